@@ -35,6 +35,8 @@ batt.py
 # ---       ?
 
 
+import asyncio
+import struct
 import threading
 import binascii
 import socket
@@ -44,18 +46,33 @@ import datetime
 import random
 import sys
 import os
+import ctrl
 import globl
+import dsmr
+import mbus
+import regmap
+import regs
 
 from typing import Optional
 from datetime import datetime
-from pymodbus.client import ModbusSerialClient
+from pymodbus.client import AsyncModbusSerialClient, AsyncModbusTcpClient
+from pymodbus.exceptions import ModbusException
 
 # -----------------------------------------------------------------
 module_name = "MRST"
 # -----------------------------------------------------------------
 
-MODBUS_DEVICE = "/dev/ttyUSB0"
+MODBUS_DEVICE = "/dev/ttyUSB0"     # --- or "tcp:host:port" for RTU over TCP (e.g. the simulator: python mrstsim.py tcp)
 MODBUS_BAUD = 115200
+MODBUS_TIMEOUT = 0.5        # --- per-request timeout in seconds (a stalled read never blocks the whole cycle)
+MODBUS_READ_GAP = 32        # --- max unused registers read to join two blocks (~break-even with one request overhead at 115200)
+MODBUS_READ_MAX = 64        # --- max registers in one read request (Modbus limit is 125)
+MODBUS_SLOW_CYCLES = 5      # --- slow register blocks are read every N cycles
+MODBUS_EXPORT_CYCLES = 30   # --- bus statistics are handed to the exporters every N cycles
+
+# --- Poll tiers by group abbreviation, all other groups are slow
+MODBUS_POLL_FAST = ("DC", "AC", "IS", "IV", "PW")       # --- control loop: power, SoC, inverter state and setpoints
+MODBUS_POLL_STATIC = ("DN", "FW", "SN", "UI")           # --- never change: read once per connection
 
 # -----------------------------------------------------------------
 # --- Index MODBUS registers/groups for Marstek Venus E V20 -------
@@ -117,86 +134,15 @@ MRST_MAX_DISCHARGE_PWR = 73 #  44003 1 u16 1W
 # --- MARSTEK MODBUS REGISTERS --- Marstek Venus E V20 ------------------------ 
 # -----------------------------------------------------------------
 
-r_value = 0
-w_value = 0
-con_value = 0
-
-MARSTEK_MODBUS = [
-["INDX","NAME","ADDR","ABBR","BLCK","OFFSET","MODE","TYPE","RVAL","WVAL","GAIN","CONV","UNIT","DESC"],
-[1,"MRST_DEVICE_NAME",31000,"DN",10,0,"R","c",r_value,w_value,1,con_value," ",""],
-[2,"MRST_DEVICE_NAME",31001,"DN",0,1,"R","c",r_value,w_value,1,con_value," ",""],
-[3,"MRST_DEVICE_NAME",31002,"DN",0,2,"R","c",r_value,w_value,1,con_value," ",""],
-[4,"MRST_DEVICE_NAME",31003,"DN",0,3,"R","c",r_value,w_value,1,con_value," ",""],
-[5,"MRST_DEVICE_NAME",31004,"DN",0,4,"R","c",r_value,w_value,1,con_value," ",""],
-[6,"MRST_DEVICE_NAME",31005,"DN",0,5,"R","c",r_value,w_value,1,con_value," ",""],
-[7,"MRST_DEVICE_NAME",31006,"DN",0,6,"R","c",r_value,w_value,1,con_value," ",""],
-[8,"MRST_DEVICE_NAME",31007,"DN",0,7,"R","c",r_value,w_value,1,con_value," ",""],
-[9,"MRST_DEVICE_NAME",31008,"DN",0,8,"R","c",r_value,w_value,1,con_value," ",""],
-[10,"MRST_DEVICE_NAME",31009,"DN",0,9,"R","c",r_value,w_value,1,con_value," ",""],
-[11,"MRST_FW_VERSION",31100,"FW",1,0,"R","u",r_value,w_value,0.01,con_value," ",""],
-[12,"MRST_SERIAL_NUM",31200,"SN",10,0,"R","c",r_value,w_value,1,con_value," ",""],
-[13,"MRST_SERIAL_NUM",31201,"SN",0,1,"R","c",r_value,w_value,1,con_value," ",""],
-[14,"MRST_SERIAL_NUM",31202,"SN",0,2,"R","c",r_value,w_value,1,con_value," ",""],
-[15,"MRST_SERIAL_NUM",31203,"SN",0,3,"R","c",r_value,w_value,1,con_value," ",""],
-[16,"MRST_SERIAL_NUM",31204,"SN",0,4,"R","c",r_value,w_value,1,con_value," ",""],
-[17,"MRST_SERIAL_NUM",31205,"SN",0,5,"R","c",r_value,w_value,1,con_value," ",""],
-[18,"MRST_SERIAL_NUM",31206,"SN",0,6,"R","c",r_value,w_value,1,con_value," ",""],
-[19,"MRST_SERIAL_NUM",31207,"SN",0,7,"R","c",r_value,w_value,1,con_value," ",""],
-[20,"MRST_SERIAL_NUM",31208,"SN",0,8,"R","c",r_value,w_value,1,con_value," ",""],
-[21,"MRST_SERIAL_NUM",31209,"SN",0,9,"R","c",r_value,w_value,1,con_value," ",""],
-[22,"MRST_DC_VOLT",32100,"DC",6,0,"R","u",r_value,w_value,0.01,con_value,"V",""],
-[23,"MRST_DC_CURR",32101,"DC",0,1,"R","s",r_value,w_value,0.01,con_value,"A",""],
-[24,"MRST_DC_PWR_DIR",32102,"DC",0,2,"R","s",r_value,w_value,1,con_value,"W","pos is charge"],
-[25,"MRST_DC_PWR_VAL",32103,"DC",0,3,"R","s",r_value,w_value,1,con_value,"W","pos is charge"],
-[26,"MRST_DC_SOC",32104,"DC",0,4,"R","u",r_value,w_value,1,con_value,"%",""],
-[27,"MRST_DC_TOT_ENRG",32105,"DC",0,5,"R","u",r_value,w_value,0.01,con_value,"kWh",""],
-[28,"MRST_AC_VOLT",32200,"AC",5,0,"R","u",r_value,w_value,0.1,con_value,"V",""],
-[29,"MRST_AC_CURR",32201,"AC",0,1,"R","u",r_value,w_value,0.01,con_value,"A",""],
-[30,"MRST_AC_PWR_DIR",32202,"AC",0,2,"R","s",r_value,w_value,1,con_value,"W","pos is discharge"],
-[31,"MRST_AC_PWR_VAL",32203,"AC",0,3,"R","s",r_value,w_value,1,con_value,"W","pos is discharge"],
-[32,"MRST_AC_FREQ",32204,"AC",0,4,"R","u",r_value,w_value,0.01,con_value,"Hz",""],
-[33,"MRST_BACKUP_VOLT",32300,"BU",4,0,"R","u",r_value,w_value,0.1,con_value,"V",""],
-[34,"MRST_BACKUP_CURR",32301,"BU",0,1,"R","u",r_value,w_value,0.01,con_value,"A",""],
-[35,"MRST_BACKUP_PWR_DIR",32302,"BU",0,2,"R","s",r_value,w_value,1,con_value,"W","pos is discharge"],
-[36,"MRST_BACKUP_PWR_VAL",32303,"BU",0,3,"R","s",r_value,w_value,1,con_value,"W","pos is discharge"],
-[37,"MRST_TOT_CHARGED_H",33000,"ST",12,0,"R","u",r_value,w_value,0.01,con_value,"kWh",""],
-[38,"MRST_TOT_CHARGED_L",33001,"ST",0,1,"R","u",r_value,w_value,0.01,con_value,"kWh",""],
-[39,"MRST_TOT_DISCHARGED_H",33002,"ST",0,2,"R","u",r_value,w_value,0.01,con_value,"kWh",""],
-[40,"MRST_TOT_DISCHARGED_L",33003,"ST",0,3,"R","u",r_value,w_value,0.01,con_value,"kWh",""],
-[41,"MRST_DAY_CHARGED_H",33004,"ST",0,4,"R","u",r_value,w_value,0.01,con_value,"kWh",""],
-[42,"MRST_DAY_CHARGED_L",33005,"ST",0,5,"R","u",r_value,w_value,0.01,con_value,"kWh",""],
-[43,"MRST_DAY_DISCHARGED_H",33006,"ST",0,6,"R","u",r_value,w_value,0.01,con_value,"kWh",""],
-[44,"MRST_DAY_DISCHARGED_L",33007,"ST",0,7,"R","u",r_value,w_value,0.01,con_value,"kWh",""],
-[45,"MRST_MNT_CHARGED_H",33008,"ST",0,8,"R","u",r_value,w_value,0.01,con_value,"kWh",""],
-[46,"MRST_MNT_CHARGED_L",33009,"ST",0,9,"R","u",r_value,w_value,0.01,con_value,"kWh",""],
-[47,"MRST_MNT_DISCHARGED_H",33010,"ST",0,10,"R","u",r_value,w_value,0.01,con_value,"kWh",""],
-[48,"MRST_MNT_DISCHARGED_L",33011,"ST",0,11,"R","u",r_value,w_value,0.01,con_value,"kWh",""],
-[49,"MRST_INT_TEMP",35000,"TP",3,0,"R","u",r_value,w_value,0.1,con_value,"°C",""],
-[50,"MRST_MOS1_TEMP",35001,"TP",0,1,"R","u",r_value,w_value,0.1,con_value,"°C",""],
-[51,"MRST_MOS2_TEMP",35002,"TP",0,2,"R","u",r_value,w_value,0.1,con_value,"°C",""],
-[52,"MRST_MAX_CELL_TEMP",35010,"CT",2,0,"R","u",r_value,w_value,0.1,con_value,"°C",""],
-[53,"MRST_MIN_CELL_TEMP",35011,"CT",0,1,"R","u",r_value,w_value,0.1,con_value,"°C",""],
-[54,"MRST_GET_INV_STATE",35100,"IS",1,0,"R","u",r_value,w_value,1,con_value," ","0:slp,1:stby,2:chrg,3:disc,4:bkp,5"],
-[55,"MRST_LIMIT_VOLT",35110,"LT",3,0,"R","u",r_value,w_value,100,con_value,"mv",""],
-[56,"MRST_LIMIT_CHARGE_CURR",35111,"LT",0,1,"R","u",r_value,w_value,100,con_value,"ma",""],
-[57,"MRST_LIMIT_DISCHARG_CURR",35112,"LT",0,2,"R","u",r_value,w_value,100,con_value,"ma",""],
-[58,"MRST_ALARM",36000,"AL",1,0,"R","b",r_value,w_value,1,con_value," ","Alarm register"],
-[59,"MRST_FAULT_LSB",36100,"FT",2,0,"R","b",r_value,w_value,1,con_value," ","Fault double register"],
-[60,"MRST_FAULT_MSB",36101,"FT",0,1,"R","b",r_value,w_value,1,con_value," ","Fault double register"],
-[61,"MRST_RESTART",41000,"RS",1,0,"RW","u",r_value,w_value,1,con_value," ","0x55AA-->restart"],
-[62,"MRST_UNIT_ID",41100,"UI",1,0,"RW","u",r_value,w_value,1,con_value," ","unit id [1..255]"],
-[63,"MRST_BACKUP",41200,"BK",1,0,"RW","u",r_value,w_value,1,con_value," ","0:enable, 1:disbale"],
-[64,"MRST_RTU_MODE",42000,"RM",1,0,"RW","u",r_value,w_value,1,con_value," ","ON:0x55AA, OFF: 0x55BB"],
-[65,"MRST_SET_INV_STATE",42010,"IV",2,0,"RW","u",r_value,w_value,1,con_value," ","0:stop,1:charge,2:discharge"],
-[66,"MRST_CHARGE_TO_SOC",42011,"IV",0,1,"RW","u",r_value,w_value,0.01,con_value," ","charge to target SOC"],
-[67,"MRST_PWR_CHARGE",42020,"PW",2,0,"RW","u",r_value,w_value,1,con_value,"W","range:[0..2500W]"],
-[68,"MRST_PWR_DISCHARGE",42021,"PW",0,1,"RW","u",r_value,w_value,1,con_value,"W","range:[0..2500W]"],
-[69,"MRST_USER_MODE",43000,"UM",1,0,"RW","u",r_value,w_value,1,con_value," ","0:manual,1:anti-feed,2:trade-mode"],
-[70,"MRST_CHARGE_CUTOFF",44000,"CO",4,0,"RW","u",r_value,w_value,0.1,con_value,"%","range:[80%..100%]"],
-[71,"MRST_DISCHARGE_CUTOFF",44001,"CO",0,1,"RW","u",r_value,w_value,0.1,con_value,"%","range:[12%..30%]"],
-[72,"MRST_MAX_CHARGE_PWR",44002,"CO",0,2,"RW","u",r_value,w_value,1,con_value,"W","range:[0..2500W]"],
-[73,"MRST_MAX_DISCHARGE_PWR",44003,"CO",0,3,"RW","u",r_value,w_value,1,con_value,"W","range:[0..2500W]"]
-]
+# --- The register map is compiled from the EMS dictionary (ems_dict_vXX.xlsx, sheet MARSTEK_MODBUS)
+# --- into a pickled artifact by regmap.py, MRST_FW_VERSION selects the dictionary after the first read
+MRST_DICTIONARY = regmap.REGMAP_DEFAULT
+
+# --- The register values live in one array-backed store (globl.MRST_STORE, shared with the CLI)
+# --- MARSTEK_MODBUS is a list-of-lists view on it: MARSTEK_MODBUS[row][IDXM_*]
+globl.MRST_STORE.load(regmap.load_register_map(MRST_DICTIONARY))
+MRST_STORE = globl.MRST_STORE
+MARSTEK_MODBUS = regs.RegisterTable(MRST_STORE)
 
 # --- Index for MARSTEK VENUS E fields ---- 
 IDXM_INDX = 0   # - Index number in list 
@@ -214,94 +160,192 @@ IDXM_CONV = 11  # - Converted Value (adjusted for gain)
 IDXM_UNIT = 12  # - Unit
 IDXM_DESC = 13  # - Description
 
+# --- Setpoint writes within the deadband of the last confirmed value are skipped (row name --> raw register units)
+MRST_WRITE_DEADBAND = {
+    "MRST_PWR_CHARGE": 10,      # --- 10W
+    "MRST_PWR_DISCHARGE": 10,   # --- 10W
+}
+
+# --- 32-bit values: two registers, high word first (row name of the high word --> type)
+# --- the combined value is stored in IDXM_CONV of both rows
+MRST_WORD_PAIRS = {
+    "MRST_DC_PWR_DIR": "s32", "MRST_AC_PWR_DIR": "s32", "MRST_BACKUP_PWR_DIR": "s32",
+    "MRST_TOT_CHARGED_H": "u32", "MRST_TOT_DISCHARGED_H": "u32",
+    "MRST_DAY_CHARGED_H": "u32", "MRST_DAY_DISCHARGED_H": "u32",
+    "MRST_MNT_CHARGED_H": "u32", "MRST_MNT_DISCHARGED_H": "u32",
+}
+
+def marstek_write_deadbands(): # --- register address --> deadband
+    return {MRST_STORE.addr[MRST_STORE.index[name]]: deadband for name, deadband in MRST_WRITE_DEADBAND.items()}
+
+# --- Last value confirmed per writable register (written or read back)
+write_cache = mbus.WriteCache(marstek_write_deadbands())
+
+# --- Setpoint range of MRST_PWR_CHARGE / MRST_PWR_DISCHARGE
+SETPOINT_MAX_PWR = 2500    # --- W
+SETPOINT_RAW_MAX = 0xFFFF  # --- a register holds one 16-bit word, larger or negative values can not be encoded
+
+# --- NOM controller, keeps its state between control ticks (restarts from the device setpoint after a pause)
+nom_controller = ctrl.PIDController(**ctrl.CTRL_NOM_TUNING)
+
+# --- PHS (per phase balance): the battery balances its own phase and keeps that phase within the main fuse
+PHASE_BATT = 1              # --- phase the battery is connected to (1..3)
+PHASE_FUSE = 25             # --- A, main fuse per phase
+PHASE_FUSE_MARGIN = 2       # --- A, kept free below the fuse
+phs_controller = ctrl.PIDController(**ctrl.CTRL_PHS_TUNING)
+
+# --- ZPV controller: charge power from the export, the gate switches the inverter between charge and stop
+zpv_controller = ctrl.PIDController(**ctrl.CTRL_ZPV_TUNING)
+zpv_gate = ctrl.StateGate(ctrl.CTRL_ZPV_START, ctrl.CTRL_ZPV_HOLD)
+
+# --- Stale data guard of the modes following the meter: estimate on a late telegram, ramp to 0 W without data
+stale_guard = ctrl.StaleGuard(ctrl.CTRL_FRESHNESS, ctrl.CTRL_ESTIMATE_TIME, ctrl.CTRL_FALLBACK_RAMP)
+
 
 # -----------------------------------------------------------------------------------------
 # --- BATT thread -----------------------------------------------------------------------
 # -----------------------------------------------------------------------------------------
 
-def copy_marstek_to_batt(): 
-    
-    # --- Clear Device Name in BATT REG LIST : AC01..............
-    globl.BATT_REGISTERS[globl.BATT_DEVICE_NAME][globl.IDXB_GVAL] = "" # clear string
-    # --- Copy the Device Name block 10x --> 20 characters (bytes)
-    for idxm in range(MRST_DEVICE_NAME, MARSTEK_MODBUS[MRST_DEVICE_NAME][IDXM_BLCK] + MRST_DEVICE_NAME): # + 1
-        globl.BATT_REGISTERS[globl.BATT_DEVICE_NAME][globl.IDXB_GVAL] += MARSTEK_MODBUS[idxm][IDXM_CONV] # --- append str
-
-    #--- Copy MRST_FW_VERSION
-    globl.BATT_REGISTERS[globl.BATT_FW_VERSION][globl.IDXB_GVAL] = MARSTEK_MODBUS[MRST_FW_VERSION][IDXM_CONV]
-
-    # --- Clear Serial Number in BATT REG LIST
-    globl.BATT_REGISTERS[globl.BATT_SERIAL_NUM][globl.IDXB_GVAL] = "" # clear string
-    # --- Copy the Serial Number block 10x --> 20 characters (bytes)
-    for idxm in range(MRST_SERIAL_NUM, MARSTEK_MODBUS[MRST_SERIAL_NUM][IDXM_BLCK] + MRST_SERIAL_NUM ): # + 1
-        globl.BATT_REGISTERS[globl.BATT_SERIAL_NUM][globl.IDXB_GVAL] += MARSTEK_MODBUS[idxm][IDXM_CONV] # --- append str
-
-    # Now copy all converterd value registers 1 on 1 until MRST_TOT_CHARGED (2 regs)
-    for idxm in range(MRST_DC_VOLT, MRST_BACKUP_PWR_VAL + 1):
-        #--- Copy regs incl offset BATT REG (3) vs MARST_MODBUS (22) (22-3=19)
-        offset = MRST_DC_VOLT - globl.BATT_DC_VOLT 
-        globl.BATT_REGISTERS[idxm-offset][globl.IDXB_GVAL] = MARSTEK_MODBUS[idxm][IDXM_CONV]
-   
-    #--- Copy BATT_TOT_CHARGED -- Because these registers consist of 2 words...
-    #globl.BATT_REGISTERS[globl.BATT_TOT_CHARGED][globl.IDXB_GVAL] = (MARSTEK_MODBUS[MRST_TOT_CHARGED_H][IDXM_CONV] + MARSTEK_MODBUS[MRST_TOT_CHARGED_L][IDXM_CONV]) * MARSTEK_MODBUS[MRST_TOT_CHARGED_L][IDXM_GAIN]
-    #globl.BATT_REGISTERS[globl.BATT_TOT_DISCHARGED][globl.IDXB_GVAL] = (MARSTEK_MODBUS[MRST_TOT_DISCHARGED_H][IDXM_CONV] + MARSTEK_MODBUS[MRST_TOT_DISCHARGED_L][IDXM_CONV]) * MARSTEK_MODBUS[MRST_TOT_DISCHARGED_L][IDXM_GAIN]
-    #globl.BATT_REGISTERS[globl.BATT_TOT_CHARGED][globl.IDXB_GVAL] = "n.a."
-    #globl.BATT_REGISTERS[globl.BATT_TOT_DISCHARGED][globl.IDXB_GVAL] = "n.a."
-    #globl.BATT_REGISTERS[globl.BATT_DAY_CHARGED][globl.IDXB_GVAL] = "n.a."
-    #globl.BATT_REGISTERS[globl.BATT_DAY_DISCHARGED][globl.IDXB_GVAL] = "n.a."
-    #globl.BATT_REGISTERS[globl.BATT_MNT_CHARGED][globl.IDXB_GVAL] = "n.a."
-    #globl.BATT_REGISTERS[globl.BATT_MNT_DISCHARGED][globl.IDXB_GVAL] = "n.a."
-    
-    # Now copy all remaining registers until the end of the list
-    for idxm in range(MRST_INT_TEMP, MRST_MAX_DISCHARGE_PWR + 1):
-        #--- Copy regs incl offset BATT REG (24) vs MARST_MODBUS (49) (49-24=25)
-        offset = MRST_INT_TEMP - globl.BATT_INT_TEMP
-        globl.BATT_REGISTERS[idxm-offset][globl.IDXB_GVAL] = MARSTEK_MODBUS[idxm][IDXM_CONV]
-    
 # -----------------------------------------------------------------------------------------
-# --- Convert all modbus register values in the MARSTEK_MODBUS list object CON_VALUE ------
+# --- Decode plan: convert the raw words of a register block into IDXM_CONV ---------------
 # -----------------------------------------------------------------------------------------
 
-def convert_modbus_registers():
-
-    global MARSTEK_MODBUS
-
-    # --- Loop through all the values in MARSTEK_MODBUS
-    for reg_index in range(1, len(MARSTEK_MODBUS)): # --- start with 1 becaue of the header
-        # --- Copy to local reg for ease of use
-        reg_name = MARSTEK_MODBUS[reg_index][IDXM_NAME]
-        reg_type = MARSTEK_MODBUS[reg_index][IDXM_TYPE]
-        reg_rval = MARSTEK_MODBUS[reg_index][IDXM_RVAL]
-        reg_gain = MARSTEK_MODBUS[reg_index][IDXM_GAIN]
-        reg_unit = MARSTEK_MODBUS[reg_index][IDXM_UNIT]
-        # --- In case of binary error/fault register show bits
-        if reg_type == "b":
-            MARSTEK_MODBUS[reg_index][IDXM_CONV] = reg_rval
-        # --- In case of a char string register value
-        elif reg_type == "c":
-            byte_high = (reg_rval >> 8) & 0xFF
-            if byte_high < 33 or byte_high > 126: byte_high = 46 # --> "."
-            byte_low  = reg_rval & 0xFF
-            if byte_low < 33 or byte_low > 126: byte_low = 46 # --> "."
-            MARSTEK_MODBUS[reg_index][IDXM_CONV] = chr(byte_high) + chr(byte_low)
-        # --- In case of an un signed register value
-        elif reg_type == "u":
-            MARSTEK_MODBUS[reg_index][IDXM_CONV] = reg_rval * reg_gain
-        # --- In case of a signed register value
-        elif reg_type == "s":
-            if reg_rval > 0x7FFF: reg_rval -= 0x10000 # subtrackt to get negative value
-            MARSTEK_MODBUS[reg_index][IDXM_CONV] = reg_rval * reg_gain
-        else:
-            MARSTEK_MODBUS[reg_index][IDXM_CONV] = reg_rval * reg_gain
-    
+# --- struct codes per register type: "u" unsigned, "s" signed, "b" bits (2 chars per "c" register)
+DECODE_STRUCT = {"u": "H", "s": "h", "b": "H", "u32": "I", "s32": "i"}
+# --- chars outside the printable range (33..126) are shown as "."
+DECODE_CHARS = bytes(byte if 33 <= byte <= 126 else 46 for byte in range(256))
+
+class BlockDecoder:
+    """Decode plan of one register block, compiled once from the register map.
+    The raw words are packed and unpacked with one precompiled struct per block;
+    numbers: (field, first row, rows, gain) and chars: (field, first row, rows), written to the register store"""
+
+    __slots__ = ("words", "layout", "numbers", "chars")
+
+    def __init__(self, reg_block):
+        reg_count = MRST_STORE.blck[reg_block]
+        codes = []
+        self.numbers = []
+        self.chars = []
+        reg_index = reg_block
+        while reg_index < reg_block + reg_count:
+            reg_type = MRST_STORE.type[reg_index]
+            pair_type = MRST_WORD_PAIRS.get(MRST_STORE.name[reg_index])
+            if reg_type == "c":
+                # --- run of char registers --> one bytes field
+                count = 1
+                while reg_index + count < reg_block + reg_count and MRST_STORE.type[reg_index + count] == "c":
+                    count += 1
+                self.chars.append((len(codes), reg_index, count))
+                codes.append(f"{count * 2}s")
+            else:
+                count = 2 if pair_type is not None else 1
+                reg_gain = 1 if reg_type == "b" else MRST_STORE.gain[reg_index]    # --- bits are shown as is
+                self.numbers.append((len(codes), reg_index, count, reg_gain))
+                codes.append(DECODE_STRUCT[pair_type or reg_type])
+            reg_index += count
+        self.words = struct.Struct(f">{reg_count}H")        # --- raw words --> bytes (big endian, as on the wire)
+        self.layout = struct.Struct(">" + "".join(codes))   # --- bytes --> typed values
+
+    def decode(self, registers):
+        values = self.layout.unpack(self.words.pack(*registers))
+        conv = MRST_STORE.conv
+        for field, reg_index, count, reg_gain in self.numbers:
+            conv[reg_index] = value = values[field] * reg_gain
+            if count == 2:
+                conv[reg_index + 1] = value
+        text = MRST_STORE.text
+        for field, reg_index, count in self.chars:
+            chars = values[field].translate(DECODE_CHARS).decode("ascii")
+            for offset in range(count):
+                text[reg_index + offset] = chars[offset * 2:offset * 2 + 2]
+
+def compile_decode_plan(): # --- block row --> BlockDecoder for every block in the register map
+    return {reg_index: BlockDecoder(reg_index) for reg_index in range(1, len(MRST_STORE)) if MRST_STORE.blck[reg_index] > 0}
+
+MRST_DECODE_PLAN = compile_decode_plan()
+
+def decode_register_block(reg_block): # --- Decode a block from the raw words (IDXM_RVAL) of its rows
+    MRST_DECODE_PLAN[reg_block].decode(MRST_STORE.rval[reg_block:reg_block + MRST_STORE.blck[reg_block]])
+    MRST_STORE.stamp[reg_block] = time.monotonic()
+
 # -----------------------------------------------------------------------------------------
 
-def copy_modbus_register_block(result, register_block): # --- Copy the register block (#regs)
-    # --- Copy all modbus register values to MARSTEK_MODBUS list object READ_VALUE
-    #global MARSTEK_MODBUS
-    for reg_index in range(0, len(result.registers)): # --- start with 0 
-        MARSTEK_MODBUS[register_block+reg_index][IDXM_RVAL] = result.registers[MARSTEK_MODBUS[register_block+reg_index][IDXM_OFFS]]
-                
+def copy_modbus_register_span(registers, span): # --- Copy every register block read by one span into the register store
+    rval = MRST_STORE.rval
+    now = time.monotonic()
+    for reg_block, reg_addr, reg_count in span.blocks:
+        base = reg_addr - span.addr     # --- position of the block in the span
+        for reg_index in range(reg_block, reg_block + reg_count):
+            rval[reg_index] = registers[base + MRST_STORE.offs[reg_index]]
+            if MRST_STORE.mode[reg_index] == "RW": # --- the device value is the confirmed value
+                write_cache.confirm(MRST_STORE.addr[reg_index], rval[reg_index])
+        # --- Convert only the blocks that were read
+        MRST_DECODE_PLAN[reg_block].decode(registers[base:base + reg_count])
+        MRST_STORE.stamp[reg_block] = now
+
+def marstek_row_constants(): # --- MRST_xxx = row constants used by the control code
+    return {name: value for name, value in globals().items() if name.startswith("MRST_") and type(value) is int}
+
+# --- The control code addresses rows by MRST_xxx constants: every constant needs a row of that name
+# --- in the default map, the values written above are the rows of the default map
+map_mismatch = regmap.check_register_map(MRST_STORE.name, marstek_row_constants())
+if map_mismatch:
+    raise ValueError(f"{MRST_DICTIONARY} does not match {', '.join(map_mismatch)}")
+globals().update(regmap.resolve_register_map(MRST_STORE.name, marstek_row_constants()))
+
+def select_register_map(): # --- After the first read: load the dictionary that fits MRST_FW_VERSION, True when the map changed
+    global MRST_DICTIONARY, MRST_DECODE_PLAN
+    fw_version = MRST_STORE.value(MRST_FW_VERSION)
+    if not fw_version:  # --- version block not read (yet)
+        return False
+    dictionary = regmap.select_dictionary(fw_version)
+    if dictionary == MRST_DICTIONARY:
+        return False
+    rows = regmap.load_register_map(dictionary)
+    names = [row[IDXM_NAME] for row in rows]
+    mismatch = regmap.check_register_map(names, marstek_row_constants())
+    if mismatch:
+        globl.log_debug(module_name, f"Firmware {fw_version}: {dictionary} does not match {', '.join(mismatch)}, keeping {MRST_DICTIONARY}")
+        return False
+    globl.log_debug(module_name, f"Firmware {fw_version}: register map {MRST_DICTIONARY} --> {dictionary}")
+    MRST_STORE.load(rows)
+    globals().update(regmap.resolve_register_map(names, marstek_row_constants()))   # --- MRST_xxx --> rows of this map
+    MRST_DICTIONARY = dictionary
+    MRST_DECODE_PLAN = compile_decode_plan()
+    write_cache.deadbands = marstek_write_deadbands()
+    write_cache.clear()
+    return True
+
+# -----------------------------------------------------------------------------------------
+
+def marstek_register_blocks(): # --- (row, address, count) of every block in MARSTEK_MODBUS
+    return [(reg_index, MARSTEK_MODBUS[reg_index][IDXM_ADDR], MARSTEK_MODBUS[reg_index][IDXM_BLCK])
+            for reg_index in range(1, len(MARSTEK_MODBUS)) if MARSTEK_MODBUS[reg_index][IDXM_BLCK] > 0]
+
+def marstek_poll_tiers(): # --- [(period, spans), ...] fast, static and slow blocks, each tier merged into few requests
+    fast_blocks, static_blocks, slow_blocks = [], [], []
+    for reg_block in marstek_register_blocks():
+        reg_abbr = MARSTEK_MODBUS[reg_block[0]][IDXM_ABBR]
+        if reg_abbr in MODBUS_POLL_FAST: fast_blocks.append(reg_block)
+        elif reg_abbr in MODBUS_POLL_STATIC: static_blocks.append(reg_block)
+        else: slow_blocks.append(reg_block)
+    return [(1, mbus.plan_reads(fast_blocks, MODBUS_READ_GAP, MODBUS_READ_MAX)),
+            (mbus.POLL_ONCE, mbus.plan_reads(static_blocks, MODBUS_READ_GAP, MODBUS_READ_MAX)),
+            (MODBUS_SLOW_CYCLES, mbus.plan_reads(slow_blocks, MODBUS_READ_GAP, MODBUS_READ_MAX))]
+
+def marstek_bus_requests(poll_scheduler): # --- (function, address) of every request the plan can put on the bus
+    requests = []
+    for entry in poll_scheduler.entries:
+        for span in entry.spans:
+            requests.append((mbus.FC_READ, span.addr))
+            requests.extend((mbus.FC_READ, addr) for _, addr, _ in span.blocks)  # --- after a split of the span
+    for reg_index in range(1, len(MARSTEK_MODBUS)):
+        if MARSTEK_MODBUS[reg_index][IDXM_MODE] == "RW": # --- setpoint write (one or more registers) and its read back
+            reg_addr = MARSTEK_MODBUS[reg_index][IDXM_ADDR]
+            requests.extend(((mbus.FC_WRITE, reg_addr), (mbus.FC_WRITE_MANY, reg_addr), (mbus.FC_READ, reg_addr)))
+    return requests
+
 # -----------------------------------------------------------------------------------------
 
 def print_modbus_registers(): # --- Print all registers in MARSTEK_MODBUS
@@ -346,371 +390,538 @@ def print_modbus_registers(): # --- Print all registers in MARSTEK_MODBUS
 
     
 # -----------------------------------------------------------------------------------------
-# --- BATT thread -----------------------------------------------------------------------
+# --- Modbus bus requests -----------------------------------------------------------------
 # -----------------------------------------------------------------------------------------
 
-def batt_thread_fn(batt_stop_event: threading.Event, interval: float = 2.0):
-    
-    cntr = 0
-    unit_id=1
-    max_charge_pwr = 1600
+def submit_modbus_reads(bus, poll_entries): # --- Queue a read for every span, returns [(entry, span, future), ...]
+    return [(entry, span, bus.read(span.addr, span.count)) for entry in poll_entries for span in entry.spans]
+
+async def complete_modbus_reads(bus, reads): # --- Wait for the queued reads and copy the registers
+    for entry, span, future in reads:
+        try:
+            result = await future
+        except (asyncio.TimeoutError, ModbusException) as e:
+            globl.log_debug(module_name, f"Read error span {span.addr}+{span.count}: {e!r}")
+            continue
+        if result.isError():
+            if len(span.blocks) > 1:
+                # --- The device rejects the span (e.g. unmapped registers in a gap), read these blocks one by one from now on
+                globl.log_debug(module_name, f"Read error span {span.addr}+{span.count}, split into {len(span.blocks)} blocks: {result}")
+                split_spans = mbus.split_span(span)
+                span_index = entry.spans.index(span)
+                entry.spans[span_index:span_index + 1] = split_spans
+                await complete_modbus_reads(bus, [(entry, split, bus.read(split.addr, split.count)) for split in split_spans])
+                continue
+            globl.log_debug(module_name, f"Read error: {result}")
+        else: # copy modbus registers in MARSTEK_MODBUS list object
+            copy_modbus_register_span(result.registers, span)
+
+def setpoint_in_range(reg_index, value): # --- The raw value fits the register (checked before it is encoded)
+    if isinstance(value, int) and 0 <= value <= SETPOINT_RAW_MAX:
+        return True
+    globl.log_debug(module_name, f"Setpoint {MARSTEK_MODBUS[reg_index][IDXM_NAME]} out of range: {value!r}")
+    return False
+
+async def write_marstek_register(bus, reg_index, value, force=False): # --- Write one register, returns True when the device holds the value
+    # --- Skip the write when the device already holds the value (within the deadband), unless forced (commands like restart)
+    reg_addr = MARSTEK_MODBUS[reg_index][IDXM_ADDR]
+    if not setpoint_in_range(reg_index, value):
+        return False
+    if not force and not write_cache.needed(reg_addr, value):
+        return True
+    try:
+        result = await bus.write(reg_addr, value)
+    except asyncio.CancelledError:
+        return False    # --- replaced by a newer write to the same register
+    except Exception as e:  # --- timeout, Modbus or encoding error: the device state is unknown
+        globl.log_debug(module_name, f"Write error {MARSTEK_MODBUS[reg_index][IDXM_NAME]}: {e!r}")
+        write_cache.forget(reg_addr)
+        return False
+    if result.isError():
+        globl.log_debug(module_name, f"Write error: {result}")
+        write_cache.forget(reg_addr)
+        return False
+    write_cache.written += 1
+    write_cache.confirm(reg_addr, value)
+    return True
+
+class MarstekSetpoints:
+    """Setpoints collected during one control tick and committed as one transaction:
+    one write per register block (function 0x10 for 2+ registers), queued back to back, then read back and verified.
+    A value out of the register range is dropped by set(); when any write or read back of the transaction fails,
+    none of its registers stays confirmed in the write cache (the next tick writes them all again)"""
+
+    def __init__(self):
+        self.changes = {}   # --- reg_index --> raw value
+        self.acked = None   # --- time.monotonic() of the last acknowledged write (None: nothing written)
+
+    def set(self, reg_index, value):
+        if setpoint_in_range(reg_index, value):
+            self.changes[reg_index] = value
+
+    def write_runs(self, force=False):
+        # --- [(first reg_index, [values]), ...] per block: from the first to the last changed register of the block
+        # --- registers in between keep their confirmed (or last read) value
+        block_indexes = {}
+        for reg_index, value in sorted(self.changes.items()):
+            if force or write_cache.needed(MARSTEK_MODBUS[reg_index][IDXM_ADDR], value):
+                block_indexes.setdefault(reg_index - MARSTEK_MODBUS[reg_index][IDXM_OFFS], []).append(reg_index)
+        runs = []
+        for indexes in block_indexes.values():
+            values = []
+            for reg_index in range(indexes[0], indexes[-1] + 1):
+                if reg_index in self.changes:
+                    values.append(self.changes[reg_index])
+                else:
+                    values.append(write_cache.confirmed.get(MARSTEK_MODBUS[reg_index][IDXM_ADDR], MARSTEK_MODBUS[reg_index][IDXM_RVAL]))
+            runs.append((indexes[0], values))
+        return runs
+
+    def forget_run(self, first, values):
+        for reg_index in range(first, first + len(values)):
+            write_cache.forget(MARSTEK_MODBUS[reg_index][IDXM_ADDR])
+
+    async def commit(self, bus, force=False, verify=True): # --- Returns True when the device holds all setpoints
+        runs = self.write_runs(force)
+        self.changes = {}
+        if not runs:
+            return True
+        committed = True
+        # --- All writes are queued at once (in address order, so RTU mode 42000 goes first), reads can not get in between
+        writes = []
+        for first, values in runs:
+            reg_addr = MARSTEK_MODBUS[first][IDXM_ADDR]
+            writes.append((first, values, bus.write_many(reg_addr, values) if len(values) > 1 else bus.write(reg_addr, values[0])))
+        verify_reads = []
+        for first, values, future in writes:
+            try:
+                result = await future
+            except asyncio.CancelledError:
+                committed = False   # --- replaced by a newer write
+                continue
+            except Exception as e:  # --- timeout, Modbus or encoding error: handled here, not by a reconnect
+                result = e
+            if isinstance(result, Exception) or result.isError():
+                globl.log_debug(module_name, f"Write error {MARSTEK_MODBUS[first][IDXM_NAME]} +{len(values)}: {result!r}")
+                self.forget_run(first, values)
+                committed = False
+                continue
+            write_cache.written += 1
+            self.acked = time.monotonic()
+            for offset, value in enumerate(values):
+                write_cache.confirm(MARSTEK_MODBUS[first + offset][IDXM_ADDR], value)
+            if verify:
+                verify_reads.append((first, values, bus.read(MARSTEK_MODBUS[first][IDXM_ADDR], len(values), priority=mbus.BUS_WRITE)))
+        # --- Read back: the device must report the written values
+        for first, values, future in verify_reads:
+            try:
+                result = await future
+            except (asyncio.CancelledError, Exception) as e:
+                result = e
+            if isinstance(result, Exception) or result.isError():
+                globl.log_debug(module_name, f"Verify read error {MARSTEK_MODBUS[first][IDXM_NAME]} +{len(values)}: {result!r}")
+                self.forget_run(first, values)
+                committed = False
+                continue
+            for offset, value in enumerate(values):
+                MARSTEK_MODBUS[first + offset][IDXM_RVAL] = result.registers[offset]
+                if result.registers[offset] != value:
+                    globl.log_debug(module_name, f"Verify error {MARSTEK_MODBUS[first + offset][IDXM_NAME]}: wrote {value}, read {result.registers[offset]}")
+                    write_cache.forget(MARSTEK_MODBUS[first + offset][IDXM_ADDR])
+                    committed = False
+            decode_register_block(first - MARSTEK_MODBUS[first][IDXM_OFFS])
+        if not committed:
+            for first, values in runs:  # --- roll back: no register of a failed transaction stays confirmed
+                self.forget_run(first, values)
+        return committed
 
-    serial_port = MODBUS_DEVICE
-    client = ModbusSerialClient(
+# -----------------------------------------------------------------------------------------
+# --- SET MODUS / PROGRAM -----------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+def marstek_discharge_limit():
+    # --- Live discharge limit in W: setpoint range, MRST_MAX_DISCHARGE_PWR and nothing at the discharge cutoff
+    if MARSTEK_MODBUS[MRST_DC_SOC][IDXM_CONV] <= MARSTEK_MODBUS[MRST_DISCHARGE_CUTOFF][IDXM_CONV]:
+        return 0
+    return min(SETPOINT_MAX_PWR, MARSTEK_MODBUS[MRST_MAX_DISCHARGE_PWR][IDXM_CONV])
+
+def marstek_charge_limit():
+    # --- Live charge limit in W: setpoint range, MRST_MAX_CHARGE_PWR and nothing at the charge cutoff
+    if MARSTEK_MODBUS[MRST_DC_SOC][IDXM_CONV] >= MARSTEK_MODBUS[MRST_CHARGE_CUTOFF][IDXM_CONV]:
+        return 0
+    return min(SETPOINT_MAX_PWR, MARSTEK_MODBUS[MRST_MAX_CHARGE_PWR][IDXM_CONV])
+
+def mode_follows_meter():
+    # --- Modes that compute a setpoint from every new telegram
+    return globl.mode_bsld or globl.mode_nom or globl.mode_zpv or globl.mode_phs or globl.mode_peak
+
+def check_stale_data():
+    # --- Age of the grid power (HOME_PWR_TOT) and of the battery AC power; returns (state, correction W of the grid power)
+    guard_state = stale_guard.state
+    state, correction = stale_guard.check(globl.HOME_POWER[globl.HOME_PWR_TOT][globl.IDXH_TIME], MARSTEK_MODBUS[MRST_AC_PWR_VAL][IDXM_CONV], MRST_STORE.stamp_time(MRST_AC_PWR_VAL), time.monotonic())
+    if state != guard_state:
+        globl.log_debug(module_name, f"Meter / battery data {ctrl.GUARD_STATES[guard_state]} --> {ctrl.GUARD_STATES[state]}")
+    return state, correction
+
+def ramp_setpoints_to_zero(setpoints, step):
+    # --- Stale data: charge and discharge power ramp to 0 W by step, then the inverter stops
+    idle = True
+    for reg_index in (MRST_PWR_CHARGE, MRST_PWR_DISCHARGE):
+        value = MARSTEK_MODBUS[reg_index][IDXM_CONV]
+        if value > step:
+            setpoints.set(reg_index, int(value - step))
+            idle = False
+        elif value > 0:
+            setpoints.set(reg_index, 0)
+    if idle and MARSTEK_MODBUS[MRST_SET_INV_STATE][IDXM_CONV] != globl.INV_STATE_STOP:
+        setpoints.set(MRST_SET_INV_STATE, globl.INV_STATE_STOP)
+
+async def run_mode_program(bus): # --- Returns the setpoints of this tick (acked: time of the write acknowledge)
+
+    setpoints = MarstekSetpoints()  # --- setpoint changes of this tick, written as one transaction
+
+    # --- Modes following the meter: no controller step on stale data
+    stale_correction = 0.0
+    if mode_follows_meter():
+        stale_state, stale_correction = check_stale_data()
+        if stale_state == ctrl.GUARD_RAMP:
+            ramp_setpoints_to_zero(setpoints, stale_guard.ramp_step())
+            await setpoints.commit(bus)
+            return setpoints
+
+    # --- MODE BASELOAD --------------------------------------
+    if globl.mode_bsld:
+        # --- Check if already in RTU mode    
+        if MARSTEK_MODBUS[MRST_RTU_MODE][IDXM_CONV] != 0x55AA: 
+            # --- Set value for MRST_RTU_MODE = 0x55AA (21930d)
+            setpoints.set(MRST_RTU_MODE, 0x55AA)
+         # --- Check if already in discharge mode : MRST_SET_INV_STATE is NOT set to discharge then...
+        inverter_state = 2  # --- discharge
+        if MARSTEK_MODBUS[MRST_SET_INV_STATE][IDXM_CONV] != inverter_state: # --- Check if already in discharge mode
+            # --- Set MRST_SET_INV_STATE to discharge
+            setpoints.set(MRST_SET_INV_STATE, inverter_state)
+
+        # ToDo: Implement BATT controller that follows the DSMR
+        home_power = globl.HOME_POWER[globl.HOME_PWR_TOT][globl.IDXH_HVAL] + stale_correction  # --- POS means power consumption (NEG = production)
+        mrst_measured_power = MARSTEK_MODBUS[MRST_AC_PWR_VAL][IDXM_CONV]  # --- POS is discharging (NEG = charging)
+        mrst_setpoint_discharge_power = MARSTEK_MODBUS[MRST_PWR_DISCHARGE][IDXM_CONV]  # --- Setpoint discharge power
+        
+        # --- Calculate the delta using proporional value only
+        mrst_delta = mrst_setpoint_discharge_power - mrst_measured_power # -- POS means ramping up and NEG means ramping down
+        print(f"HOME POWER:{home_power}; mrst_delta:{mrst_delta}; mrst_setpoint:{mrst_setpoint_discharge_power}; mrst_measured:{mrst_measured_power}")
+        new_setpoint = mrst_setpoint_discharge_power + (home_power - mrst_delta)
+        
+        #if home_power > 0:  # --- Home is consuming energy
+        #    new_setpoint = mrst_setpoint_discharge_power + (home_power - mrst_delta)
+        #elif home_power < 0:  # --- Home is producing energy
+        #    new_setpoint = mrst_setpoint_discharge_power + (home_power - mrst_delta)
+        
+        # --- Set value for MRST_PWR_DISCHARGE
+        setpoints.set(MRST_PWR_DISCHARGE, int(new_setpoint))
+        await setpoints.commit(bus)
+
+    # --- MODE MANUAL --------------------------------------
+    elif globl.mode_man:
+        # --- Restart Marstek
+        if globl.man_restart:
+            print("[MRST] Restarting Marstek Venus E V2.0 ...")
+            globl.man_restart = False
+            if await write_marstek_register(bus, MRST_RESTART, 0x55AA, force=True):
+                globl.log_debug(module_name, "Write succes: MRST_RESTART = 0x55AA")
+        elif globl.man_maxcpwr:
+            print("[MRST] Marstek SET max charging power ...")
+            globl.man_maxcpwr = False
+            max_charging_power = globl.BATT_REGISTERS[globl.BATT_MAX_CHARGE_PWR][globl.IDXB_SVAL]
+            if await write_marstek_register(bus, MRST_MAX_CHARGE_PWR, max_charging_power, force=True):
+                globl.log_debug(module_name, f"Write succes: MRST_MAX_CHARGE_PWR = {max_charging_power}")
+        elif globl.man_maxdpwr:
+            print("[MRST] Marstek SET max discharging power ...")
+            globl.man_maxdpwr = False
+            max_discharging_power = globl.BATT_REGISTERS[globl.BATT_MAX_DISCHARGE_PWR][globl.IDXB_SVAL]
+            if await write_marstek_register(bus, MRST_MAX_DISCHARGE_PWR, max_discharging_power, force=True):
+                globl.log_debug(module_name, f"Write succes: MRST_MAX_DISCHARGE_PWR = {max_discharging_power}")
+                
+                
+                
+        if False:
+            # Reset the changed flag
+            #globl.mode_changed = False
+            # --- Check if already in RTU mode
+            if MARSTEK_MODBUS[MRST_RTU_MODE][IDXM_CONV] != 0x55AA:
+                # --- Set value for MRST_RTU_MODE = 0x55AA (21930d)
+                await write_marstek_register(bus, MRST_RTU_MODE, 0x55AA)
+            # --- Set value for MRST_PWR_CHARGE
+            await write_marstek_register(bus, MRST_PWR_CHARGE, globl.set_pwr_charge)
+            # --- Set value for MRST_PWR_DISCHARGE
+            await write_marstek_register(bus, MRST_PWR_DISCHARGE, globl.set_pwr_discharge)
+            # --- Set value for MRST_SET_INV_STATE
+            await write_marstek_register(bus, MRST_SET_INV_STATE, globl.set_inv_state)
+
+    # --- MODE Nul Op de Meter --------------------------------------
+    elif globl.mode_nom :
+        # --- Check if already in RTU mode    
+        if MARSTEK_MODBUS[MRST_RTU_MODE][IDXM_CONV] != 0x55AA: 
+            # --- Set value for MRST_RTU_MODE = 0x55AA (21930d)
+            setpoints.set(MRST_RTU_MODE, 0x55AA)
+         # --- Check if already in discharge mode : MRST_SET_INV_STATE is NOT set to discharge then...
+        inverter_state = 2  # --- discharge
+        if MARSTEK_MODBUS[MRST_SET_INV_STATE][IDXM_CONV] != inverter_state: # --- Check if already in discharge mode
+            # --- Set MRST_SET_INV_STATE to discharge
+            setpoints.set(MRST_SET_INV_STATE, inverter_state)
+
+        # --- PID on the grid power (target 0 W), clamped to the live discharge limit, slew limited
+        home_power = globl.HOME_POWER[globl.HOME_PWR_TOT][globl.IDXH_HVAL] + stale_correction  # --- POS means power consumption (NEG = production)
+        mrst_measured_power = MARSTEK_MODBUS[MRST_AC_PWR_VAL][IDXM_CONV]  # --- POS is discharging (NEG = charging)
+        mrst_setpoint_discharge_power = MARSTEK_MODBUS[MRST_PWR_DISCHARGE][IDXM_CONV]  # --- Setpoint discharge power
+        mrst_discharge_limit = marstek_discharge_limit()
+        new_setpoint = nom_controller.update(home_power, mrst_measured_power + home_power, 0, mrst_discharge_limit, time.monotonic(), mrst_setpoint_discharge_power)
+        print(f"HOME POWER:{home_power}; mrst_setpoint:{mrst_setpoint_discharge_power}; mrst_measured:{mrst_measured_power}; mrst_limit:{mrst_discharge_limit}; new_setpoint:{new_setpoint:.0f}")
+
+        # --- Set value for MRST_PWR_DISCHARGE
+        setpoints.set(MRST_PWR_DISCHARGE, int(round(new_setpoint)))
+        await setpoints.commit(bus)
+
+
+    # --- MODE Zero PV (no export) --------------------------------------
+    elif globl.mode_zpv:
+        # --- Check if already in RTU mode
+        if MARSTEK_MODBUS[MRST_RTU_MODE][IDXM_CONV] != 0x55AA:
+            # --- Set value for MRST_RTU_MODE = 0x55AA (21930d)
+            setpoints.set(MRST_RTU_MODE, 0x55AA)
+
+        # --- PID on the export (target 0 W), the output is the charge power
+        home_power = globl.HOME_POWER[globl.HOME_PWR_TOT][globl.IDXH_HVAL] + stale_correction  # --- POS means power consumption (NEG = production)
+        export_power = -home_power
+        mrst_measured_power = MARSTEK_MODBUS[MRST_AC_PWR_VAL][IDXM_CONV]  # --- POS is discharging (NEG = charging)
+        mrst_charging = MARSTEK_MODBUS[MRST_SET_INV_STATE][IDXM_CONV] == 1
+        mrst_setpoint_charge_power = MARSTEK_MODBUS[MRST_PWR_CHARGE][IDXM_CONV] if mrst_charging else 0
+        mrst_charge_limit = marstek_charge_limit()
+        now = time.monotonic()
+        # --- charge as soon as there is export, stop only after a long time without surplus (or at the cutoff)
+        charge = zpv_gate.update(export_power, zpv_controller.output, now, mrst_charge_limit > 0)
+        new_setpoint = zpv_controller.update(export_power, export_power - mrst_measured_power, 0, mrst_charge_limit if charge else 0, now, mrst_setpoint_charge_power)
+        print(f"HOME POWER:{home_power}; mrst_setpoint:{mrst_setpoint_charge_power}; mrst_measured:{mrst_measured_power}; mrst_limit:{mrst_charge_limit}; charge:{charge}; new_setpoint:{new_setpoint:.0f}")
+
+        inverter_state = 1 if charge else 0     # --- charge / stop
+        if MARSTEK_MODBUS[MRST_SET_INV_STATE][IDXM_CONV] != inverter_state:
+            setpoints.set(MRST_SET_INV_STATE, inverter_state)
+        # --- Set value for MRST_PWR_CHARGE
+        setpoints.set(MRST_PWR_CHARGE, int(round(new_setpoint)))
+        await setpoints.commit(bus)
+
+    # --- MODE Per phase balance --------------------------------------
+    elif globl.mode_phs:
+        # --- Check if already in RTU mode
+        if MARSTEK_MODBUS[MRST_RTU_MODE][IDXM_CONV] != 0x55AA:
+            # --- Set value for MRST_RTU_MODE = 0x55AA (21930d)
+            setpoints.set(MRST_RTU_MODE, 0x55AA)
+
+        # --- PID on the grid power of the battery phase (target 0 W), output is the battery power (NEG = charging)
+        phase = PHASE_BATT - 1
+        phase_powers = [globl.HOME_POWER[row][globl.IDXH_HVAL] for row in (globl.HOME_PWR_L1, globl.HOME_PWR_L2, globl.HOME_PWR_L3)]
+        phase_powers[phase] += stale_correction     # --- the battery only changes its own phase
+        fuse_powers = ctrl.phase_fuse_power(phase_powers, globl.PHASE_CURR, globl.PHASE_VOLT, PHASE_FUSE - PHASE_FUSE_MARGIN)
+        mrst_measured_power = MARSTEK_MODBUS[MRST_AC_PWR_VAL][IDXM_CONV]  # --- POS is discharging (NEG = charging)
+        mrst_inv_state = MARSTEK_MODBUS[MRST_SET_INV_STATE][IDXM_CONV]
+        if mrst_inv_state == globl.INV_STATE_DISCHARGE:
+            mrst_setpoint_power = MARSTEK_MODBUS[MRST_PWR_DISCHARGE][IDXM_CONV]
+        elif mrst_inv_state == globl.INV_STATE_CHARGE:
+            mrst_setpoint_power = -MARSTEK_MODBUS[MRST_PWR_CHARGE][IDXM_CONV]
+        else:
+            mrst_setpoint_power = 0
+        low, high = ctrl.phase_battery_window(phase_powers[phase], mrst_measured_power, fuse_powers[phase], -marstek_charge_limit(), marstek_discharge_limit())
+        new_setpoint = phs_controller.update(phase_powers[phase], phase_powers[phase] + mrst_measured_power, low, high, time.monotonic(), mrst_setpoint_power)
+        print(f"PHASE POWER:{phase_powers}; L{PHASE_BATT}; fuse:{fuse_powers[phase]:.0f}; window:{low:.0f}..{high:.0f}; mrst_setpoint:{mrst_setpoint_power}; mrst_measured:{mrst_measured_power}; new_setpoint:{new_setpoint:.0f}")
+        for other, (power, fuse_power) in enumerate(zip(phase_powers, fuse_powers)):
+            if other != phase and abs(power) > fuse_power:
+                globl.log_debug(module_name, f"L{other + 1} {power} W is over the fuse limit ({fuse_power:.0f} W), the battery is on L{PHASE_BATT}")
+
+        # --- Direction: around 0 W the inverter keeps charging / discharging
+        if new_setpoint > ctrl.CTRL_PHS_DEADBAND:
+            inverter_state = globl.INV_STATE_DISCHARGE
+        elif new_setpoint < -ctrl.CTRL_PHS_DEADBAND:
+            inverter_state = globl.INV_STATE_CHARGE
+        elif mrst_inv_state in (globl.INV_STATE_CHARGE, globl.INV_STATE_DISCHARGE):
+            inverter_state = mrst_inv_state
+        else:
+            inverter_state = globl.INV_STATE_DISCHARGE
+        if mrst_inv_state != inverter_state:
+            setpoints.set(MRST_SET_INV_STATE, inverter_state)
+        if inverter_state == globl.INV_STATE_DISCHARGE:
+            setpoints.set(MRST_PWR_DISCHARGE, int(round(max(new_setpoint, 0))))
+        else:
+            setpoints.set(MRST_PWR_CHARGE, int(round(max(-new_setpoint, 0))))
+        await setpoints.commit(bus)
+
+    # --- MODE Peak shaving --------------------------------------
+    elif globl.mode_peak:
+        # --- Check if already in RTU mode
+        if MARSTEK_MODBUS[MRST_RTU_MODE][IDXM_CONV] != 0x55AA:
+            # --- Set value for MRST_RTU_MODE = 0x55AA (21930d)
+            setpoints.set(MRST_RTU_MODE, 0x55AA)
+        # --- The inverter stays in discharge, 0 W while the quarter stays below the monthly peak
+        if MARSTEK_MODBUS[MRST_SET_INV_STATE][IDXM_CONV] != globl.INV_STATE_DISCHARGE:
+            setpoints.set(MRST_SET_INV_STATE, globl.INV_STATE_DISCHARGE)
+
+        # --- Discharge only what keeps the projected quarter-hour average at the monthly peak
+        home_power = globl.HOME_POWER[globl.HOME_PWR_TOT][globl.IDXH_HVAL] + stale_correction  # --- POS means power consumption (NEG = production)
+        mrst_measured_power = MARSTEK_MODBUS[MRST_AC_PWR_VAL][IDXM_CONV]  # --- POS is discharging (NEG = charging)
+        quarter_peak = globl.quarter_peak
+        new_setpoint = min(quarter_peak.shave_power(home_power + mrst_measured_power), marstek_discharge_limit())
+        print(f"HOME POWER:{home_power}; quarter avg:{quarter_peak.quarter.average():.0f}; projected:{quarter_peak.quarter.projected():.0f}; target:{quarter_peak.target():.0f}; mrst_measured:{mrst_measured_power}; new_setpoint:{new_setpoint:.0f}")
+
+        # --- Set value for MRST_PWR_DISCHARGE
+        setpoints.set(MRST_PWR_DISCHARGE, int(round(new_setpoint)))
+        await setpoints.commit(bus)
+
+    # --- Stop any running programm -------------------------------
+    elif globl.mode_stop:
+        # Reset the stop flag
+        globl.mode_stop = False
+        print("[BATT] Stopping running program ...")
+        # --- Check if already in RTU mode
+        if MARSTEK_MODBUS[MRST_RTU_MODE][IDXM_CONV] != 0x55AA:
+            # --- Set value for MRST_RTU_MODE = 0x55AA (21930d)
+            setpoints.set(MRST_RTU_MODE, 0x55AA)
+        # --- Set STOP value in MRST_SET_INV_STATE
+        setpoints.set(MRST_SET_INV_STATE, 0) # --- 0: STOP
+        await setpoints.commit(bus, force=True)
+        print("[BATT] Stopped running program ...")
+
+    return setpoints
+
+# -----------------------------------------------------------------------------------------
+# --- BATT thread -----------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+def create_modbus_client():
+    if MODBUS_DEVICE.startswith("tcp:"):
+        # --- RTU frames over TCP (RS485 gateway or the simulator mrstsim.py)
+        _, host, port = MODBUS_DEVICE.split(":")
+        return AsyncModbusTcpClient(host, port=int(port), framer="rtu", timeout=MODBUS_TIMEOUT, retries=0)
+    return AsyncModbusSerialClient(
         framer="rtu",
-        port=serial_port,
+        port=MODBUS_DEVICE,
         baudrate=MODBUS_BAUD,
         bytesize=8,
         parity='N',
         stopbits=1,
-        timeout=1
+        timeout=MODBUS_TIMEOUT,
+        retries=0           # --- the bus queue handles timeouts, a retry would only delay the next request
     )
-    # --- proportional controller
-    new_setpoint = 0        # --- new setpoint
-    mrst_delta = 0          # delta between mrst set and measured power    
-   
+
+async def stop_modbus_bus(bus, bus_task): # --- Cancel the queued requests and wait for the bus worker to end
+    bus.cancel_pending()
+    bus_task.cancel()
+    await asyncio.gather(bus_task, return_exceptions=True)
+
+async def batt_main(batt_stop_event: threading.Event, interval: float):
+    
+    cntr = 0
+    unit_id=1
+
+    client = create_modbus_client()
+
+    # --- Poll schedule: fast blocks every cycle, slow blocks every N cycles, static blocks once per connection
+    # --- neighbouring register blocks within a tier are merged into as few requests as possible
+    reg_blocks = marstek_register_blocks()
+    poll_scheduler = mbus.PollScheduler(marstek_poll_tiers())
+    globl.bus_stats.prepare(marstek_bus_requests(poll_scheduler))   # --- the bus worker only counts in place
+    block_time = mbus.plan_read_time(mbus.plan_reads(reg_blocks, -1), MODBUS_BAUD)
+    plan_time = poll_scheduler.cycle_time(MODBUS_BAUD)
+    globl.log_debug(module_name, f"Poll plan: {len(reg_blocks)} blocks in {len(poll_scheduler.entries)} requests, est. bus time per cycle {block_time * 1000:.0f} ms --> {plan_time * 1000:.0f} ms")
 
     while not batt_stop_event.is_set():
         
-        if not client.connect():
-            globl.log_debug(module_name, f"Could not connect to battery on {serial_port}")
-            time.sleep(10)  # delay before reconnecting
+        if not await client.connect():
+            globl.log_debug(module_name, f"Could not connect to battery on {MODBUS_DEVICE}")
+            await asyncio.sleep(10)  # delay before reconnecting
             return
-        globl.log_debug(module_name, f"Connected to battery on {serial_port}")
+        globl.log_debug(module_name, f"Connected to battery on {MODBUS_DEVICE}")
+        poll_scheduler.reset()  # --- read everything once after (re)connecting
+        poll_cycle = 0
+        write_cache.clear()     # --- re-verify: the setpoints are confirmed again by the first full read
+
+        # --- One worker owns the bus, setpoint writes overtake queued telemetry reads
+        bus = mbus.ModbusBus(client, unit_id, MODBUS_TIMEOUT, globl.bus_stats)
+        bus_task = asyncio.create_task(bus.run())
+        telegram_seq, telegram_arrival = dsmr.telegram_signal.latest()
+        telegram_woken = False
         
         try:
             while not batt_stop_event.is_set():
 
-                # --- Device Name
-                reg_block = MRST_DEVICE_NAME
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-                    
-                # --- FW version
-                reg_block = MRST_FW_VERSION
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-
-                # --- SERIAL number
-                reg_block = MRST_SERIAL_NUM
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-
-                # --- DC block
-                reg_block = MRST_DC_VOLT
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-
-                # --- AC block
-                reg_block = MRST_AC_VOLT
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-
-                # --- BACKUP block
-                reg_block = MRST_BACKUP_VOLT
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-
-                # ---  Statistics block 
-                reg_block = MRST_TOT_CHARGED
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-
-                # --- INTernal TEMP (mosfets)
-                reg_block = MRST_INT_TEMP
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-
-                # --- CELL TEMP MAX and MIN value block
-                reg_block = MRST_MAX_CELL_TEMP
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-
-                # --- INVerter STATE block
-                reg_block = MRST_GET_INV_STATE
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-
-                # --- ALARM WORD
-                reg_block = MRST_ALARM
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-
-                # --- FAULT DOUBLE WORD
-                reg_block = MRST_FAULT_LSB
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-
-                # --- READ and WRITE registers -- You can only SET values after setting RTU mode to 0x55AA = ON (0x55BB = OFF) 
-                
-                # --- RESTART --- write 0x55AA
-                reg_block = MRST_RESTART
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-
-                # --- UNIT_ID - be careful not to change the Unit ID
-                reg_block = MRST_UNIT_ID
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-
-                # --- MRST_BACKUP - 0: enable backup, 1: disable backup
-                reg_block = MRST_BACKUP
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-
-                # --- RTU MODE setting RTU mode to 0x55AA = ON (0x55BB = OFF) 
-                reg_block = MRST_RTU_MODE
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-
-                # --- INVerter STATE - 0:stop, 1:charge, 2:discharge
-                reg_block = MRST_SET_INV_STATE
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-
-                # --- PWR_CHARGE - charging and discharging power [0-2500W]
-                reg_block = MRST_PWR_CHARGE
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-
-                # --- USER_MODE - 0:manual, 1:anti-feed, 2:trade mode
-                reg_block = MRST_USER_MODE
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-
-                # --- CHARGE and DISCHARGE CUTOFF + MRST_MAX_CHARGE_PWR + MRST_MAX_DISCHARGE_PWR
-                reg_block = MRST_CHARGE_CUTOFF
-                result = client.read_holding_registers(address=MARSTEK_MODBUS[reg_block][IDXM_ADDR], count=MARSTEK_MODBUS[reg_block][IDXM_BLCK], device_id=unit_id)
-                if result.isError():
-                    globl.log_debug(module_name, f"Read error: {result}")
-                else: # copy modbus registers in MARSTEK_MODBUS list object
-                    copy_modbus_register_block(result, reg_block)
-                            
-                # --- Convert all MODBUS registers and adjust gain
-                convert_modbus_registers()
-
-                # --- Copy MARSTEK MODBUS LIST to BATT_REGISTERS with Thread.Lock
-                copy_marstek_to_batt()
-
-                # ------------------------------------------------------------------------------------------
-                # --- SET MODUS / PROGRAM ------------------------------------------------------------------
-                # ------------------------------------------------------------------------------------------
-
-                # --- MODE BASELOAD --------------------------------------
-                if globl.mode_bsld:
-                    # --- Check if already in RTU mode    
-                    if MARSTEK_MODBUS[MRST_RTU_MODE][IDXM_CONV] != 0x55AA: 
-                        # --- Set value for MRST_RTU_MODE = 0x55AA (21930d)
-                        result = client.write_register(address=MARSTEK_MODBUS[MRST_RTU_MODE][IDXM_ADDR], value=0x55AA, device_id=unit_id)
-                        if result.isError():
-                            globl.log_debug(module_name, f"Write error: {result}")
-                     # --- Check if already in discharge mode : MRST_SET_INV_STATE is NOT set to discharge then...
-                    inverter_state = 2  # --- discharge
-                    if MARSTEK_MODBUS[MRST_SET_INV_STATE][IDXM_ADDR] != inverter_state: # --- Check if already in RTU mode
-                        # --- Set MRST_SET_INV_STATE to discharge
-                        result = client.write_register(address=MARSTEK_MODBUS[MRST_SET_INV_STATE][IDXM_ADDR], value=inverter_state, device_id=unit_id)
-                        if result.isError():
-                            globl.log_debug(module_name, f"Write error: {result}")
-
-                    # ToDo: Implement BATT controller that follows the DSMR
-                    home_power = globl.HOME_POWER[globl.HOME_PWR_TOT][globl.IDXH_HVAL]  # --- POS means power consumption (NEG = production)
-                    mrst_measured_power = MARSTEK_MODBUS[MRST_AC_PWR_VAL][IDXM_CONV]  # --- POS is discharging (NEG = charging)
-                    mrst_setpoint_discharge_power = MARSTEK_MODBUS[MRST_PWR_DISCHARGE][IDXM_CONV]  # --- Setpoint discharge power
-                    
-                    # --- Calculate the delta using proporional value only
-                    mrst_delta = mrst_setpoint_discharge_power - mrst_measured_power # -- POS means ramping up and NEG means ramping down
-                    print(f"HOME POWER:{home_power}; mrst_delta:{mrst_delta}; mrst_setpoint:{mrst_setpoint_discharge_power}; mrst_measured:{mrst_measured_power}")
-                    new_setpoint = mrst_setpoint_discharge_power + (home_power - mrst_delta)
-                    
-                    #if home_power > 0:  # --- Home is consuming energy
-                    #    new_setpoint = mrst_setpoint_discharge_power + (home_power - mrst_delta)
-                    #elif home_power < 0:  # --- Home is producing energy
-                    #    new_setpoint = mrst_setpoint_discharge_power + (home_power - mrst_delta)
-                    
-                    # --- Set value for MRST_PWR_DISCHARGE
-                    result = client.write_register(address=MARSTEK_MODBUS[MRST_PWR_DISCHARGE][IDXM_ADDR], value=int(new_setpoint), device_id=unit_id)
-                    if result.isError():
-                       globl.log_debug(module_name, f"Write error: {result}")
-
-                # --- MODE MANUAL --------------------------------------
-                elif globl.mode_man:
-                    # --- Restart Marstek
-                    if globl.man_restart:
-                        print("[MRST] Restarting Marstek Venus E V2.0 ...")
-                        globl.man_restart = False
-                        result = client.write_register(address=MARSTEK_MODBUS[MRST_RESTART][IDXM_ADDR], value=0x55AA, device_id=unit_id)
-                        if result.isError():
-                            globl.log_debug(module_name, f"Write error: {result}")
-                        else:
-                            globl.log_debug(module_name, f"Write succes: {result}")
-                    elif globl.man_maxcpwr:
-                        print("[MRST] Marstek SET max charging power ...")
-                        globl.man_maxcpwr = False
-                        max_charging_power = globl.BATT_REGISTERS[globl.BATT_MAX_CHARGE_PWR][globl.IDXB_SVAL]
-                        result = client.write_register(address=MARSTEK_MODBUS[MRST_MAX_CHARGE_PWR][IDXM_ADDR], value=max_charging_power, device_id=unit_id)
-                        if result.isError():
-                            globl.log_debug(module_name, f"Write error: {result}")
-                        else:
-                            globl.log_debug(module_name, f"Write succes: {result}")
-                    elif globl.man_maxdpwr:
-                        print("[MRST] Marstek SET max discharging power ...")
-                        globl.man_maxdpwr = False
-                        max_discharging_power = globl.BATT_REGISTERS[globl.BATT_MAX_DISCHARGE_PWR][globl.IDXB_SVAL]
-                        result = client.write_register(address=MARSTEK_MODBUS[MRST_MAX_DISCHARGE_PWR][IDXM_ADDR], value=max_discharging_power, device_id=unit_id)
-                        if result.isError():
-                            globl.log_debug(module_name, f"Write error: {result}")
-                        else:
-                            globl.log_debug(module_name, f"Write succes: {result}")
-                            
-                            
-                            
-                    if False:
-                        # Reset the changed flag
-                        #globl.mode_changed = False
-                        # --- Check if already in RTU mode
-                        if MARSTEK_MODBUS[MRST_RTU_MODE][IDXM_CONV] != 0x55AA:
-                            # --- Set value for MRST_RTU_MODE = 0x55AA (21930d)
-                            result = client.write_register(address=MARSTEK_MODBUS[MRST_RTU_MODE][IDXM_ADDR], value=0x55AA, device_id=unit_id)
-                            if result.isError():
-                                globl.log_debug(module_name, f"Write error: {result}")
-                        # --- Set value for MRST_PWR_CHARGE
-                        result = client.write_register(address=MARSTEK_MODBUS[MRST_PWR_CHARGE][IDXM_ADDR], value=globl.set_pwr_charge, device_id=unit_id)
-                        if result.isError():
-                            globl.log_debug(module_name, f"Write error: {result}")
-                            
-                        # --- Set value for MRST_PWR_DISCHARGE
-                        result = client.write_register(address=MARSTEK_MODBUS[MRST_PWR_DISCHARGE][IDXM_ADDR], value=globl.set_pwr_discharge, device_id=unit_id)
-                        if result.isError():
-                            globl.log_debug(module_name, f"Write error: {result}")
-                        # --- Set value for MRST_SET_INV_STATE
-                        result = client.write_register(address=MARSTEK_MODBUS[MRST_SET_INV_STATE][IDXM_ADDR], value=globl.set_inv_state, device_id=unit_id)
-                        if result.isError():
-                            globl.log_debug(module_name, f"Write error: {result}")
-
-                # --- MODE Nul Op de Meter --------------------------------------
-                elif globl.mode_nom :
-                    # --- Check if already in RTU mode    
-                    if MARSTEK_MODBUS[MRST_RTU_MODE][IDXM_CONV] != 0x55AA: 
-                        # --- Set value for MRST_RTU_MODE = 0x55AA (21930d)
-                        result = client.write_register(address=MARSTEK_MODBUS[MRST_RTU_MODE][IDXM_ADDR], value=0x55AA, device_id=unit_id)
-                        if result.isError():
-                            globl.log_debug(module_name, f"Write error: {result}")
-                     # --- Check if already in discharge mode : MRST_SET_INV_STATE is NOT set to discharge then...
-                    inverter_state = 2  # --- discharge
-                    if MARSTEK_MODBUS[MRST_SET_INV_STATE][IDXM_ADDR] != inverter_state: # --- Check if already in RTU mode
-                        # --- Set MRST_SET_INV_STATE to discharge
-                        result = client.write_register(address=MARSTEK_MODBUS[MRST_SET_INV_STATE][IDXM_ADDR], value=inverter_state, device_id=unit_id)
-                        if result.isError():
-                            globl.log_debug(module_name, f"Write error: {result}")
-
-                    # ToDo: Implement BATT controller that follows the DSMR
-                    home_power = globl.HOME_POWER[globl.HOME_PWR_TOT][globl.IDXH_HVAL]  # --- POS means power consumption (NEG = production)
-                    mrst_measured_power = MARSTEK_MODBUS[MRST_AC_PWR_VAL][IDXM_CONV]  # --- POS is discharging (NEG = charging)
-                    mrst_setpoint_discharge_power = MARSTEK_MODBUS[MRST_PWR_DISCHARGE][IDXM_CONV]  # --- Setpoint discharge power
-                    
-                    # --- Calculate the delta using proporional value only
-                    mrst_delta = mrst_setpoint_discharge_power - mrst_measured_power # -- POS means ramping up and NEG means ramping down
-                    print(f"HOME POWER:{home_power}; mrst_delta:{mrst_delta}; mrst_setpoint:{mrst_setpoint_discharge_power}; mrst_measured:{mrst_measured_power}")
-                    new_setpoint = mrst_setpoint_discharge_power + (home_power - mrst_delta)
-                    
-                    #if home_power > 0:  # --- Home is consuming energy
-                    #    new_setpoint = mrst_setpoint_discharge_power + (home_power - mrst_delta)
-                    #elif home_power < 0:  # --- Home is producing energy
-                    #    new_setpoint = mrst_setpoint_discharge_power + (home_power - mrst_delta)
-                    
-                    # --- Set value for MRST_PWR_DISCHARGE
-                    result = client.write_register(address=MARSTEK_MODBUS[MRST_PWR_DISCHARGE][IDXM_ADDR], value=int(new_setpoint), device_id=unit_id)
-                    if result.isError():
-                       globl.log_debug(module_name, f"Write error: {result}")
-
-
-                # --- Stop any running programm -------------------------------
-                elif globl.mode_stop:
-                    # Reset the stop flag
-                    globl.mode_stop = False
-                    print("[BATT] Stopping running program ...")
-                    # --- Check if already in RTU mode
-                    if MARSTEK_MODBUS[MRST_RTU_MODE][IDXM_CONV] != 0x55AA:
-                        # --- Set value for MRST_RTU_MODE = 0x55AA (21930d)
-                        result = client.write_register(address=MARSTEK_MODBUS[MRST_RTU_MODE][IDXM_ADDR], value=0x55AA, device_id=unit_id)
-                        if result.isError():
-                            globl.log_debug(module_name, f"Write error: {result}")
-                    # --- Set STOP value in MRST_SET_INV_STATE
-                    result = client.write_register(address=MARSTEK_MODBUS[MRST_SET_INV_STATE][IDXM_ADDR], value=0, device_id=unit_id) # --- 0: STOP
-                    if result.isError():
-                        globl.log_debug(module_name, f"Write error: {result}")
-                    print("[BATT] Stopped running program ...")
-
-
+                busy_time = bus.busy_time
+                cycle_start = time.perf_counter()
+
+                # --- Queue the register blocks due in this cycle, control registers (fast) in front
+                poll_entries = poll_scheduler.pop_due(poll_cycle)
+                fast_reads = submit_modbus_reads(bus, [entry for entry in poll_entries if entry.period == 1])
+                other_reads = submit_modbus_reads(bus, [entry for entry in poll_entries if entry.period != 1])
+                read_count = len(fast_reads) + len(other_reads)
+                poll_cycle += 1
+
+                # --- Control registers first (decoded into the register store on arrival)
+                # --- (first cycle after a connect: wait for the full register image before writing)
+                await complete_modbus_reads(bus, fast_reads)
+                reads_done = time.monotonic()
+                if poll_cycle == 1:
+                    await complete_modbus_reads(bus, other_reads)
+                    other_reads = []
+                    if select_register_map():
+                        # --- other firmware, other map: new poll plan, read everything again before writing
+                        # --- the bus worker is stopped (queue drained) while the statistics get the entries of the new plan
+                        await stop_modbus_bus(bus, bus_task)
+                        poll_scheduler = mbus.PollScheduler(marstek_poll_tiers())
+                        globl.bus_stats.prepare(marstek_bus_requests(poll_scheduler))
+                        bus = mbus.ModbusBus(client, unit_id, MODBUS_TIMEOUT, globl.bus_stats)
+                        bus_task = asyncio.create_task(bus.run())
+                        poll_cycle = 0
+                        continue
+
+                # --- Setpoint writes go to the bus before the remaining (slow / static) reads
+                # --- latency of a tick that wrote: telegram --> control registers read, then read --> write acknowledged
+                control_start = time.monotonic() if poll_cycle == 1 else reads_done  # --- first cycle: after the full image
+                setpoints = await run_mode_program(bus)
+                if telegram_woken:
+                    globl.ctrl_ticks_telegram += 1
+                    if setpoints.acked is not None:
+                        globl.ctrl_read_latency.add(reads_done - telegram_arrival)
+                        globl.ctrl_latency.add(setpoints.acked - control_start)
+                elif mode_follows_meter():
+                    globl.ctrl_ticks_timeout += 1
+
+                if other_reads:
+                    await complete_modbus_reads(bus, other_reads)
+
+                # --- Cycle time (without the sleep) and bus time of this cycle
+                globl.bus_stats.record_cycle(time.perf_counter() - cycle_start, bus.busy_time - busy_time)
 
                 # --- Print all MODBUS registers
                 print_modbus_registers()
 
                 cntr += 1      # increment counter
-                time.sleep(interval)  # delay between reads (interval)
-                globl.log_loop(module_name, f"Loop counter: {cntr}")
+                if cntr % MODBUS_EXPORT_CYCLES == 0:
+                    for exporter, e in globl.bus_stats.publish():
+                        globl.log_debug(module_name, f"Bus stats exporter {exporter} failed: {e}")
+
+                # --- Next tick: the modes following the meter wake as soon as a new telegram is in HOME_POWER
+                # --- (the interval is the fallback when the meter is silent), the other modes poll every interval
+                if mode_follows_meter():
+                    telegram_woken = await dsmr.telegram_signal.wait(telegram_seq, interval)
+                else:
+                    await asyncio.sleep(interval)  # delay between reads (interval)
+                    telegram_woken = False
+                telegram_seq, telegram_arrival = dsmr.telegram_signal.latest()
+                globl.log_loop(module_name, f"Loop counter: {cntr}, {read_count} read requests, bus time {(bus.busy_time - busy_time) * 1000:.0f} ms, timeouts {bus.timeouts}, writes {write_cache.written}, skipped {write_cache.skipped}, telegram ticks {globl.ctrl_ticks_telegram}, read p95 {globl.ctrl_read_latency.percentile(95) * 1000:.0f} ms, write p95 {globl.ctrl_latency.percentile(95) * 1000:.0f} ms")
                 
         except Exception as e:
             globl.log_debug(module_name, f"Exception: {e}")
-            time.sleep(interval)  # delay between reads after error
+            await asyncio.sleep(interval)  # delay between reads after error
         finally:
+            await stop_modbus_bus(bus, bus_task)
             client.close()
             globl.log_debug(module_name, "Battery connection closed.")
-        
+
+def batt_thread_fn(batt_stop_event: threading.Event, interval: float = 2.0):
+    asyncio.run(batt_main(batt_stop_event, interval))
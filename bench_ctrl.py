@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+bench_ctrl.py
+  Closed loop harness for the NOM controller: mrstsim.VenusModel (dead time, ramp) between home and grid,
+  one telegram per second with the mean grid power since the last telegram (like the meter),
+  the control tick writes right after the telegram (like batt.py)
+  reports per load step the settling time, and for the whole trace the grid import / export energy
+  usage: python bench_ctrl.py [trace.csv]
+    trace.csv: recorded HOME_PWR_TOT in W (battery idle), one row per telegram or with a "time" column in s
+    without a trace a built-in step profile is used
+"""
+
+import csv
+import sys
+import ctrl
+import mrstsim
+
+# -----------------------------------------------------------------
+module_name = "BNCH"
+# -----------------------------------------------------------------
+
+BENCH_STEP = 0.05           # --- s, simulation step
+BENCH_TELEGRAM = 1.0        # --- s, meter interval
+BENCH_READ_TIME = 0.05      # --- s, fast reads before the setpoint is computed
+BENCH_WRITE_TIME = 0.02     # --- s, setpoint write until acknowledged
+BENCH_SETTLE_BAND = 50.0    # --- W, settled when |grid power| stays within the band (or within 5% of the step)
+BENCH_MAX_POWER = 2500      # --- W, setpoint range of MRST_PWR_DISCHARGE
+
+# --- (duration s, home power W): base load, kettle, PV surplus, over the battery limit
+BENCH_PROFILE = [(20, 300), (20, 1200), (20, 400), (20, 2200), (20, -600), (20, 3200), (20, 500)]
+
+# -----------------------------------------------------------------------------------------
+# --- Trace -------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+def load_trace(file_path):
+    # --- [(time s, HOME_PWR_TOT W)], column HOME_PWR_TOT (or the last column), optional column time
+    with open(file_path, newline="") as trace_file:
+        rows = list(csv.DictReader(trace_file))
+    trace = []
+    for number, row in enumerate(rows):
+        power = row["HOME_PWR_TOT"] if "HOME_PWR_TOT" in row else list(row.values())[-1]
+        trace.append((float(row["time"]) if "time" in row else number * BENCH_TELEGRAM, float(power)))
+    start = trace[0][0] if trace else 0.0
+    return [(time_stamp - start, power) for time_stamp, power in trace]
+
+def profile_trace(profile=BENCH_PROFILE):
+    trace = []
+    time_stamp = 0.0
+    for duration, power in profile:
+        trace.append((time_stamp, float(power)))
+        time_stamp += duration
+    trace.append((time_stamp, float(profile[-1][1])))
+    return trace
+
+def load_at(trace, time_stamp, position):
+    # --- Home power of the trace at time_stamp (step hold), position: index to continue from
+    while position + 1 < len(trace) and trace[position + 1][0] <= time_stamp:
+        position += 1
+    return trace[position][1], position
+
+# -----------------------------------------------------------------------------------------
+# --- Controllers -------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+def legacy_step(home_power, measured, setpoint, now):
+    # --- The proportional step of batt.py before the controller (only clamped to the register range)
+    return max(0, min(BENCH_MAX_POWER, setpoint + (home_power - (setpoint - measured))))
+
+def pid_step_fn(tuning=ctrl.CTRL_NOM_TUNING):
+    controller = ctrl.PIDController(**tuning)
+    def pid_step(home_power, measured, setpoint, now):
+        return controller.update(home_power, measured + home_power, 0, BENCH_MAX_POWER, now, setpoint)
+    return pid_step
+
+# -----------------------------------------------------------------------------------------
+# --- Closed loop -------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+def run_loop(trace, control_step):
+    # --- Returns (settling times [(step time, home power, settled after s or None)], import Wh, export Wh, peak export W)
+    model = mrstsim.VenusModel(soc=60.0)
+    model.setpoints["MRST_RTU_MODE"] = mrstsim.SIM_RTU_ON
+    model.setpoints["MRST_SET_INV_STATE"] = 2
+    model.setpoints["MRST_PWR_DISCHARGE"] = 0
+    model.time = 0.0
+    end = trace[-1][0]
+    position = 0
+    next_telegram = BENCH_TELEGRAM
+    pending = []            # --- (time, action, value): measurement read, setpoint written
+    meter_energy = 0.0      # --- W * s since the last telegram
+    import_wh = export_wh = peak_export = 0.0
+    steps = []              # --- [step time, home power, last time outside the band]
+    now = 0.0
+    while now < end:
+        now += BENCH_STEP
+        model.load, position = load_at(trace, now, position)
+        model.step(now)
+        grid = model.grid_power()
+        import_wh += max(grid, 0.0) * BENCH_STEP / 3600
+        export_wh += max(-grid, 0.0) * BENCH_STEP / 3600
+        peak_export = max(peak_export, -grid)
+        meter_energy += grid * BENCH_STEP
+        if not steps or abs(model.load - steps[-1][1]) > BENCH_SETTLE_BAND:   # --- a load step (not noise)
+            steps.append([now, model.load, now])
+        step = steps[-1]
+        band = max(BENCH_SETTLE_BAND, 0.05 * abs(step[1] - (steps[-2][1] if len(steps) > 1 else 0.0)))
+        # --- the battery can not cover a load above its limit or a surplus (discharge only): settle on what it can do
+        reachable = max(0.0, min(float(BENCH_MAX_POWER), model.load))
+        if abs(grid - (model.load - reachable)) > band:
+            step[2] = now
+        # --- telegram --> read the control registers --> compute --> write
+        if now >= next_telegram:
+            next_telegram += BENCH_TELEGRAM
+            pending.append((now + BENCH_READ_TIME, "tick", round(meter_energy / BENCH_TELEGRAM)))
+            meter_energy = 0.0
+        for item in [item for item in pending if item[0] <= now]:
+            pending.remove(item)
+            if item[1] == "tick":
+                setpoint = model.setpoints["MRST_PWR_DISCHARGE"]
+                new_setpoint = int(control_step(item[2], round(model.ac_power), setpoint, now))
+                pending.append((now + BENCH_WRITE_TIME, "write", new_setpoint))
+            else:
+                model.setpoints["MRST_PWR_DISCHARGE"] = item[2]
+    settling = []
+    for number, (step_time, power, last_outside) in enumerate(steps):
+        step_end = steps[number + 1][0] if number + 1 < len(steps) else end
+        settling.append((step_time, power, last_outside - step_time if last_outside < step_end - BENCH_STEP else None))
+    return settling, import_wh, export_wh, peak_export
+
+def report(name, result):
+    settling, import_wh, export_wh, peak_export = result
+    times = [settled for _, _, settled in settling]
+    settled = [settled for settled in times if settled is not None]
+    print(f"[{module_name}] {name:<6} settling " + " ".join(f"{power:>5.0f}W:{settled:4.1f}s" if settled is not None else f"{power:>5.0f}W:  -- " for _, power, settled in settling))
+    print(f"[{module_name}] {name:<6} max settling {max(settled) if settled else 0:.1f} s, not settled {len(times) - len(settled)}, grid import {import_wh:.2f} Wh, export {export_wh:.2f} Wh, peak export {peak_export:.0f} W")
+
+# -----------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    trace = load_trace(sys.argv[1]) if len(sys.argv) > 1 else profile_trace()
+    print(f"[{module_name}] trace: {len(trace)} points, {trace[-1][0]:.0f} s")
+    report("legacy", run_loop(trace, legacy_step))
+    report("pid", run_loop(trace, pid_step_fn()))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+bench_dsmr.py
+  Micro-benchmark for the DSMR P1 telegram parser (fixture: p1.txt)
+    fresh  - parse_telegram into a new DsmrRecord (every line converted: 48 fields, the find() scan reads 25)
+    reused - parse_telegram into the record of the previous telegram, as each P1Source does (unchanged lines skipped)
+  usage: python bench_dsmr.py [loops]
+"""
+
+import copy
+import sys
+import timeit
+import globl
+import dsmr
+
+from p1feed import load_frames
+from dsmr import DSMR_OBIS_LIST, IDXD_OBIS, IDXD_TYPE, IDXD_SVAL, IDXD_NVAL
+
+# -----------------------------------------------------------------
+module_name = "BNCH"
+# -----------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------------
+# --- Fixture -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+def load_telegrams():
+    # --- p1.txt telegrams as received on the wire
+    return [frame.decode("ascii") for frame in load_frames()]
+
+# -----------------------------------------------------------------------------------------
+# --- Reference: find()-per-field scan (previous lookup_dsmr_value without printing) -------
+# -----------------------------------------------------------------------------------------
+
+# --- The 25 original rows with the short OBIS codes ("1-0:1.7.0" --> "1.7.0"), the gas volume is the last row,
+# --- and the divider column the legacy scan used: all digits of the value / divider ("230.9*V" --> 2309 / 10)
+LEGACY_DIVIDERS = [10, 1, 1, 1000, 1000, 1000, 1000, 1, 1, 1, 10, 10, 10, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1000]
+IDXD_DIVR = len(DSMR_OBIS_LIST[0])
+LEGACY_OBIS_LIST = [row[:IDXD_OBIS] + [row[IDXD_OBIS].partition(":")[2]] + row[IDXD_OBIS + 1:] + [divider] for row, divider in zip(DSMR_OBIS_LIST, LEGACY_DIVIDERS)]
+
+def lookup_dsmr_value_find(telegram, obis_list):
+    for item in range(len(obis_list)-1):
+        indx_obis = telegram.find(obis_list[item][IDXD_OBIS])
+        indx_open_bracket = telegram[indx_obis:].find("(") + indx_obis + 1
+        indx_close_bracket = telegram[indx_open_bracket:].find(")") + indx_open_bracket
+        obis_list[item][IDXD_SVAL] = telegram[indx_open_bracket:indx_close_bracket]
+        if (obis_list[item][IDXD_TYPE] == "u"):
+            obis_list[item][IDXD_NVAL] = int(''.join(filter(str.isdigit, obis_list[item][IDXD_SVAL]))) / obis_list[item][IDXD_DIVR]
+    indx_open_bracket = telegram[indx_close_bracket:].find("(") + indx_close_bracket + 1
+    indx_close_bracket = telegram[indx_open_bracket:].find(")") + indx_open_bracket
+    item += 1
+    obis_list[item][IDXD_SVAL] = telegram[indx_open_bracket:indx_close_bracket - 1]
+    obis_list[item][IDXD_NVAL] = int(''.join(filter(str.isdigit, obis_list[item][IDXD_SVAL]))) / obis_list[item][IDXD_DIVR]
+
+# -----------------------------------------------------------------------------------------
+
+def check_equal(telegram):
+    # --- Both parsers must produce the same numeric values
+    obis_list = copy.deepcopy(LEGACY_OBIS_LIST)
+    lookup_dsmr_value_find(telegram, obis_list)
+    record = dsmr.parse_telegram(telegram)
+    for item in range(len(obis_list)):
+        if obis_list[item][IDXD_TYPE] == "u":
+            new_value = getattr(record, dsmr.SLOT_ATTR[item])
+            if abs(obis_list[item][IDXD_NVAL] - new_value) > 1e-9:
+                print(f"[{module_name}] MISMATCH {obis_list[item][0]}: {obis_list[item][IDXD_NVAL]} != {new_value}")
+                return False
+    return True
+
+def bench(loops):
+    telegrams = load_telegrams()
+    for telegram in telegrams:
+        if not check_equal(telegram):
+            sys.exit(1)
+
+    obis_list = copy.deepcopy(LEGACY_OBIS_LIST)
+    record = dsmr.DsmrRecord()
+    # --- best of 5 runs to filter out scheduler noise
+    t_find = min(timeit.repeat(lambda: [lookup_dsmr_value_find(t, obis_list) for t in telegrams], number=loops, repeat=5))
+    t_fresh = min(timeit.repeat(lambda: [dsmr.parse_telegram(t) for t in telegrams], number=loops, repeat=5))
+    t_reused = min(timeit.repeat(lambda: [dsmr.parse_telegram(t, record) for t in telegrams], number=loops, repeat=5))
+
+    count = loops * len(telegrams)
+    print(f"[{module_name}] telegrams: {len(telegrams)} x {loops} loops")
+    print(f"[{module_name}] find() per field     : {t_find / count * 1e6:8.2f} us/telegram")
+    print(f"[{module_name}] single pass, fresh   : {t_fresh / count * 1e6:8.2f} us/telegram  {t_find / t_fresh:5.2f} x")
+    print(f"[{module_name}] single pass, reused  : {t_reused / count * 1e6:8.2f} us/telegram  {t_find / t_reused:5.2f} x")
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+ctrl.py
+  Battery power controllers for the control tick in batt.py (no I/O: measurements in, setpoint out)
+    PIDController - feedforward + PID on the grid power with integrator anti-windup (tracking of the applied
+                    output), slew rate limiting and saturation to the live limits of the battery
+    StateGate     - on/off decision with hysteresis (e.g. inverter state charge / stop in ZPV mode)
+    phase_fuse_power     - per phase grid power the main fuse allows (L1, L2, L3 in one pass, plain floats:
+                           three values per telegram, about 2 us for both functions, numpy would cost more than it saves)
+    phase_battery_window - battery power range that keeps the battery phase within its fuse
+    StaleGuard    - freshness of the meter / battery data: fresh, estimate (stale meter value corrected by the
+                    change of the battery power) or ramp the setpoints to 0
+  closed loop harness: python bench_ctrl.py [trace.csv]
+"""
+
+# -----------------------------------------------------------------
+module_name = "CTRL"
+# -----------------------------------------------------------------
+
+# --- NOM (nul op de meter) tuning: error = grid power (pos is import), output = discharge setpoint in W
+# --- tuned with bench_ctrl.py (1 s telegrams, 0.5 s inverter dead time, 1000 W/s ramp)
+# --- feedforward: load estimate (measured AC power + grid power); the telegram is a 1 s mean and the AC power an
+# --- instant value, during a ramp the estimate overshoots, so the feedforward is off by default
+CTRL_NOM_TUNING = {
+    "kp": 0.2,              # --- W per W of grid power
+    "ki": 0.5,              # --- W per W of grid power per second
+    "kd": 0.0,              # --- W per W/s (on the measurement, no kick on a target change)
+    "kff": 0.0,             # --- share of the load estimate applied directly
+    "slew_rate": 1000.0,    # --- W/s, max setpoint change (the inverter ramps at about the same rate)
+}
+# --- ZPV (zero PV export) tuning: error = export power, output = charge setpoint in W (same plant, same gains)
+CTRL_ZPV_TUNING = dict(CTRL_NOM_TUNING)
+CTRL_ZPV_START = 30.0       # --- W, export that switches the inverter to charge
+CTRL_ZPV_HOLD = 120.0       # --- s at 0 W charge power before the inverter is stopped (rides through clouds)
+
+# --- PHS (per phase balance) tuning: error = grid power of the battery phase, output = battery power
+# --- (pos is discharge, neg is charge)
+CTRL_PHS_TUNING = dict(CTRL_NOM_TUNING)
+CTRL_PHS_DEADBAND = 20.0    # --- W, around 0 W the inverter keeps its direction (no charge / discharge toggling)
+CTRL_PHASE_VOLT = 230.0     # --- V, nominal voltage when the meter does not report the phase voltage
+CTRL_CURR_RESOLUTION = 1.0  # --- A, DSMR reports whole amps
+
+# --- Freshness of the measurements a control step uses (time.monotonic() stamps of HOME_POWER and the register store)
+CTRL_FRESHNESS = 3.0        # --- s, older meter or battery data is stale (the meter sends every second)
+CTRL_ESTIMATE_TIME = 10.0   # --- s after the freshness budget the estimate is used, then the setpoints ramp to 0
+CTRL_FALLBACK_RAMP = 200.0  # --- W/s, setpoint ramp to 0 W on stale data
+
+# --- StaleGuard states
+GUARD_FRESH = 0
+GUARD_ESTIMATE = 1
+GUARD_RAMP = 2
+GUARD_STATES = ("fresh", "estimate", "ramp")
+
+CTRL_DT_MAX = 5.0           # --- s, a longer gap between updates restarts the controller from the device setpoint
+
+# -----------------------------------------------------------------------------------------
+# --- PID controller ----------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+class PIDController:
+    """output = kff * feedforward + kp * error + integral - kd * d(measurement)/dt, error = measurement - target.
+    The output is slew limited and clamped to [low, high] of this update; the integral then tracks the applied
+    output (back-calculation), so it never winds up while the output is saturated or slew limited"""
+
+    __slots__ = ("kp", "ki", "kd", "kff", "slew_rate", "target", "integral", "output", "measurement", "time")
+
+    def __init__(self, kp, ki, kd=0.0, kff=0.0, slew_rate=None, target=0.0):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.kff = kff
+        self.slew_rate = slew_rate      # --- output units per second, None: no limit
+        self.target = target
+        self.reset()
+
+    def reset(self, output=0.0):
+        # --- Restart from `output` (bumpless: the setpoint the device holds)
+        self.output = float(output)
+        self.integral = 0.0
+        self.measurement = None
+        self.time = None
+
+    def update(self, measurement, feedforward, low, high, now, previous=None):
+        # --- One control step at time `now` (s, monotonic); previous: setpoint the device holds, used to
+        # --- restart after a pause. Returns the new output within [low, high]
+        if self.time is None or now - self.time > CTRL_DT_MAX:
+            self.reset(self.output if previous is None else previous)
+            self.integral = self.output - self.kff * feedforward - self.kp * (measurement - self.target)
+            dt = 0.0
+        else:
+            dt = max(now - self.time, 0.0)
+        error = measurement - self.target
+        derivative = (measurement - self.measurement) / dt if dt and self.kd else 0.0
+        proportional = self.kff * feedforward + self.kp * error - self.kd * derivative
+        output = proportional + self.integral + self.ki * error * dt
+        if self.slew_rate is not None and dt:
+            step = self.slew_rate * dt
+            output = max(self.output - step, min(self.output + step, output))
+        output = max(low, min(high, output))
+        # --- anti-windup: the integral holds what the proportional part does not explain of the applied output
+        self.integral = output - proportional
+        self.output = output
+        self.measurement = measurement
+        self.time = now
+        return output
+
+# -----------------------------------------------------------------------------------------
+# --- Per phase limits --------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+def phase_fuse_power(powers, currents, volts, fuse_current):
+    # --- Per phase (sequences L1, L2, L3): grid power in W the fuse allows in either direction. The fuse trips on
+    # --- current: the part of the metered current the active power does not explain (reactive load) is subtracted
+    # --- scalar on purpose: a loop over three phases, no array library (not a dependency of the EMS)
+    limits = []
+    for power, current, volt in zip(powers, currents, volts):
+        volt = volt or CTRL_PHASE_VOLT
+        limits.append(fuse_current * volt - max((current - CTRL_CURR_RESOLUTION) * volt - abs(power), 0.0))
+    return limits
+
+def phase_battery_window(phase_power, battery_power, fuse_power, low, high):
+    # --- Battery power range within [low, high] (pos is discharge) that keeps the phase grid power within +-fuse_power.
+    # --- phase_power + battery_power is the phase load without the battery. When no battery power keeps the phase
+    # --- within the fuse, the window is the limit that helps most
+    load = phase_power + battery_power
+    window_low = max(low, load - fuse_power)
+    window_high = min(high, load + fuse_power)
+    if window_low > window_high:
+        return (high, high) if load > 0 else (low, low)
+    return window_low, window_high
+
+# -----------------------------------------------------------------------------------------
+# --- State gate --------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+class StateGate:
+    """On as soon as the demand exceeds `start`, off only after the output has been 0 for `hold` seconds
+    (or at once when not allowed). A state change of the inverter is slow, a setpoint change is not:
+    during a short dip the inverter stays on at 0 W and follows the next rise at telegram rate"""
+
+    __slots__ = ("start", "hold", "on", "idle_since", "time")
+
+    def __init__(self, start, hold):
+        self.start = start
+        self.hold = hold
+        self.reset()
+
+    def reset(self):
+        self.on = False
+        self.idle_since = None
+        self.time = None
+
+    def update(self, demand, output, now, allowed=True):
+        # --- demand: e.g. the export in W, output: setpoint of the previous step; returns the new state
+        if self.time is not None and now - self.time > CTRL_DT_MAX:
+            self.reset()    # --- not updated for a while (other mode): start from off
+        self.time = now
+        if not allowed:
+            self.on = False
+            self.idle_since = None
+        elif not self.on:
+            if demand > self.start:
+                self.on = True
+                self.idle_since = None
+        elif output > 0:
+            self.idle_since = None
+        elif self.idle_since is None:
+            self.idle_since = now
+        elif now - self.idle_since >= self.hold:
+            self.on = False
+            self.idle_since = None
+        return self.on
+
+# -----------------------------------------------------------------------------------------
+# --- Stale data guard --------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+class StaleGuard:
+    """Freshness check of the measurements of one control step.
+    GUARD_FRESH    - meter value within the budget: used as is
+    GUARD_ESTIMATE - stale meter value: corrected by the change of the battery AC power since that telegram
+                     (the home load is assumed constant)
+    GUARD_RAMP     - meter value older than budget + estimate time, or stale battery data: setpoints ramp to 0"""
+
+    __slots__ = ("budget", "estimate_time", "ramp_rate", "state", "value_time", "battery_power", "time", "dt")
+
+    def __init__(self, budget=CTRL_FRESHNESS, estimate_time=CTRL_ESTIMATE_TIME, ramp_rate=CTRL_FALLBACK_RAMP):
+        self.budget = budget
+        self.estimate_time = estimate_time
+        self.ramp_rate = ramp_rate      # --- W/s
+        self.state = GUARD_FRESH
+        self.value_time = None          # --- stamp of the last meter value seen
+        self.battery_power = 0.0        # --- battery AC power when that meter value was first used
+        self.time = None                # --- time of the last check
+        self.dt = 0.0                   # --- s since the check before
+
+    def check(self, value_time, battery_power, battery_time, now):
+        # --- value_time / battery_time: time.monotonic() stamps of the meter value and the battery AC power (0.0: never)
+        # --- returns (state, correction in W to add to the meter value)
+        if value_time != self.value_time:
+            self.value_time = value_time
+            self.battery_power = battery_power  # --- battery power that belongs to this meter value
+        self.dt = min(now - self.time, CTRL_DT_MAX) if self.time is not None else 0.0  # --- after a pause: no jump
+        self.time = now
+        meter_age = now - value_time if value_time else float("inf")
+        battery_age = now - battery_time if battery_time else float("inf")
+        if battery_age > self.budget or meter_age > self.budget + self.estimate_time:
+            self.state = GUARD_RAMP
+        elif meter_age > self.budget:
+            self.state = GUARD_ESTIMATE
+        else:
+            self.state = GUARD_FRESH
+        # --- the battery took over (battery_power - then) of the grid power since the telegram
+        correction = self.battery_power - battery_power if self.state == GUARD_ESTIMATE else 0.0
+        return self.state, correction
+
+    def ramp_step(self):
+        # --- W the setpoints may move toward 0 in this step
+        return self.ramp_rate * self.dt
@@ -6,21 +6,16 @@ thread 2 is a TCP client that connects to a server on port 23 and received DSMR
 The DSMR and MODBUS data will be shared as global data
 """
 
+import asyncio
+import calendar
 import threading
-import binascii
 import socket
-import csv
 import time
-import datetime
+import operator
 import random
-import sys
-import os
+import serial
 import globl
 
-from typing import Optional
-from datetime import datetime
-from pymodbus.client import ModbusSerialClient
-
 # -----------------------------------------------------------------
 module_name = "DSMR"
 # -----------------------------------------------------------------
@@ -29,6 +24,37 @@ module_name = "DSMR"
 DSMR_HOST = "192.168.101.182"
 DSMR_PORT = 23
 
+# --- P1-over-TCP endpoints, tried in turn on every reconnect
+DSMR_ENDPOINTS = [(DSMR_HOST, DSMR_PORT)]
+
+# --- Direct P1 cable (DSMR 4/5: 115200 8N1)
+DSMR_SERIAL_DEVICE = "/dev/ttyUSB1"
+DSMR_SERIAL_BAUD = 115200
+
+DSMR_INPUT = "tcp"          # --- "tcp": P1 telnet bridge on DSMR_ENDPOINTS, "serial": P1 cable on DSMR_SERIAL_DEVICE
+
+# --- P1 meters, all read concurrently in one asyncio loop (no thread per meter)
+# --- The first meter is the primary meter: DSMR_OBIS_LIST, printing and the moving average follow this meter
+DSMR_METERS = [
+["main", DSMR_INPUT, DSMR_ENDPOINTS if DSMR_INPUT == "tcp" else DSMR_SERIAL_DEVICE, 1],
+#["sub", "serial", "/dev/ttyUSB2", 0],
+]
+
+# --- Index for DSMR_METERS fields
+IDXP_NAME = 0   # - Meter name (key in globl.METER_POWER)
+IDXP_INPT = 1   # - Input: "tcp" or "serial"
+IDXP_ADDR = 2   # - List of (host, port) endpoints for "tcp", device path for "serial"
+IDXP_SIGN = 3   # - Contribution to the aggregated HOME_POWER: 1 add, -1 subtract, 0 none (e.g. sub-meter behind the main meter)
+
+# --- P1 ingestion settings
+P1_READ_SIZE = 1024         # --- max bytes per read
+P1_QUEUE_SIZE = 4           # --- bounded telegram queue, the oldest telegram is dropped when full
+P1_CONNECT_TIMEOUT = 3.0    # --- seconds to set up the TCP connection
+P1_IDLE_TIMEOUT = 3.0       # --- no bytes for 3s (meter sends every 1s) --> half-open connection, reconnect
+P1_BACKOFF_MIN = 0.05       # --- first reconnect delay in seconds
+P1_BACKOFF_MAX = 5.0        # --- max reconnect delay in seconds
+P1_STOP_POLL = 0.2          # --- how often the stop event is checked
+
 # -----------------------------------------------------------------------------
 # --- DSMR DATA FIELD ---------------------------------------------------------
 # -----------------------------------------------------------------------------
@@ -58,78 +84,94 @@ DSMR_PWR_L3_PROD    = 21 # --- 62.7.0   --- Instantaneous active power L3 (-P)
 DSMR_GAS_SERIAL_NUM = 22 # --- 96.1.0   --- Serial Number 
 DSMR_GAS_TIME_STAMP = 23 # --- 24.2.1   --- Gas timestamp
 DSMR_GAS_VOLUME     = 24 # --- 24.2.1   --- Gas in m3
-
-# --- OBIS LIST --------------------------------------------------------------------------
-
-OBIS_LIST = [
-"1.0.0",
-"0.2.8",
-"96.1.1",
-"1.8.1",
-"1.8.2",
-"2.8.1",
-"2.8.2",
-"96.14.0",
-"1.7.0",
-"2.7.0",
-"32.7.0",
-"52.7.0",
-"72.7.0",
-"31.7.0",
-"51.7.0",
-"71.7.0",
-"21.7.0",
-"41.7.0",
-"61.7.0",
-"22.7.0",
-"42.7.0",
-"62.7.0",
-"96.1.0",
-"24.2.1",
-"24.2.1"
-]
+DSMR_PWR_FAILURES   = 25 # --- 96.7.21  --- Number of power failures in any phase
+DSMR_LONG_PWR_FAILURES = 26 # --- 96.7.9 --- Number of long power failures in any phase
+DSMR_PWR_FAILURE_LOG = 27 # --- 99.97.0 --- Power failure event log: (timestamp end of failure, duration in s)
+DSMR_SAGS_L1        = 28 # --- 32.32.0  --- Number of voltage sags in phase L1
+DSMR_SAGS_L2        = 29 # --- 52.32.0  --- Number of voltage sags in phase L2
+DSMR_SAGS_L3        = 30 # --- 72.32.0  --- Number of voltage sags in phase L3
+DSMR_SWELLS_L1      = 31 # --- 32.36.0  --- Number of voltage swells in phase L1
+DSMR_SWELLS_L2      = 32 # --- 52.36.0  --- Number of voltage swells in phase L2
+DSMR_SWELLS_L3      = 33 # --- 72.36.0  --- Number of voltage swells in phase L3
+DSMR_TEXT_MSG       = 34 # --- 96.13.0  --- Text message (hex coded)
+DSMR_GAS_DEVICE_TYPE = 35 # --- 24.1.0  --- M-Bus channel 1 device type (003: gas)
+DSMR_MBUS2_DEVICE_TYPE = 36 # --- 0-2:24.1.0 --- M-Bus channel 2 device type
+DSMR_MBUS2_SERIAL_NUM = 37 # --- 0-2:96.1.0 --- M-Bus channel 2 serial number
+DSMR_MBUS2_TIME_STAMP = 38 # --- 0-2:24.2.1 --- M-Bus channel 2 time stamp
+DSMR_MBUS2_VALUE    = 39 # --- 0-2:24.2.1 --- M-Bus channel 2 value (m3 or GJ)
+DSMR_MBUS3_DEVICE_TYPE = 40 # --- 0-3:24.1.0 --- M-Bus channel 3 device type
+DSMR_MBUS3_SERIAL_NUM = 41 # --- 0-3:96.1.0 --- M-Bus channel 3 serial number
+DSMR_MBUS3_TIME_STAMP = 42 # --- 0-3:24.2.1 --- M-Bus channel 3 time stamp
+DSMR_MBUS3_VALUE    = 43 # --- 0-3:24.2.1 --- M-Bus channel 3 value (m3 or GJ)
+DSMR_MBUS4_DEVICE_TYPE = 44 # --- 0-4:24.1.0 --- M-Bus channel 4 device type
+DSMR_MBUS4_SERIAL_NUM = 45 # --- 0-4:96.1.0 --- M-Bus channel 4 serial number
+DSMR_MBUS4_TIME_STAMP = 46 # --- 0-4:24.2.1 --- M-Bus channel 4 time stamp
+DSMR_MBUS4_VALUE    = 47 # --- 0-4:24.2.1 --- M-Bus channel 4 value (m3 or GJ)
 
 # --- DSMR OBIS DATA LIST --------------------------------------------------------------------------
 
 # --- Index for DSMR fields ----
 IDXD_NAME = 0   # - Field name 
-IDXD_OBIS = 1   # - OBIS identifier
-IDXD_TYPE = 2   # - Type of value
+IDXD_OBIS = 1   # - OBIS identifier (A-B:C.D.E, B is the M-Bus channel)
+IDXD_TYPE = 2   # - Type of value: "u" number, "s" string, "t" timestamp, "l" event log
 IDXD_SVAL = 3   # - Raw string value
 IDXD_NVAL = 4   # - Nummeric value    
-IDXD_DIVR = 5   # - Divider (/1000)
-IDXD_UNIT = 6   # - Unit (kWh)
+IDXD_UNIT = 5   # - Unit (kWh)
+IDXD_SCAL = 6   # - Scale applied to the decimal value (kW --> W)
 
 # --- supporting variables
 str_value = "mtr-value"
 num_value = 0
 
 DSMR_OBIS_LIST = [
-["DSMR_VERSION", "0.2.8", "u", str_value, num_value, 10, ""],
-["DSMR_TIME_STAMP", "1.0.0", "t", str_value, num_value, 1, ""],
-["DSMR_SERIAL_NUM", "96.1.1", "s", str_value, num_value, 1, ""],
-["DSMR_ENRG_T1_CONS", "1.8.1", "u", str_value, num_value, 1000, "Wh"],
-["DSMR_ENRG_T2_CONS", "1.8.2", "u", str_value, num_value, 1000, "Wh"],
-["DSMR_ENRG_T1_PROD", "2.8.1", "u", str_value, num_value, 1000, "Wh"],
-["DSMR_ENRG_T2_PROD", "2.8.2", "u", str_value, num_value, 1000, "Wh"],
-["DSMR_ACTIVE_TARIF", "96.14.0", "u", str_value, num_value, 1, ""],
-["DSMR_PWR_TOT_CONS", "1.7.0", "u", str_value, num_value, 1, "W CONS"],
-["DSMR_PWR_TOT_PROD", "2.7.0", "u", str_value, num_value, 1, "W PROD"],
-["DSMR_VOLT_L1", "32.7.0", "u", str_value, num_value, 10, "V L1"],
-["DSMR_VOLT_L2", "52.7.0", "u", str_value, num_value, 10, "V L2"],
-["DSMR_VOLT_L3", "72.7.0", "u", str_value, num_value, 10, "V L3"],
-["DSMR_CURR_L1", "31.7.0", "u", str_value, num_value, 1, "A L1"],
-["DSMR_CURR_L2", "51.7.0", "u", str_value, num_value, 1, "A L2"],
-["DSMR_CURR_L3", "71.7.0", "u", str_value, num_value, 1, "A L3"],
-["DSMR_PWR_L1_CONS", "21.7.0", "u", str_value, num_value, 1, "W L1 CONS"],
-["DSMR_PWR_L2_CONS", "41.7.0", "u", str_value, num_value, 1, "W L2 CONS"],
-["DSMR_PWR_L3_CONS", "61.7.0", "u", str_value, num_value, 1, "W L3 CONS"],
-["DSMR_PWR_L1_PROD", "22.7.0", "u", str_value, num_value, 1, "W L1 PROD"],
-["DSMR_PWR_L2_PROD", "42.7.0", "u", str_value, num_value, 1, "W L2 PROD"],
-["DSMR_PWR_L3_PROD", "62.7.0", "u", str_value, num_value, 1, "W L3 PROD"],
-["DSMR_GAS_SERIAL_NUM", "96.1.0", "s", str_value, num_value, 1, ""],
-["DSMR_GAS_TIME_STAMP", "24.2.1", "t", str_value, num_value, 1, ""],
-["DSMR_GAS_VOLUME", "24.2.1", "u", str_value, num_value, 1000, "m3"]
+["DSMR_VERSION", "1-3:0.2.8", "u", str_value, num_value, "", 0.1],
+["DSMR_TIME_STAMP", "0-0:1.0.0", "t", str_value, num_value, "", 1],
+["DSMR_SERIAL_NUM", "0-0:96.1.1", "s", str_value, num_value, "", 1],
+["DSMR_ENRG_T1_CONS", "1-0:1.8.1", "u", str_value, num_value, "Wh", 1],
+["DSMR_ENRG_T2_CONS", "1-0:1.8.2", "u", str_value, num_value, "Wh", 1],
+["DSMR_ENRG_T1_PROD", "1-0:2.8.1", "u", str_value, num_value, "Wh", 1],
+["DSMR_ENRG_T2_PROD", "1-0:2.8.2", "u", str_value, num_value, "Wh", 1],
+["DSMR_ACTIVE_TARIF", "0-0:96.14.0", "u", str_value, num_value, "", 1],
+["DSMR_PWR_TOT_CONS", "1-0:1.7.0", "u", str_value, num_value, "W CONS", 1000],
+["DSMR_PWR_TOT_PROD", "1-0:2.7.0", "u", str_value, num_value, "W PROD", 1000],
+["DSMR_VOLT_L1", "1-0:32.7.0", "u", str_value, num_value, "V L1", 1],
+["DSMR_VOLT_L2", "1-0:52.7.0", "u", str_value, num_value, "V L2", 1],
+["DSMR_VOLT_L3", "1-0:72.7.0", "u", str_value, num_value, "V L3", 1],
+["DSMR_CURR_L1", "1-0:31.7.0", "u", str_value, num_value, "A L1", 1],
+["DSMR_CURR_L2", "1-0:51.7.0", "u", str_value, num_value, "A L2", 1],
+["DSMR_CURR_L3", "1-0:71.7.0", "u", str_value, num_value, "A L3", 1],
+["DSMR_PWR_L1_CONS", "1-0:21.7.0", "u", str_value, num_value, "W L1 CONS", 1000],
+["DSMR_PWR_L2_CONS", "1-0:41.7.0", "u", str_value, num_value, "W L2 CONS", 1000],
+["DSMR_PWR_L3_CONS", "1-0:61.7.0", "u", str_value, num_value, "W L3 CONS", 1000],
+["DSMR_PWR_L1_PROD", "1-0:22.7.0", "u", str_value, num_value, "W L1 PROD", 1000],
+["DSMR_PWR_L2_PROD", "1-0:42.7.0", "u", str_value, num_value, "W L2 PROD", 1000],
+["DSMR_PWR_L3_PROD", "1-0:62.7.0", "u", str_value, num_value, "W L3 PROD", 1000],
+["DSMR_GAS_SERIAL_NUM", "0-1:96.1.0", "s", str_value, num_value, "", 1],
+["DSMR_GAS_TIME_STAMP", "0-1:24.2.1", "t", str_value, num_value, "", 1],
+["DSMR_GAS_VOLUME", "0-1:24.2.1", "u", str_value, num_value, "m3", 1],
+["DSMR_PWR_FAILURES", "0-0:96.7.21", "u", str_value, num_value, "", 1],
+["DSMR_LONG_PWR_FAILURES", "0-0:96.7.9", "u", str_value, num_value, "", 1],
+["DSMR_PWR_FAILURE_LOG", "1-0:99.97.0", "l", str_value, num_value, "", 1],
+["DSMR_SAGS_L1", "1-0:32.32.0", "u", str_value, num_value, "L1", 1],
+["DSMR_SAGS_L2", "1-0:52.32.0", "u", str_value, num_value, "L2", 1],
+["DSMR_SAGS_L3", "1-0:72.32.0", "u", str_value, num_value, "L3", 1],
+["DSMR_SWELLS_L1", "1-0:32.36.0", "u", str_value, num_value, "L1", 1],
+["DSMR_SWELLS_L2", "1-0:52.36.0", "u", str_value, num_value, "L2", 1],
+["DSMR_SWELLS_L3", "1-0:72.36.0", "u", str_value, num_value, "L3", 1],
+["DSMR_TEXT_MSG", "0-0:96.13.0", "s", str_value, num_value, "", 1],
+["DSMR_GAS_DEVICE_TYPE", "0-1:24.1.0", "u", str_value, num_value, "", 1],
+["DSMR_MBUS2_DEVICE_TYPE", "0-2:24.1.0", "u", str_value, num_value, "", 1],
+["DSMR_MBUS2_SERIAL_NUM", "0-2:96.1.0", "s", str_value, num_value, "", 1],
+["DSMR_MBUS2_TIME_STAMP", "0-2:24.2.1", "t", str_value, num_value, "", 1],
+["DSMR_MBUS2_VALUE", "0-2:24.2.1", "u", str_value, num_value, "", 1],
+["DSMR_MBUS3_DEVICE_TYPE", "0-3:24.1.0", "u", str_value, num_value, "", 1],
+["DSMR_MBUS3_SERIAL_NUM", "0-3:96.1.0", "s", str_value, num_value, "", 1],
+["DSMR_MBUS3_TIME_STAMP", "0-3:24.2.1", "t", str_value, num_value, "", 1],
+["DSMR_MBUS3_VALUE", "0-3:24.2.1", "u", str_value, num_value, "", 1],
+["DSMR_MBUS4_DEVICE_TYPE", "0-4:24.1.0", "u", str_value, num_value, "", 1],
+["DSMR_MBUS4_SERIAL_NUM", "0-4:96.1.0", "s", str_value, num_value, "", 1],
+["DSMR_MBUS4_TIME_STAMP", "0-4:24.2.1", "t", str_value, num_value, "", 1],
+["DSMR_MBUS4_VALUE", "0-4:24.2.1", "u", str_value, num_value, "", 1]
 ]
 
 # -----------------------------------------------------------------------------------------
@@ -155,119 +197,559 @@ def print_string_value(item):
             print(f"[DSMR] {DSMR_OBIS_LIST[item][IDXD_NAME]}\t\t{DSMR_OBIS_LIST[item][IDXD_OBIS]} \t = {DSMR_OBIS_LIST[item][IDXD_SVAL]}")
     
 # -----------------------------------------------------------------------------------------
+# --- DSMR typed record --------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+# --- Attribute name per DSMR_OBIS_LIST row (DSMR_PWR_TOT_CONS --> pwr_tot_cons)
+SLOT_ATTR = [row[IDXD_NAME][5:].lower() for row in DSMR_OBIS_LIST]
+
+class DsmrRecord:
+    """Typed values of one P1 telegram, one attribute per DSMR_OBIS_LIST row.
+    raw holds the unconverted value string per row (indexed by the DSMR_* constants)"""
+
+    __slots__ = tuple(SLOT_ATTR) + ("raw", "lines", "dst", "changed", "changed_at")
+
+    def __init__(self):
+        for attr, default in SLOT_DEFAULT:
+            setattr(self, attr, default)
+        self.raw = [""] * len(DSMR_OBIS_LIST)
+        self.lines = frozenset()  # --- lines of the last parsed telegram
+        self.dst = False        # --- DSMR_TIME_STAMP is summer time (S suffix)
+        self.changed = []       # --- slots that changed in the last parsed telegram
+        self.changed_at = [0] * len(DSMR_OBIS_LIST)  # --- epoch of the telegram in which each slot last changed
+
+# --- Initial value per type of value: number, string, timestamp (epoch), event log
+DSMR_TYPE_DEFAULT = {"u": 0, "s": "", "t": 0, "l": ()}
+SLOT_DEFAULT = tuple((SLOT_ATTR[slot], DSMR_TYPE_DEFAULT[row[IDXD_TYPE]]) for slot, row in enumerate(DSMR_OBIS_LIST))
+
+def compile_obis_slots():
+    # --- Build OBIS --> ((slot, attribute, type, scale), ...) with one entry per value group "(..)" on the line
+    table = {}
+    for slot in range(len(DSMR_OBIS_LIST)):
+        row = DSMR_OBIS_LIST[slot]
+        table.setdefault(row[IDXD_OBIS], []).append((slot, SLOT_ATTR[slot], row[IDXD_TYPE], row[IDXD_SCAL]))
+    return {obis: tuple(slots) for obis, slots in table.items()}
+
+OBIS_SLOT = compile_obis_slots()
+OBIS_SINGLE = {obis: slots[0] for obis, slots in OBIS_SLOT.items() if len(slots) == 1}    # --- one value on the line
+OBIS_GROUPS = {obis: slots for obis, slots in OBIS_SLOT.items() if len(slots) > 1}       # --- e.g. gas: time stamp + value
+
+# -----------------------------------------------------------------------------------------
+
+# --- DSMR time stamps are local Dutch time: YYMMDDhhmmss + W (winter, CET) or S (summer, CEST)
+DSMR_TZ_OFFSET = {"W": 3600, "S": 7200}
+TIME_STAMP_CACHE = {}       # --- "YYMMDDhh" + W/S --> epoch at the start of that hour
+
+def decode_time_stamp(stamp):
+    # --- "251030161306W" --> epoch seconds (UTC), the calendar math is only done once per hour
+    if len(stamp) < 12:
+        return 0
+    key = stamp[:8] + stamp[12:]
+    base = TIME_STAMP_CACHE.get(key)
+    if base is None:
+        if len(TIME_STAMP_CACHE) > 16: # --- several meters or M-Bus channels may be in different hours
+            TIME_STAMP_CACHE.clear()
+        base = calendar.timegm((2000 + int(stamp[0:2]), int(stamp[2:4]), int(stamp[4:6]), int(stamp[6:8]), 0, 0)) - DSMR_TZ_OFFSET.get(stamp[12:], 3600)
+        TIME_STAMP_CACHE[key] = base
+    return base + int(stamp[8:10]) * 60 + int(stamp[10:12])
+
+def parse_event_log(body):
+    # --- "1)(0-0:96.7.19)(221111154937W)(0000001025*s" --> ((epoch end of failure, 1025),)
+    groups = body.split(")(")
+    return tuple((decode_time_stamp(groups[indx]), int(groups[indx + 1].partition("*")[0])) for indx in range(2, len(groups) - 1, 2))
+
+def parse_telegram(telegram, record=None):
+    # --- Single pass over the telegram lines, each matched line is converted via its precompiled slot(s)
+    # --- With the record of the previous telegram, lines equal to a line of that telegram are skipped with one set
+    # --- lookup (most values do not change every second); the slots that did change are listed in record.changed
+    # --- Into a new record (all 48 fields) it costs about as much as the old find() scan of 25 fields; the gain is
+    # --- in reusing the record per meter (bench_dsmr.py reports both)
+    if record is None:
+        record = DsmrRecord()
+    raw = record.raw
+    changed = record.changed
+    changed.clear()
+    obis_single = OBIS_SINGLE
+    previous_lines = record.lines
+    lines = telegram.splitlines()
+    record.lines = frozenset(lines)
+    for line in lines:
+        if line in previous_lines or line[-1:] != ")": # --- unchanged, or header / CRC / empty line
+            continue
+        # --- "1-0:1.7.0(00.195*kW)" --> "1-0:1.7.0", "00.195*kW"; unknown OBIS codes are skipped
+        obis, _, body = line.partition("(")
+        entry = obis_single.get(obis)
+        if entry is not None:
+            body = body[:-1]
+            slot, attr, kind, scale = entry
+            if raw[slot] == body: # --- unchanged
+                continue
+            raw[slot] = body
+            changed.append(slot)
+            if kind == "u":
+                if scale == 1: # --- "230.9*V" --> 230.9
+                    setattr(record, attr, float(body.partition("*")[0]))
+                else: # --- "00.195*kW" --> 0.195 * 1000 = 195.0 W
+                    setattr(record, attr, round(float(body.partition("*")[0]) * scale, 3))
+            elif kind == "t": # --- "251030161306W" --> epoch
+                setattr(record, attr, decode_time_stamp(body))
+            elif kind == "l": # --- event log with a variable number of value groups
+                setattr(record, attr, parse_event_log(body))
+            else: # --- string
+                setattr(record, attr, body)
+            continue
+        slots = OBIS_GROUPS.get(obis)
+        if slots is None:
+            continue
+        # --- one value per group on the line: "251030161002W)(07850.922*m3"
+        for (slot, attr, kind, scale), group in zip(slots, body[:-1].split(")(")):
+            if raw[slot] == group:
+                continue
+            raw[slot] = group
+            changed.append(slot)
+            if kind == "u":
+                setattr(record, attr, round(float(group.partition("*")[0]) * scale, 3))
+            elif kind == "t":
+                setattr(record, attr, decode_time_stamp(group))
+            else:
+                setattr(record, attr, group)
+    # --- time stamp (epoch) of the telegram in which each changed value was seen
+    changed_at = record.changed_at
+    time_stamp = record.time_stamp
+    for slot in changed:
+        changed_at[slot] = time_stamp
+    record.dst = raw[DSMR_TIME_STAMP].endswith("S")
+    return record
 
-def lookup_dsmr_value(telegram):
-    # Lookup Electric values and DSMR_GAS_VOLUME separately (-1)
-    for item in range(len(DSMR_OBIS_LIST)-1):   
-        indx_obis = telegram.find(DSMR_OBIS_LIST[item][IDXD_OBIS])
-        indx_open_bracket = telegram[indx_obis:].find("(") + indx_obis + 1
-        indx_close_bracket = telegram[indx_open_bracket:].find(")") + indx_open_bracket
-        DSMR_OBIS_LIST[item][IDXD_SVAL] = telegram[indx_open_bracket:indx_close_bracket]
+# -----------------------------------------------------------------------------------------
+
+def lookup_dsmr_value(telegram, record=None):
+    # --- Parse the telegram and make the changed values available in DSMR_OBIS_LIST (used for printing)
+    record = parse_telegram(telegram, record)
+    for item in record.changed:
+        DSMR_OBIS_LIST[item][IDXD_SVAL] = record.raw[item]
         if (DSMR_OBIS_LIST[item][IDXD_TYPE] == "u"): # if unsigned int --> number
-            DSMR_OBIS_LIST[item][IDXD_NVAL] = int(''.join(filter(str.isdigit, DSMR_OBIS_LIST[item][IDXD_SVAL]))) / DSMR_OBIS_LIST[item][IDXD_DIVR]
-            print_numeric_value(item)
-        else: # No need to print the nummeric value and unit because string or timestamp
-            print_string_value(item)
-            
-    # --- Calculate DSMR_GAS_VOLUME separately (+1)
-    indx_open_bracket = telegram[indx_close_bracket:].find("(") + indx_close_bracket + 1 # --- find next opening bracket
-    indx_close_bracket = telegram[indx_open_bracket:].find(")") + indx_open_bracket      # --- find next closing bracket  
-    item += 1 # this applies to the next row: DSMR_GAS_VOLUME
-    DSMR_OBIS_LIST[item][IDXD_SVAL] = telegram[indx_open_bracket:indx_close_bracket - 1] # The -1 is needed to remove the extra 3 from "m3"
-    DSMR_OBIS_LIST[item][IDXD_NVAL] = int(''.join(filter(str.isdigit, DSMR_OBIS_LIST[item][IDXD_SVAL]))) / DSMR_OBIS_LIST[item][IDXD_DIVR]
-    # --- Only print DSMR data if requested
-    if globl.show_dsmr: print(f"[DSMR] {DSMR_OBIS_LIST[item][IDXD_NAME]}\t\t{DSMR_OBIS_LIST[item][IDXD_OBIS]} \t = {DSMR_OBIS_LIST[item][IDXD_SVAL]} \t = {DSMR_OBIS_LIST[item][IDXD_NVAL]} {DSMR_OBIS_LIST[item][IDXD_UNIT]}")
+            DSMR_OBIS_LIST[item][IDXD_NVAL] = getattr(record, SLOT_ATTR[item])
+    # --- Print all values if requested, only the nummeric values come with a unit
+    if globl.show_dsmr:
+        for item in range(len(DSMR_OBIS_LIST)):
+            if (DSMR_OBIS_LIST[item][IDXD_TYPE] == "u"):
+                print_numeric_value(item)
+            else:
+                print_string_value(item)
     # --- reset print flag (always)
     globl.show_dsmr = False
+    return record
 
 # -----------------------------------------------------------------------------------------
+# --- DSMR change subscribers -------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
 
-def dsmr_thread_fn(dsmr_stop_event: threading.Event, interval: float = 2.0):
+# --- Callbacks fn(meter_name, time_stamp, changes) with changes = {attribute: value} of the fields that changed
+# --- They run on the DSMR thread for every telegram, so keep them short (e.g. put the changes on a queue)
+DSMR_SUBSCRIBERS = []
 
-    cntr = 0
-    host = "192.168.101.182"
-    port = 23
-    p1_counter = 0
-
-    # --- moving average
-    win_2 = []
-    win_3 = []
-    win_4 = []
-    win_5 = []
-    win_6 = []
-    win_8 = []
+def subscribe(callback):
+    if callback not in DSMR_SUBSCRIBERS:
+        DSMR_SUBSCRIBERS.append(callback)
 
-    
-    while not dsmr_stop_event.is_set():
+def unsubscribe(callback):
+    if callback in DSMR_SUBSCRIBERS:
+        DSMR_SUBSCRIBERS.remove(callback)
+
+def publish_changes(name, record):
+    # --- Hand only the changed fields of the last telegram to the subscribers
+    if not DSMR_SUBSCRIBERS or not record.changed:
+        return
+    changes = {SLOT_ATTR[slot]: getattr(record, SLOT_ATTR[slot]) for slot in record.changed}
+    for callback in list(DSMR_SUBSCRIBERS):
+        try:
+            callback(name, record.time_stamp, changes)
+        except Exception as e:
+            globl.log_debug(module_name, f"Subscriber {callback} failed: {e}")
+
+# -----------------------------------------------------------------------------------------
+# --- New telegram signal -----------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+class TelegramSignal:
+    """Wakes waiters on other threads / event loops when a telegram has been published to HOME_POWER.
+    seq counts the published telegrams, arrival is the time.monotonic() the last one was read from the meter"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.arrival = 0.0
+        self.waiters = set()    # --- (event loop, asyncio.Event)
+
+    def notify(self, arrival):
+        with self.lock:
+            self.seq += 1
+            self.arrival = arrival
+            waiters = list(self.waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:    # --- loop already closed
+                pass
+
+    def latest(self):
+        with self.lock:
+            return self.seq, self.arrival
+
+    async def wait(self, seq, timeout):
+        # --- True as soon as a telegram newer than seq is published, False after timeout seconds
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self.lock:
+            if self.seq != seq:
+                return True
+            self.waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self.lock:
+                self.waiters.discard(waiter)
+
+# --- Set by consume_telegrams, the BATT control tick waits on it
+telegram_signal = TelegramSignal()
+
+# -----------------------------------------------------------------------------------------
+# --- P1 framer ---------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+# --- A P1 telegram runs from "/" up to and including "!" followed by the CRC16 as 4 hex chars
+P1_FRAME_MAX = 4096         # --- max size of one telegram before the buffer is resynced
+P1_LATE_FACTOR = 1.5        # --- a telegram is late when it arrives after 1.5x the meter interval
+
+def compile_crc16_table(poly=0xA001):
+    # --- CRC16/ARC lookup table (x16 + x15 + x2 + 1, LSB first) as used by DSMR 4 and 5
+    table = []
+    for byte in range(256):
+        crc = byte
+        for bit in range(8):
+            crc = (crc >> 1) ^ poly if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+CRC16_TABLE = compile_crc16_table()
+
+def crc16(data, crc=0):
+    # --- Table driven CRC16 over bytes, bytearray or memoryview
+    table = CRC16_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+class P1Framer:
+    """Cuts complete "/...!XXXX" telegrams out of a P1 byte stream and checks the CRC16.
+    Received bytes are collected in one reusable bytearray, valid telegrams are returned as bytes"""
+
+    def __init__(self, interval=1.0, max_size=P1_FRAME_MAX):
+        self.buffer = bytearray()
+        self.interval = interval        # --- meter telegram interval in seconds (DSMR 5: 1s)
+        self.max_size = max_size
+        self.last_time = 0.0            # --- monotonic time of the last valid telegram
+        self.frames = 0                 # --- valid telegrams
+        self.rejected = 0               # --- telegrams with a wrong or missing CRC
+        self.resynced = 0               # --- times bytes were skipped to find the next "/" header
+        self.late = 0                   # --- valid telegrams arriving later than expected
+
+    def reset(self):
+        # --- Drop any partial telegram (e.g. after a reconnect), the counters are kept
+        self.buffer.clear()
+        self.last_time = 0.0
+
+    def feed(self, data, now=None):
+        # --- Append received bytes and return a list with all complete and valid telegrams
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        while buffer:
+            start = buffer.find(b"/")
+            if start != 0:
+                if buffer[:start if start > 0 else len(buffer)].strip(): # --- only whitespace between telegrams is expected
+                    self.resynced += 1
+                if start < 0:
+                    buffer.clear()
+                    break
+                del buffer[:start]
+            bang = buffer.find(b"!")
+            if bang < 0 or len(buffer) < bang + 5: # --- telegram or CRC not complete yet
+                if len(buffer) > self.max_size: # --- no end in sight, skip this header
+                    self.resynced += 1
+                    del buffer[:1]
+                    continue
+                break
+            restart = buffer.find(b"/", 1, bang)
+            if restart > 0: # --- new header before the end: the previous telegram was cut short
+                self.resynced += 1
+                del buffer[:restart]
+                continue
+            with memoryview(buffer) as view:
+                crc = crc16(view[:bang + 1])
+            try:
+                valid = crc == int(bytes(buffer[bang + 1:bang + 5]), 16)
+            except ValueError:
+                valid = False
+            if valid:
+                frames.append(bytes(buffer[:bang + 5]))
+                self.frames += 1
+                if now is None:
+                    now = time.monotonic()
+                if self.last_time and (now - self.last_time) > P1_LATE_FACTOR * self.interval:
+                    self.late += 1
+                self.last_time = now
+            else:
+                self.rejected += 1
+            del buffer[:bang + 5]
+        return frames
+
+    def summary(self):
+        return f"frames:{self.frames} rejected:{self.rejected} resynced:{self.resynced} late:{self.late}"
+
+# -----------------------------------------------------------------------------------------
+# --- P1 ingestion (asyncio) --------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+class P1Source:
+    """State of one P1 meter: framer, last record, HOME_POWER style table and connection counters"""
+
+    def __init__(self, name, interval=1.0, sign=1):
+        self.name = name
+        self.sign = sign        # --- contribution to the aggregated HOME_POWER
+        self.framer = P1Framer(interval)
+        self.record = DsmrRecord()
+        self.power = [list(row) for row in globl.HOME_POWER]  # --- per meter copy of the HOME_POWER table
+        self.attempt = 0        # --- failed connects since the last valid telegram
+        self.reconnects = 0     # --- connections lost or failed
+        self.dropped = 0        # --- telegrams dropped because the queue was full
+        self.spacing = 0        # --- seconds between the meter time stamps of the last two telegrams
+
+    def summary(self):
+        return f"{self.name} {self.framer.summary()} dropped:{self.dropped} reconnects:{self.reconnects} spacing:{self.spacing}s"
+
+def backoff_delay(attempt):
+    # --- Exponential backoff with jitter: 50ms, 100ms, 200ms ... up to P1_BACKOFF_MAX
+    delay = min(P1_BACKOFF_MAX, P1_BACKOFF_MIN * (2 ** attempt))
+    return delay * random.uniform(0.5, 1.0)
+
+def set_keepalive(sock):
+    # --- Let the kernel detect a dead peer as well (options are not available on every OS)
+    if sock is None:
+        return
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 2)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 1)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+
+def put_telegram(source, queue, frame):
+    # --- Keep the newest telegrams: when the queue is full the oldest one is dropped
+    if queue.full():
+        queue.get_nowait()
+        source.dropped += 1
+    queue.put_nowait((source, frame, time.monotonic()))
+
+async def reconnect_delay(source):
+    # --- Count the lost connection and wait before the next attempt
+    source.reconnects += 1
+    delay = backoff_delay(source.attempt)
+    source.attempt += 1
+    globl.log_debug(module_name, f"P1 {source.summary()} - reconnecting in {delay:.2f}s...")
+    await asyncio.sleep(delay)
+
+async def read_tcp(source, endpoints, queue, stop_event):
+    # --- Read P1 telegrams over TCP, reconnect with backoff when the connection fails or goes quiet
+    index = 0
+    while not stop_event.is_set():
+        host, port = endpoints[index % len(endpoints)]
+        writer = None
         try:
             globl.log_debug(module_name, f"Connecting to Telnet server {host}:{port}...")
-            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client.connect((host, port))
-            client.settimeout(10)  # connection timeout
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), P1_CONNECT_TIMEOUT)
+            set_keepalive(writer.get_extra_info("socket"))
             globl.log_debug(module_name, f"Connected to {host}:{port}")
-            client.settimeout(3)  # read timeout
-            
-            while not dsmr_stop_event.is_set():
-                data = client.recv(1024)
+            source.framer.reset()
+            while not stop_event.is_set():
+                data = await asyncio.wait_for(reader.read(P1_READ_SIZE), P1_IDLE_TIMEOUT)
                 if not data:
                     globl.log_debug(module_name, f"Connection closed by server {host}:{port}")
                     break
-                telegram = data.decode(errors='ignore')
-                if len(telegram) > 800:  # --- Only analyse p1 telegram if complete (>800char)
-                    lookup_dsmr_value(telegram)
-                    # make available globally to all thread via global variables
-                    globl.power_cons = DSMR_OBIS_LIST[DSMR_PWR_TOT_CONS][IDXD_NVAL]
-                    globl.power_prod = DSMR_OBIS_LIST[DSMR_PWR_TOT_PROD][IDXD_NVAL]
-                    globl.power_tot = globl.power_cons - globl.power_prod 
-                    globl.power_l1 = DSMR_OBIS_LIST[DSMR_PWR_L1_CONS][IDXD_NVAL] - DSMR_OBIS_LIST[DSMR_PWR_L1_PROD][IDXD_NVAL]
-                    globl.power_l2 = DSMR_OBIS_LIST[DSMR_PWR_L2_CONS][IDXD_NVAL] - DSMR_OBIS_LIST[DSMR_PWR_L2_PROD][IDXD_NVAL]
-                    globl.power_l3 = DSMR_OBIS_LIST[DSMR_PWR_L3_CONS][IDXD_NVAL] - DSMR_OBIS_LIST[DSMR_PWR_L3_PROD][IDXD_NVAL]
-                    # Fill HOME_POWER array
-                    globl.HOME_POWER[globl.HOME_PWR_TIME_STAMP][globl.IDXH_HVAL] = DSMR_OBIS_LIST[DSMR_TIME_STAMP][IDXD_NVAL]
-                    globl.HOME_POWER[globl.HOME_PWR_CONS][globl.IDXH_HVAL] = DSMR_OBIS_LIST[DSMR_PWR_TOT_CONS][IDXD_NVAL]
-                    globl.HOME_POWER[globl.HOME_PWR_PROD][globl.IDXH_HVAL] = DSMR_OBIS_LIST[DSMR_PWR_TOT_PROD][IDXD_NVAL]
-                    globl.HOME_POWER[globl.HOME_PWR_TOT][globl.IDXH_HVAL] = DSMR_OBIS_LIST[DSMR_PWR_TOT_CONS][IDXD_NVAL] - DSMR_OBIS_LIST[DSMR_PWR_TOT_PROD][IDXD_NVAL]
-                    globl.HOME_POWER[globl.HOME_PWR_L1][globl.IDXH_HVAL] = DSMR_OBIS_LIST[DSMR_PWR_L1_CONS][IDXD_NVAL] - DSMR_OBIS_LIST[DSMR_PWR_L1_PROD][IDXD_NVAL]
-                    globl.HOME_POWER[globl.HOME_PWR_L2][globl.IDXH_HVAL] = DSMR_OBIS_LIST[DSMR_PWR_L2_CONS][IDXD_NVAL] - DSMR_OBIS_LIST[DSMR_PWR_L2_PROD][IDXD_NVAL]                    
-                    globl.HOME_POWER[globl.HOME_PWR_L3][globl.IDXH_HVAL] = DSMR_OBIS_LIST[DSMR_PWR_L3_CONS][IDXD_NVAL] - DSMR_OBIS_LIST[DSMR_PWR_L3_PROD][IDXD_NVAL]
-
-                    # calculate moving average (voortschrijdend gemiddelde)
-                    win_2.append(globl.HOME_POWER[globl.HOME_PWR_TOT][globl.IDXH_HVAL])
-                    win_3.append(globl.HOME_POWER[globl.HOME_PWR_TOT][globl.IDXH_HVAL])
-                    win_4.append(globl.HOME_POWER[globl.HOME_PWR_TOT][globl.IDXH_HVAL])
-                    win_5.append(globl.HOME_POWER[globl.HOME_PWR_TOT][globl.IDXH_HVAL])
-                    win_6.append(globl.HOME_POWER[globl.HOME_PWR_TOT][globl.IDXH_HVAL])
-                    win_8.append(globl.HOME_POWER[globl.HOME_PWR_TOT][globl.IDXH_HVAL])
-
-                    # keep only last N values
-                    if len(win_2) > 2: win_2.pop(0)
-                    if len(win_3) > 3: win_3.pop(0)
-                    if len(win_4) > 4: win_4.pop(0)
-                    if len(win_5) > 5: win_5.pop(0)
-                    if len(win_6) > 6: win_6.pop(0)
-                    if len(win_8) > 8: win_8.pop(0)
-
-                    if globl.show_mov_avrg: 
-                        # device based on window size
-                        ma_2 = sum(win_2) / 2
-                        ma_3 = sum(win_3) / 3
-                        ma_4 = sum(win_4) / 4
-                        ma_5 = sum(win_5) / 5
-                        ma_6 = sum(win_6) / 6
-                        ma_8 = sum(win_8) / 8
-                        # print value and moving average with 0 decimals
-                        print(f"{globl.HOME_POWER[globl.HOME_PWR_TOT][globl.IDXH_HVAL]:.0f}; {ma_2:.0f}; {ma_3:.0f}; {ma_4:.0f}; {ma_5:.0f}; {ma_6:.0f}; {ma_8:.0f}")
-
-                    
-        except Exception as e:
-            globl.log_debug(module_name, f"Exception error: {e}")
-            globl.log_debug(module_name, "Reconnecting in 5 seconds...")
-            time.sleep(5)
+                for frame in source.framer.feed(data):  # --- Only complete telegrams with a valid CRC
+                    source.attempt = 0
+                    put_telegram(source, queue, frame)
+        except asyncio.TimeoutError:
+            globl.log_debug(module_name, f"No data from {host}:{port} within {P1_IDLE_TIMEOUT}s")
+        except OSError as e:
+            globl.log_debug(module_name, f"Connection error {host}:{port}: {e}")
         finally:
+            if writer is not None:
+                writer.close()
+        if stop_event.is_set():
+            break
+        index += 1
+        await reconnect_delay(source)
+
+async def read_serial(source, device, queue, stop_event):
+    # --- Read P1 telegrams from a serial port, the OS buffer is drained in bulk whenever it is readable
+    loop = asyncio.get_running_loop()
+    while not stop_event.is_set():
+        port = None
+        try:
+            globl.log_debug(module_name, f"Opening P1 serial port {device}...")
+            port = serial.Serial(device, baudrate=DSMR_SERIAL_BAUD, bytesize=8, parity="N", stopbits=1, timeout=0)
+            globl.log_debug(module_name, f"Opened {device}")
+            source.framer.reset()
+            readable = asyncio.Event()
+            loop.add_reader(port.fileno(), readable.set)
             try:
-                client.close()
-            except:
-                pass
+                while not stop_event.is_set():
+                    await asyncio.wait_for(readable.wait(), P1_IDLE_TIMEOUT)
+                    readable.clear()
+                    data = port.read(port.in_waiting or 1)  # --- non-blocking (timeout=0), all bytes the OS has buffered
+                    for frame in source.framer.feed(data):  # --- Only complete telegrams with a valid CRC
+                        source.attempt = 0
+                        put_telegram(source, queue, frame)
+            finally:
+                loop.remove_reader(port.fileno())
+        except asyncio.TimeoutError:
+            globl.log_debug(module_name, f"No data from {device} within {P1_IDLE_TIMEOUT}s")
+        except (OSError, serial.SerialException) as e:
+            globl.log_debug(module_name, f"Serial error {device}: {e}")
+        finally:
+            if port is not None:
+                port.close()
+        if stop_event.is_set():
+            break
+        await reconnect_delay(source)
+
+# -----------------------------------------------------------------------------------------
+
+def update_moving_average(value):
+    # --- Moving average (voortschrijdend gemiddelde) and EWMA of the total home power
+    home_pwr_stats = globl.home_pwr_stats
+    home_pwr_stats.update(value)
+    if globl.show_mov_avrg:
+        # print value, moving averages and EWMA with 0 decimals
+        print(f"{value:.0f}; " + "; ".join(f"{window.mean():.0f}" for window in home_pwr_stats.windows.values())
+              + "; " + "; ".join(f"{ewma:.0f}" for ewma in home_pwr_stats.ewmas.values()))
+
+def update_quarter_peak(record):
+    # --- Quarter-hour average import and monthly peak of the primary (billing) meter
+    if record.time_stamp and globl.quarter_peak.update(record.time_stamp, (record.enrg_t1_cons + record.enrg_t2_cons) * 1000, record.pwr_tot_cons):
+        globl.log_debug(module_name, f"Monthly peak {globl.quarter_peak.month}: {globl.quarter_peak.peak:.0f} W")
+
+def fill_home_power(home_power, record, arrival):
+    # --- Fill a HOME_POWER style table from one telegram (signed values: consume is positive)
+    # --- arrival: time.monotonic() the telegram was read, the age of every value
+    home_power[globl.HOME_PWR_TIME_STAMP][globl.IDXH_HVAL] = record.time_stamp
+    home_power[globl.HOME_PWR_CONS][globl.IDXH_HVAL] = record.pwr_tot_cons
+    home_power[globl.HOME_PWR_PROD][globl.IDXH_HVAL] = record.pwr_tot_prod
+    home_power[globl.HOME_PWR_TOT][globl.IDXH_HVAL] = record.pwr_tot_cons - record.pwr_tot_prod
+    home_power[globl.HOME_PWR_L1][globl.IDXH_HVAL] = record.pwr_l1_cons - record.pwr_l1_prod
+    home_power[globl.HOME_PWR_L2][globl.IDXH_HVAL] = record.pwr_l2_cons - record.pwr_l2_prod
+    home_power[globl.HOME_PWR_L3][globl.IDXH_HVAL] = record.pwr_l3_cons - record.pwr_l3_prod
+    for row in home_power:
+        row[globl.IDXH_TIME] = arrival
+
+# --- Current (A, unsigned) and voltage (V) of L1, L2, L3 of one record in one call
+PHASE_VALUES = operator.attrgetter("curr_l1", "curr_l2", "curr_l3", "volt_l1", "volt_l2", "volt_l3")
 
+def fill_phase_values(record, arrival):
+    # --- Per phase current / voltage of the primary meter (currents of several meters do not add up)
+    values = PHASE_VALUES(record)
+    globl.PHASE_CURR[:] = values[:3]
+    globl.PHASE_VOLT[:] = values[3:]
+    globl.PHASE_TIME = arrival
+
+def aggregate_home_power(sources):
+    # --- HOME_POWER = sum of all meters weighted with their sign, time stamp of the primary meter
+    # --- the age of a sum is the age of its oldest part
+    globl.HOME_POWER[globl.HOME_PWR_TIME_STAMP][globl.IDXH_HVAL] = sources[0].power[globl.HOME_PWR_TIME_STAMP][globl.IDXH_HVAL]
+    globl.HOME_POWER[globl.HOME_PWR_TIME_STAMP][globl.IDXH_TIME] = sources[0].power[globl.HOME_PWR_TIME_STAMP][globl.IDXH_TIME]
+    for row in range(globl.HOME_PWR_CONS, len(globl.HOME_POWER)):
+        value = 0
+        value_time = None
+        for source in sources:
+            if source.sign:
+                value += source.sign * source.power[row][globl.IDXH_HVAL]
+                source_time = source.power[row][globl.IDXH_TIME]
+                value_time = source_time if value_time is None else min(value_time, source_time)
+        globl.HOME_POWER[row][globl.IDXH_HVAL] = value
+        globl.HOME_POWER[row][globl.IDXH_TIME] = value_time or 0.0
+    # --- make available globally to all thread via global variables
+    globl.power_cons = globl.HOME_POWER[globl.HOME_PWR_CONS][globl.IDXH_HVAL]
+    globl.power_prod = globl.HOME_POWER[globl.HOME_PWR_PROD][globl.IDXH_HVAL]
+    globl.power_tot = globl.HOME_POWER[globl.HOME_PWR_TOT][globl.IDXH_HVAL]
+    globl.power_l1 = globl.HOME_POWER[globl.HOME_PWR_L1][globl.IDXH_HVAL]
+    globl.power_l2 = globl.HOME_POWER[globl.HOME_PWR_L2][globl.IDXH_HVAL]
+    globl.power_l3 = globl.HOME_POWER[globl.HOME_PWR_L3][globl.IDXH_HVAL]
+
+def publish_telegram(source, sources, telegram, arrival=None):
+    # --- Parse the telegram into the meter's record, update its table and the aggregate
+    # --- arrival: time.monotonic() the telegram was read (default: now)
+    arrival = time.monotonic() if arrival is None else arrival
+    last_time_stamp = source.record.time_stamp
+    if source is sources[0]:
+        lookup_dsmr_value(telegram, source.record)
+    else:
+        parse_telegram(telegram, source.record)
+    if last_time_stamp:
+        source.spacing = source.record.time_stamp - last_time_stamp
+    fill_home_power(source.power, source.record, arrival)
+    if source is sources[0]:
+        fill_phase_values(source.record, arrival)
+    aggregate_home_power(sources)
+    publish_changes(source.name, source.record)
+
+async def consume_telegrams(queue, sources):
+    # --- Hand every queued telegram to the rest of the system
+    while True:
+        source, frame, arrival = await queue.get()
+        try:
+            publish_telegram(source, sources, frame.decode("ascii", errors="ignore"), arrival)
+            if source is sources[0]:
+                update_moving_average(globl.HOME_POWER[globl.HOME_PWR_TOT][globl.IDXH_HVAL])
+                update_quarter_peak(source.record)
+            telegram_signal.notify(arrival)    # --- HOME_POWER and the quarter are up to date: wake the control tick
+        except Exception as e: # --- a malformed value or a failing update must not stop the consumer
+            globl.log_debug(module_name, f"Telegram from {source.name} not processed: {type(e).__name__}: {e}")
+
+def create_reader(meter, source, queue, stop_event):
+    if meter[IDXP_INPT] == "serial":
+        return read_serial(source, meter[IDXP_ADDR], queue, stop_event)
+    return read_tcp(source, meter[IDXP_ADDR], queue, stop_event)
+
+async def dsmr_main(dsmr_stop_event, interval):
+    queue = asyncio.Queue(P1_QUEUE_SIZE * len(DSMR_METERS))
+    sources = []
+    tasks = []
+    globl.METER_POWER.clear()
+    for meter in DSMR_METERS:
+        source = P1Source(meter[IDXP_NAME], interval, meter[IDXP_SIGN])
+        globl.METER_POWER[source.name] = source.power
+        sources.append(source)
+        tasks.append(asyncio.create_task(create_reader(meter, source, queue, dsmr_stop_event)))
+    tasks.append(asyncio.create_task(consume_telegrams(queue, sources)))
+    cntr = 0
+    while not dsmr_stop_event.is_set():
+        await asyncio.sleep(P1_STOP_POLL)
         cntr += 1
-        globl.log_loop(module_name, f"Loop counter: {cntr}")
+        if cntr % 25 == 0: # --- about every 5 seconds
+            for source in sources:
+                globl.log_loop(module_name, f"Loop counter: {cntr} P1 {source.summary()}")
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+# -----------------------------------------------------------------------------------------
+
+def dsmr_thread_fn(dsmr_stop_event: threading.Event, interval: float = 1.0):
+    # --- Run the asyncio P1 ingestion in this thread until the stop event is set
+    try:
+        asyncio.run(dsmr_main(dsmr_stop_event, interval))
+    except Exception as e:
+        globl.log_debug(module_name, f"Exception error: {e}")
@@ -12,6 +12,10 @@ import datetime
 import random
 import sys
 import os
+import mbus
+import peak
+import regs
+import stats
 
 from typing import Optional
 from datetime import datetime
@@ -41,6 +45,8 @@ mode_nom = False            # --- Execute Nul Op de Meter (NOM)
 mode_man = False            # --- Execute Manual commands program
 mode_stop = False           # --- Stop any program (and stop the inverter)
 mode_zpv = False            # --- Execute zero Solar (ZPV) program
+mode_phs = False            # --- Execute per phase balance (PHS) program (battery phase only, fuse limit)
+mode_peak = False           # --- Execute peak shaving (PEAK) program (capacity tariff, quarter-hour average)
 
 # --- Flags for indicating that a new value needs to be set (this flag will be reset to False after execution in batt.py)
 man_restart = False           # --- True will restart the batt
@@ -74,7 +80,7 @@ power_l2 = 0
 power_l3 = 0
 
 # --- Index list for Home Power
-HOME_PWR_TIME_STAMP = 0     # ---  Timestamp power
+HOME_PWR_TIME_STAMP = 0     # ---  Timestamp power (epoch of the meter time stamp)
 HOME_PWR_CONS = 1           # ---  Power consumed total (unsigned always positive)
 HOME_PWR_PROD = 2           # ---  Power produced total (unsigned always positive)
 HOME_PWR_TOT = 3            # ---  Power total (signed, consume is positive)
@@ -85,20 +91,48 @@ HOME_PWR_L3 = 6             # ---  Power phase 3 (signed, consume is positive)
 init_value = 0
 
 HOME_POWER = [
-["HOME_PWR_TIME_STAMP","t",init_value,""],
-["HOME_PWR_CONS","u",init_value,"W"],
-["HOME_PWR_PROD","u",init_value,"W"],
-["HOME_PWR_TOT","s",init_value,"W"],
-["HOME_PWR_L1","s",init_value,"W"],
-["HOME_PWR_L2","s",init_value,"W"],
-["HOME_PWR_L3","s",init_value,"W"]
+["HOME_PWR_TIME_STAMP","t",init_value,"",0.0],
+["HOME_PWR_CONS","u",init_value,"W",0.0],
+["HOME_PWR_PROD","u",init_value,"W",0.0],
+["HOME_PWR_TOT","s",init_value,"W",0.0],
+["HOME_PWR_L1","s",init_value,"W",0.0],
+["HOME_PWR_L2","s",init_value,"W",0.0],
+["HOME_PWR_L3","s",init_value,"W",0.0]
 ]
 
+# --- Per phase values of the primary meter (L1, L2, L3): current in A (31.7.0 / 51.7.0 / 71.7.0, unsigned), voltage in V
+PHASE_CURR = [0, 0, 0]
+PHASE_VOLT = [0, 0, 0]
+PHASE_TIME = 0.0            # --- time.monotonic() of the telegram of PHASE_CURR / PHASE_VOLT
+
 # --- HOME_FIELD_INDEX index for HOME POWER values  
 IDXH_NAME = 0
 IDXH_SIGN = 1
 IDXH_HVAL = 2
 IDXH_UNIT = 3
+IDXH_TIME = 4   # --- time.monotonic() the value was read from the meter (0.0: never), for the freshness checks
+
+# --- Rolling statistics of HOME_PWR_TOT (updated per telegram of the primary meter)
+HOME_PWR_WINDOWS = (2, 3, 4, 5, 6, 8)   # --- moving average window sizes (telegrams)
+HOME_PWR_ALPHAS = (0.5, 0.2)            # --- EWMA smoothing factors
+home_pwr_stats = stats.RollingStats(HOME_PWR_WINDOWS, HOME_PWR_ALPHAS)
+
+# --- Modbus latency / error histograms, cycle time and bus utilisation (updated by the BATT thread, 'show bus')
+bus_stats = mbus.BusStats()
+
+# --- Control tick: woken by a new telegram (or after the interval), latency in two parts per tick that wrote:
+# --- telegram arrival --> control registers read (fast tier reads), control registers read --> setpoint write acknowledged
+CTRL_LATENCY_EDGES = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)   # --- seconds
+ctrl_read_latency = stats.Histogram(CTRL_LATENCY_EDGES)
+ctrl_latency = stats.Histogram(CTRL_LATENCY_EDGES)
+ctrl_ticks_telegram = 0     # --- control ticks woken by a telegram
+ctrl_ticks_timeout = 0      # --- control ticks after the interval without a telegram
+
+# --- Quarter-hour average import and monthly peak of the primary meter (updated per telegram, 'show peak')
+quarter_peak = peak.PeakTracker()
+
+# --- Per meter HOME_POWER tables (meter name --> list like HOME_POWER), HOME_POWER holds the aggregate of all meters
+METER_POWER = {}
 
 
 # -----------------------------------------------------------------------------
@@ -159,7 +193,7 @@ BATT_MAX_DISCHARGE_PWR = 49 #  44003 u16 1W
 get_value = 0
 set_value = 0
 
-BATT_REGISTERS = [
+BATT_FIELDS = [
 ["INDX","NAME","ABBR","GVAL","SVAL","UNIT","DESC"],
 [1,"BATT_DEVICE_NAME","DN",get_value,set_value," ",""],
 [2,"BATT_FW_VERSION","FW",get_value,set_value," ",""],
@@ -212,6 +246,11 @@ BATT_REGISTERS = [
 [49,"BATT_MAX_DISCHARGE_PWR","CO",get_value,set_value,"W","range:[0..2500W]"]
 ]
 
+# --- Marstek register store (filled by batt.py) and the BATT_REGISTERS view on it
+# --- BATT_REGISTERS[row][IDXB_GVAL] reads the converted value from the store, IDXB_SVAL is kept in the view
+MRST_STORE = regs.RegisterStore()
+BATT_REGISTERS = regs.BattTable(MRST_STORE, BATT_FIELDS)
+
 # --- BATT_FIELD_INDEX index for BATT fields ---- 
 IDXB_INDX = 0   # - Index number
 IDXB_NAME = 1   # - Field name 
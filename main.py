@@ -47,9 +47,10 @@ import random
 import sys
 import os
 import globl   # -- import global constants
+import mbus
 
 from batt import batt_thread_fn
-from dsmr import dsmr_thread_fn
+from dsmr import dsmr_thread_fn, subscribe, unsubscribe, DSMR_SUBSCRIBERS
 from bsld import baseload_thread_fn
 from logger import logger_thread_fn
 from ems import ems_thread_fn
@@ -112,6 +113,10 @@ ems_stop_event = threading.Event()      # ems stop signal
 # --- logger_thread_fn moved to file: logger.py
 # --- ems_thread_fn moved to file: ems.py
         
+# --- DSMR change subscriber: print only the fields that changed (toggle delta)
+def print_dsmr_changes(meter_name, time_stamp, changes):
+    print(f"[DSMR] {meter_name} {time_stamp}: " + ", ".join(f"{name}={value}" for name, value in changes.items()))
+
 # -----------------------------------------------------------------------------
 # ---- SimpleCLI class --------------------------------------------------------
 # -----------------------------------------------------------------------------
@@ -468,6 +473,10 @@ class SimpleCLI:
         print(f"[HOME] | HOME L1 power            | {globl.power_l1:>8.2f} | Watt")
         print(f"[HOME] | HOME L2 power            | {globl.power_l2:>8.2f} | Watt")
         print(f"[HOME] | HOME L3 power            | {globl.power_l3:>8.2f} | Watt")
+        # --- Age of the last telegram (meter time stamp is epoch)
+        time_stamp = globl.HOME_POWER[globl.HOME_PWR_TIME_STAMP][globl.IDXH_HVAL]
+        if time_stamp:
+            print(f"[HOME] | Telegram age             | {time.time() - time_stamp:>8.1f} | sec")
         # --- Print AC power
         reg_name = globl.BATT_REGISTERS[globl.BATT_AC_PWR_VAL][globl.IDXB_NAME]
         reg_conv = globl.BATT_REGISTERS[globl.BATT_AC_PWR_VAL][globl.IDXB_GVAL]
@@ -480,8 +489,57 @@ class SimpleCLI:
         reg_name = globl.BATT_REGISTERS[globl.BATT_DC_SOC][globl.IDXB_NAME]
         reg_conv = globl.BATT_REGISTERS[globl.BATT_DC_SOC][globl.IDXB_GVAL]
         print(f"[BATT] | {reg_name:<24} | {reg_conv:>8.2f} | %")
+        # --- Print total power per meter (only when reading more than one meter)
+        if len(globl.METER_POWER) > 1:
+            for meter_name, meter_power in globl.METER_POWER.items():
+                print(f"[HOME] | METER {meter_name:<18} | {meter_power[globl.HOME_PWR_TOT][globl.IDXH_HVAL]:>8.2f} | Watt")
         print("[HOME] +--------------------------+-------+---------\n")
         
+    # --- show rolling statistics of the total home power ------------------------------
+
+    def show_stat(self):
+        home_pwr_stats = globl.home_pwr_stats
+        print("[STAT] WINDOW |     MEAN |      MIN |      MAX |   STDDEV ")
+        print("[STAT] -------+----------+----------+----------+----------")
+        for size, window in home_pwr_stats.windows.items():
+            print(f"[STAT] {size:>6} | {window.mean():>8.1f} | {window.min():>8.1f} | {window.max():>8.1f} | {window.variance() ** 0.5:>8.1f}")
+        for alpha, ewma in home_pwr_stats.ewmas.items():
+            print(f"[STAT] {'a=' + str(alpha):>6} | {ewma:>8.1f} | (EWMA)")
+        print("[STAT] -------+----------+----------+----------+----------\n")
+
+    # --- show quarter-hour average and monthly peak (capacity tariff) ---------------
+
+    def show_peak(self):
+        quarter_peak = globl.quarter_peak
+        quarter = quarter_peak.quarter
+        print(f"[PEAK] quarter: {quarter.elapsed():>3} s of {quarter.period} s, average {quarter.average():.0f} W, projected {quarter.projected():.0f} W, last quarter {quarter_peak.last_average:.0f} W")
+        peak_time = datetime.fromtimestamp(quarter_peak.peak_start).strftime("%Y-%m-%d %H:%M") if quarter_peak.peak_start else "--"
+        print(f"[PEAK] monthly peak {quarter_peak.month or '--'}: {quarter_peak.peak:.0f} W at {peak_time}, shaving target {quarter_peak.target():.0f} W\n")
+
+    # --- show Modbus latency / error statistics per request -------------------------
+
+    def show_bus(self):
+        bus_stats = globl.bus_stats
+        store = globl.MRST_STORE
+        print("[MBUS] FC |  ADDR | GR |      N | MEAN ms |  P95 ms |  MAX ms |  TMO |   IO | ERR | EXCEPTIONS")
+        print("[MBUS] ---+-------+----+--------+---------+---------+---------+------+------+-----+-----------")
+        for entry in bus_stats.entries():
+            reg_index = store.by_addr.get(entry.address)
+            reg_abbr = store.abbr[reg_index] if reg_index is not None else "--"
+            address = entry.address if entry.address != mbus.BUS_ADDR_OTHER else "other"   # --- requests outside the plan
+            latency = entry.latency
+            exceptions = " ".join(f"{code}:{count}" for code, count in enumerate(entry.exceptions) if count)
+            print(f"[MBUS] {entry.function:02X} | {address:>5} | {reg_abbr:<2} | {latency.count:>6} | {latency.mean() * 1000:>7.1f} | {latency.percentile(95) * 1000:>7.1f} | {latency.peak * 1000:>7.1f} | {entry.timeouts:>4} | {entry.io_errors:>4} | {entry.errors:>3} | {exceptions}")
+        print("[MBUS] ---+-------+----+--------+---------+---------+---------+------+------+-----+-----------")
+        cycles = bus_stats.cycles
+        print(f"[MBUS] cycles: {cycles.count}, cycle time p50 {cycles.percentile(50) * 1000:.0f} ms, p95 {cycles.percentile(95) * 1000:.0f} ms, p99 {cycles.percentile(99) * 1000:.0f} ms, max {cycles.peak * 1000:.0f} ms")
+        cycle_share = bus_stats.cycle_busy / bus_stats.cycle_time if bus_stats.cycle_time else 0.0
+        print(f"[MBUS] bus utilisation: {bus_stats.utilisation() * 100:.1f}% of the time, {cycle_share * 100:.0f}% of the last cycle")
+        print(f"[MBUS] control ticks: {globl.ctrl_ticks_telegram} on telegram, {globl.ctrl_ticks_timeout} on timeout")
+        for label, latency in (("telegram --> regs read", globl.ctrl_read_latency), ("regs read --> write ack", globl.ctrl_latency)):
+            print(f"[MBUS] {label}: {latency.count} writes, mean {latency.mean() * 1000:.0f} ms, p50 {latency.percentile(50) * 1000:.0f} ms, p95 {latency.percentile(95) * 1000:.0f} ms, max {latency.peak * 1000:.0f} ms")
+        print()
+
     # ----------------------------------------------------------------------------
         
     def show(self, argument):
@@ -501,6 +559,12 @@ class SimpleCLI:
             #self.show_mrst()
             globl.log_debug(module_name, "Show Marstek modbus data...")
             globl.show_mrst = True
+        elif argument.strip() == "stat":
+            self.show_stat()
+        elif argument.strip() == "bus":
+            self.show_bus()
+        elif argument.strip() == "peak":
+            self.show_peak()
         else:
             print(f"Unknown show command: (type 'help')")
             print("  show all  - show all ...")
@@ -508,6 +572,9 @@ class SimpleCLI:
             print("  show dsmr - dsmr obis values")
             print("  show home - home energy usage")
             print("  show mrst - modbus registers")
+            print("  show stat - home power moving averages")
+            print("  show bus  - modbus latency, errors, bus utilisation and control latency")
+            print("  show peak - quarter-hour average and monthly peak")
 
     # ----------------------------------------------------------------------------
     
@@ -530,6 +597,12 @@ class SimpleCLI:
         elif argument.strip() == "ma":
             globl.log_debug(module_name, "Toggle Moving Average data...")
             globl.show_mov_avrg = not globl.show_mov_avrg
+        elif argument.strip() == "delta":
+            globl.log_debug(module_name, "Toggle DSMR changes...")
+            if print_dsmr_changes in DSMR_SUBSCRIBERS:
+                unsubscribe(print_dsmr_changes)
+            else:
+                subscribe(print_dsmr_changes)
         else:
             print(f"unknown toggle argument: (type 'help')")
             print("  toggle mrst")
@@ -538,6 +611,8 @@ class SimpleCLI:
             #print("  toggle log")
             #print("  toggle ems")
             print("  toggle debug")
+            print("  toggle ma")
+            print("  toggle delta")
 
     # ----------------------------------------------------------------------------
 
@@ -548,6 +623,8 @@ class SimpleCLI:
             globl.mode_man = False
             globl.mode_stop = False
             globl.mode_zpv = False
+            globl.mode_phs = False
+            globl.mode_peak = False
             globl.mode_bsld = True
             self.prompt = "ems>bsld> "
         elif argument.strip() == "man":
@@ -556,6 +633,8 @@ class SimpleCLI:
             globl.mode_bsld = False
             globl.mode_stop = False
             globl.mode_zpv = False
+            globl.mode_phs = False
+            globl.mode_peak = False
             globl.mode_man = True
             self.prompt = "ems>man>"
         elif argument.strip() == "nom":
@@ -564,6 +643,8 @@ class SimpleCLI:
             globl.mode_man = False
             globl.mode_stop = False
             globl.mode_zpv = False
+            globl.mode_phs = False
+            globl.mode_peak = False
             globl.mode_nom = True
             self.prompt = "ems>nom> "
         elif argument.strip() == "zpv":
@@ -572,14 +653,38 @@ class SimpleCLI:
             globl.mode_man = False
             globl.mode_nom = False
             globl.mode_stop = False
+            globl.mode_phs = False
+            globl.mode_peak = False
             globl.mode_zpv = True
             self.prompt = "ems>zpv> "
+        elif argument.strip() == "phs":
+            globl.log_debug(module_name, "Mode set to per phase balance...")
+            globl.mode_bsld = False
+            globl.mode_man = False
+            globl.mode_nom = False
+            globl.mode_stop = False
+            globl.mode_zpv = False
+            globl.mode_peak = False
+            globl.mode_phs = True
+            self.prompt = "ems>phs> "
+        elif argument.strip() == "peak":
+            globl.log_debug(module_name, "Mode set to peak shaving...")
+            globl.mode_bsld = False
+            globl.mode_man = False
+            globl.mode_nom = False
+            globl.mode_stop = False
+            globl.mode_zpv = False
+            globl.mode_phs = False
+            globl.mode_peak = True
+            self.prompt = "ems>peak> "
         elif argument.strip() == "stop":
             globl.log_debug(module_name, "Stop any program and stop the inverter...")
             globl.mode_nom = False
             globl.mode_man = False
             globl.mode_bsld = False
             globl.mode_zpv = False
+            globl.mode_phs = False
+            globl.mode_peak = False
             globl.mode_stop = True
             self.prompt = "ems> "
         else:
@@ -588,6 +693,8 @@ class SimpleCLI:
             print("  mode man (Manual execution)")
             print("  mode nom (Nul op de Meter)")
             print("  mode zpv (Zero PV / Solar)")
+            print("  mode phs (Per phase balance, fuse limit)")
+            print("  mode peak (Peak shaving, quarter-hour average)")
             print("  mode stop (Stop ...)")
 
     def man(self, arg0, arg1: str = ""):
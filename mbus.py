@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""
+mbus.py
+  Modbus helpers used by batt.py (independent of the Marstek register map)
+    plan_reads          - merge neighbouring register blocks into the fewest read requests
+    estimate_read_time  - estimated RTU bus time of one read request
+    PollScheduler       - deadline-ordered poll queue with per-tier periods (fast / slow / static)
+    ModbusBus           - asyncio request queue for one bus, setpoint writes go before reads
+    WriteCache          - last confirmed value per register, skips duplicate writes and writes inside a deadband
+    BusStats            - latency / error histograms per request, cycle time percentiles and bus utilisation
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+import stats
+
+from array import array
+from pymodbus.exceptions import ModbusIOException
+
+# -----------------------------------------------------------------
+module_name = "MBUS"
+# -----------------------------------------------------------------
+
+MODBUS_MAX_GAP = 32         # --- max unmapped registers read to join two blocks in one request
+MODBUS_MAX_COUNT = 64       # --- max registers per read request (Modbus limit is 125)
+MODBUS_TURNAROUND = 0.005   # --- estimated device response time in seconds
+
+# -----------------------------------------------------------------------------------------
+# --- RTU bus time ------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+def estimate_read_time(count, baud, turnaround=MODBUS_TURNAROUND):
+    # --- Request (8 bytes) and response (5 + 2 bytes per register), each followed by a 3.5 char silence
+    # --- One char on the wire is 11 bits (start, 8 data, parity or 2nd stop, stop)
+    chars = (8 + 3.5) + (5 + 2 * count + 3.5)
+    return chars * 11 / baud + turnaround
+
+# -----------------------------------------------------------------------------------------
+# --- Read planner ------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+class ReadSpan:
+    """One read request covering one or more register blocks.
+    blocks holds (block id, address, count) of every block read by this request"""
+
+    __slots__ = ("addr", "count", "blocks")
+
+    def __init__(self, addr, count, blocks):
+        self.addr = addr
+        self.count = count
+        self.blocks = blocks
+
+    def __repr__(self):
+        return f"ReadSpan({self.addr}, {self.count}, {len(self.blocks)} blocks)"
+
+def plan_reads(blocks, max_gap=MODBUS_MAX_GAP, max_count=MODBUS_MAX_COUNT):
+    # --- blocks: (block id, address, count) --> list of ReadSpan, neighbouring blocks are merged
+    # --- as long as the hole between them is <= max_gap and the span stays <= max_count registers
+    spans = []
+    for block in sorted(blocks, key=lambda block: block[1]):
+        block_id, addr, count = block
+        if spans:
+            span = spans[-1]
+            gap = addr - (span.addr + span.count)
+            if 0 <= gap <= max_gap and (addr + count - span.addr) <= max_count:
+                span.count = addr + count - span.addr
+                span.blocks = span.blocks + (block,)
+                continue
+        spans.append(ReadSpan(addr, count, (block,)))
+    return spans
+
+def split_span(span):
+    # --- Fallback when the device rejects a span: one request per block
+    return [ReadSpan(addr, count, ((block_id, addr, count),)) for block_id, addr, count in span.blocks]
+
+def plan_read_time(spans, baud, turnaround=MODBUS_TURNAROUND):
+    # --- Estimated bus time of one cycle over all spans
+    return sum(estimate_read_time(span.count, baud, turnaround) for span in spans)
+
+# -----------------------------------------------------------------------------------------
+# --- Poll scheduler ----------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+POLL_ONCE = 0               # --- period of blocks read once per connection (static values)
+
+class PollEntry:
+    """Spans of one tier group with their period in cycles.
+    spans is a list, the reader may split a rejected span in place"""
+
+    __slots__ = ("tier", "period", "phase", "spans")
+
+    def __init__(self, tier, period, phase, spans):
+        self.tier = tier        # --- priority within a cycle (0 first)
+        self.period = period    # --- cycles between reads, POLL_ONCE = once per connection
+        self.phase = phase      # --- spreads the slow entries over the cycles of one period
+        self.spans = spans
+
+class PollScheduler:
+    """Deadline-ordered poll queue, heap of (due cycle, tier, seq, entry).
+    tiers: [(period, spans), ...] in priority order, e.g. fast (1), static (POLL_ONCE), slow (N)"""
+
+    def __init__(self, tiers):
+        self.entries = []
+        for tier, (period, spans) in enumerate(tiers):
+            for index, span in enumerate(spans):
+                self.entries.append(PollEntry(tier, period, index % period if period > 1 else 0, [span]))
+        self.heap = []
+        self.reset()
+
+    def reset(self):
+        # --- New connection: every entry (incl. the static ones) is due in the first cycle
+        self.heap = [(0, entry.tier, seq, entry) for seq, entry in enumerate(self.entries)]
+        heapq.heapify(self.heap)
+
+    def pop_due(self, cycle):
+        # --- Entries due in this cycle, most urgent first; periodic entries are rescheduled
+        entries = []
+        while self.heap and self.heap[0][0] <= cycle:
+            _, tier, seq, entry = heapq.heappop(self.heap)
+            entries.append(entry)
+            if entry.period != POLL_ONCE:
+                heapq.heappush(self.heap, (cycle + entry.period - (cycle - entry.phase) % entry.period, tier, seq, entry))
+        return entries
+
+    def cycle_time(self, baud, turnaround=MODBUS_TURNAROUND):
+        # --- Estimated average bus time per cycle once the static entries are read
+        return sum(plan_read_time(entry.spans, baud, turnaround) / entry.period for entry in self.entries if entry.period != POLL_ONCE)
+
+# -----------------------------------------------------------------------------------------
+# --- Async bus request queue -------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+BUS_WRITE = 0               # --- queue priority of (setpoint) writes
+BUS_READ = 1                # --- queue priority of telemetry reads
+BUS_TIMEOUT = 0.5           # --- default per-request timeout in seconds
+
+# --- Modbus function codes of the queued requests
+FC_READ = 0x03              # --- read holding registers
+FC_WRITE = 0x06             # --- write single register
+FC_WRITE_MANY = 0x10        # --- write multiple registers
+
+class ModbusBus:
+    """One worker owns the (half-duplex) bus and runs the queued requests one by one.
+    Writes overtake queued reads, a newer write to the same address cancels the queued older one.
+    Every request returns a future: the pymodbus response, or TimeoutError / ModbusException.
+    With a BusStats every request is recorded by function code and start address"""
+
+    def __init__(self, client, device_id, timeout=BUS_TIMEOUT, bus_stats=None):
+        self.client = client
+        self.device_id = device_id
+        self.timeout = timeout
+        self.bus_stats = bus_stats
+        self.queue = asyncio.PriorityQueue()
+        self.seq = itertools.count()    # --- FIFO order within one priority
+        self.pending_writes = {}        # --- address --> future of the queued write
+        self.busy_time = 0.0            # --- total time the bus was in use (s)
+        self.requests = 0
+        self.timeouts = 0
+        self.cancelled = 0
+
+    def submit(self, priority, function, func, timeout=None, **kwargs):
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((priority, next(self.seq), function, func, kwargs, timeout or self.timeout, future))
+        return future
+
+    def read(self, address, count, timeout=None, priority=BUS_READ):
+        # --- priority=BUS_WRITE for the read-back of a write (keeps the transaction together on the bus)
+        return self.submit(priority, FC_READ, self.client.read_holding_registers, timeout, address=address, count=count)
+
+    def write(self, address, value, timeout=None):
+        # --- Function 0x06, one register
+        self.cancel_write(address)
+        future = self.submit(BUS_WRITE, FC_WRITE, self.client.write_register, timeout, address=address, value=value)
+        self.pending_writes[address] = future
+        return future
+
+    def write_many(self, address, values, timeout=None):
+        # --- Function 0x10, contiguous registers in one request
+        self.cancel_write(address)
+        future = self.submit(BUS_WRITE, FC_WRITE_MANY, self.client.write_registers, timeout, address=address, values=list(values))
+        self.pending_writes[address] = future
+        return future
+
+    def cancel_write(self, address):
+        # --- A queued write that is not on the bus yet is replaced by the newer one
+        future = self.pending_writes.pop(address, None)
+        if future is not None and future.cancel():
+            self.cancelled += 1
+
+    def cancel_pending(self):
+        # --- Connection lost or stopping: cancel everything still queued
+        while not self.queue.empty():
+            future = self.queue.get_nowait()[-1]
+            if future.cancel():
+                self.cancelled += 1
+        self.pending_writes.clear()
+
+    async def run(self):
+        while True:
+            priority, _, function, func, kwargs, timeout, future = await self.queue.get()
+            if future.done():   # --- cancelled by the requester while queued
+                continue
+            start = time.perf_counter()
+            outcome = REQ_OK
+            code = 0
+            try:
+                result = await asyncio.wait_for(func(device_id=self.device_id, **kwargs), timeout)
+            except asyncio.CancelledError:
+                future.cancel()
+                outcome = None
+                raise
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timeouts += 1
+                    outcome = REQ_TIMEOUT
+                elif isinstance(e, ModbusIOException):
+                    outcome = REQ_IO
+                else:
+                    outcome = REQ_ERROR
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if result.isError():
+                    outcome = REQ_EXCEPTION
+                    code = getattr(result, "exception_code", 0)
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.busy_time += elapsed
+                self.requests += 1
+                if self.bus_stats is not None and outcome is not None:
+                    self.bus_stats.record(function, kwargs["address"], elapsed, outcome, code)
+                if self.pending_writes.get(kwargs["address"]) is future:
+                    del self.pending_writes[kwargs["address"]]
+
+# -----------------------------------------------------------------------------------------
+# --- Write cache -------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+class WriteCache:
+    """Last value confirmed per register address: acknowledged by a write or read back from the device.
+    A write is only needed when the new value differs more than the deadband of that address"""
+
+    def __init__(self, deadbands=None):
+        self.deadbands = dict(deadbands or {})  # --- address --> deadband (raw register units)
+        self.confirmed = {}                     # --- address --> last confirmed value
+        self.written = 0
+        self.skipped = 0
+
+    def clear(self):
+        # --- (Re)connect: nothing is confirmed until read back from the device
+        self.confirmed.clear()
+
+    def needed(self, address, value):
+        last = self.confirmed.get(address)
+        if last is not None and abs(value - last) <= self.deadbands.get(address, 0):
+            self.skipped += 1
+            return False
+        return True
+
+    def confirm(self, address, value):
+        self.confirmed[address] = value
+
+    def forget(self, address):
+        # --- Write failed: the device state is unknown, the next write must go out
+        self.confirmed.pop(address, None)
+
+# -----------------------------------------------------------------------------------------
+# --- Bus statistics ----------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+BUS_LATENCY_EDGES = (0.002, 0.005, 0.01, 0.02, 0.03, 0.05, 0.1, 0.2, 0.5, 1.0)  # --- request latency buckets (s)
+BUS_CYCLE_EDGES = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)        # --- poll cycle time buckets (s)
+BUS_EXCEPTION_CODES = 16    # --- Modbus exception codes 1..11 are defined, counted per code
+
+# --- Outcome of one request
+REQ_OK = 0
+REQ_TIMEOUT = 1             # --- no response within the request timeout
+REQ_IO = 2                  # --- no (valid) response: pymodbus drops frames with a CRC error, they end up here
+REQ_EXCEPTION = 3           # --- Modbus exception response (e.g. 2: illegal data address)
+REQ_ERROR = 4               # --- any other error (connection lost, ...)
+
+BUS_ADDR_OTHER = -1         # --- address of the entry that counts the requests outside the prepared plan
+
+class RequestStats:
+    """Latency histogram and error counts of one request (function code, start address)"""
+
+    __slots__ = ("function", "address", "latency", "timeouts", "io_errors", "errors", "exceptions")
+
+    def __init__(self, function, address, edges=BUS_LATENCY_EDGES):
+        self.function = function
+        self.address = address
+        self.latency = stats.Histogram(edges)
+        self.timeouts = 0
+        self.io_errors = 0
+        self.errors = 0
+        self.exceptions = array("Q", [0] * BUS_EXCEPTION_CODES)   # --- exception code --> count
+
+    def clear(self):
+        self.latency.clear()
+        self.timeouts = 0
+        self.io_errors = 0
+        self.errors = 0
+        for code in range(BUS_EXCEPTION_CODES):
+            self.exceptions[code] = 0
+
+    def failures(self):
+        return self.timeouts + self.io_errors + self.errors + sum(self.exceptions)
+
+class BusStats:
+    """Per request statistics of one bus plus cycle time and bus utilisation.
+    The (fixed bucket) histograms are created up front by prepare() from the planned requests, record() only counts
+    in place: a request outside the plan is counted in the BUS_ADDR_OTHER entry of its function (no allocation).
+    Exporters fn(snapshot) are called by publish(), snapshot is a dict as returned by export()"""
+
+    def __init__(self, latency_edges=BUS_LATENCY_EDGES, cycle_edges=BUS_CYCLE_EDGES):
+        self.latency_edges = latency_edges
+        self.functions = {FC_READ: {}, FC_WRITE: {}, FC_WRITE_MANY: {}}  # --- function --> {address: RequestStats}
+        for function in self.functions:
+            self.request(function, BUS_ADDR_OTHER)
+        self.cycles = stats.Histogram(cycle_edges)
+        self.busy_time = 0.0        # --- total time the bus was in use (s)
+        self.cycle_time = 0.0       # --- last poll cycle (s)
+        self.cycle_busy = 0.0       # --- bus time of the last poll cycle (s)
+        self.start = time.monotonic()
+        self.exporters = []
+
+    def reset(self):
+        for requests in self.functions.values():
+            for entry in requests.values():
+                entry.clear()
+        self.cycles.clear()
+        self.busy_time = 0.0
+        self.cycle_time = 0.0
+        self.cycle_busy = 0.0
+        self.start = time.monotonic()
+
+    def request(self, function, address):
+        requests = self.functions.get(function)
+        if requests is None:
+            requests = self.functions[function] = {}
+        entry = requests.get(address)
+        if entry is None:
+            entry = requests[address] = RequestStats(function, address, self.latency_edges)
+        return entry
+
+    def prepare(self, requests):
+        # --- Create the entries of the planned (function, address) requests while the bus worker is stopped
+        # --- new dicts are swapped in: a reader in another thread (CLI) keeps iterating the old ones
+        functions = {function: dict(entries) for function, entries in self.functions.items()}
+        for function, address in requests:
+            entries = functions.setdefault(function, {})
+            if address not in entries:
+                entries[address] = RequestStats(function, address, self.latency_edges)
+        self.functions = functions
+
+    def record(self, function, address, latency, outcome=REQ_OK, code=0):
+        requests = self.functions[function]
+        entry = requests.get(address)
+        if entry is None:
+            entry = requests[BUS_ADDR_OTHER]    # --- not in the plan: no allocation in the bus worker
+        entry.latency.add(latency)
+        if outcome == REQ_TIMEOUT:
+            entry.timeouts += 1
+        elif outcome == REQ_IO:
+            entry.io_errors += 1
+        elif outcome == REQ_EXCEPTION:
+            entry.exceptions[code if 0 <= code < BUS_EXCEPTION_CODES else 0] += 1
+        elif outcome == REQ_ERROR:
+            entry.errors += 1
+        self.busy_time += latency
+
+    def record_cycle(self, cycle_time, cycle_busy):
+        # --- One poll cycle (reads, control and writes, without the sleep) and its bus time
+        self.cycles.add(cycle_time)
+        self.cycle_time = cycle_time
+        self.cycle_busy = cycle_busy
+
+    def utilisation(self):
+        # --- Fraction of the wall time the bus was in use
+        elapsed = time.monotonic() - self.start
+        return self.busy_time / elapsed if elapsed > 0 else 0.0
+
+    def entries(self):
+        # --- RequestStats that saw requests, ordered by address, reads first (BUS_ADDR_OTHER first per function)
+        return [entry for function in sorted(self.functions) for _, entry in sorted(self.functions[function].items()) if entry.latency.count]
+
+    def export(self):
+        # --- Snapshot as plain values (for a logger, csv or metrics exporter)
+        return {
+            "time": time.time(),
+            "utilisation": self.utilisation(),
+            "busy_time": self.busy_time,
+            "cycles": self.cycles.count,
+            "cycle_p50": self.cycles.percentile(50),
+            "cycle_p95": self.cycles.percentile(95),
+            "cycle_p99": self.cycles.percentile(99),
+            "cycle_max": self.cycles.peak,
+            "requests": [{
+                "function": entry.function,
+                "address": entry.address,
+                "count": entry.latency.count,
+                "latency_mean": entry.latency.mean(),
+                "latency_p95": entry.latency.percentile(95),
+                "latency_max": entry.latency.peak,
+                "latency_buckets": list(entry.latency.counts),
+                "timeouts": entry.timeouts,
+                "io_errors": entry.io_errors,
+                "errors": entry.errors,
+                "exceptions": {code: count for code, count in enumerate(entry.exceptions) if count},
+            } for entry in self.entries()],
+        }
+
+    def subscribe(self, callback):
+        if callback not in self.exporters:
+            self.exporters.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.exporters:
+            self.exporters.remove(callback)
+
+    def publish(self):
+        # --- Hand a snapshot to the exporters, a failing exporter does not stop the others
+        if not self.exporters:
+            return []
+        snapshot = self.export()
+        failed = []
+        for callback in list(self.exporters):
+            try:
+                callback(snapshot)
+            except Exception as e:
+                failed.append((callback, e))
+        return failed
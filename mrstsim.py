@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+mrstsim.py
+  Marstek Venus E simulator: serves the full MARSTEK_MODBUS register map with the pymodbus server
+  over a pseudo terminal (pty, like the RS485 adapter) or RTU over TCP, for tests and benchmarks without a battery
+    VenusModel        - SoC, AC/DC power ramping to the setpoints, cutoffs, fault bits and energy counters
+    SimulatorContext  - pymodbus device context: reads are encoded from the model, writes go to the setpoints
+    serve_tcp         - RTU frames over TCP   (batt.py: MODBUS_DEVICE = "tcp:127.0.0.1:5020")
+    serve_pty         - RTU frames over a pty (batt.py: MODBUS_DEVICE = the printed /dev/pts/N)
+  usage: python mrstsim.py [pty | tcp [port]] [latency ms]
+"""
+
+import asyncio
+import os
+import pty
+import random
+import struct
+import sys
+import time
+import tty
+
+import batt
+import mbus
+import regmap
+
+from batt import IDXM_NAME, IDXM_ADDR, IDXM_BLCK, IDXM_MODE, IDXM_TYPE, IDXM_GAIN
+from pymodbus.constants import ExcCodes
+from pymodbus.datastore import ModbusServerContext
+from pymodbus.datastore.context import ModbusBaseDeviceContext
+from pymodbus.framer import FramerType
+from pymodbus.server import ModbusSerialServer, ModbusTcpServer
+
+# -----------------------------------------------------------------
+module_name = "MSIM"
+# -----------------------------------------------------------------
+
+SIM_DEVICE_ID = 1
+SIM_TCP_PORT = 5020
+SIM_LATENCY = 0.005         # --- device response time in seconds (on top of the RTU wire time)
+SIM_JITTER = 0.002          # --- random extra response time in seconds (0..jitter)
+
+SIM_CAPACITY = 5120         # --- usable energy in Wh
+SIM_MAX_POWER = 2500        # --- inverter limit in W (charge and discharge)
+SIM_RAMP_RATE = 1000        # --- AC power ramp in W/s
+SIM_DELAY = 0.5             # --- dead time before a new setpoint starts ramping (s)
+SIM_EFFICIENCY = 0.92       # --- one way efficiency AC <--> DC
+
+SIM_RTU_ON = 0x55AA         # --- MRST_RTU_MODE value that hands control to the RS485 master
+
+# --- Initial values of the writable registers (physical values)
+SIM_SETPOINTS = {
+    "MRST_RESTART": 0,
+    "MRST_UNIT_ID": SIM_DEVICE_ID,
+    "MRST_BACKUP": 0,
+    "MRST_RTU_MODE": 0x55BB,
+    "MRST_SET_INV_STATE": 0,
+    "MRST_CHARGE_TO_SOC": 0,
+    "MRST_PWR_CHARGE": 0,
+    "MRST_PWR_DISCHARGE": 0,
+    "MRST_USER_MODE": 0,
+    "MRST_CHARGE_CUTOFF": 100,
+    "MRST_DISCHARGE_CUTOFF": 12,
+    "MRST_MAX_CHARGE_PWR": SIM_MAX_POWER,
+    "MRST_MAX_DISCHARGE_PWR": SIM_MAX_POWER,
+}
+
+# --- Accepted range of the writable registers (physical values), a write outside is rejected (ILLEGAL_VALUE)
+SIM_RANGES = {
+    "MRST_PWR_CHARGE": (0, SIM_MAX_POWER),
+    "MRST_PWR_DISCHARGE": (0, SIM_MAX_POWER),
+    "MRST_MAX_CHARGE_PWR": (0, SIM_MAX_POWER),
+    "MRST_MAX_DISCHARGE_PWR": (0, SIM_MAX_POWER),
+    "MRST_CHARGE_CUTOFF": (80, 100),
+    "MRST_DISCHARGE_CUTOFF": (12, 30),
+    "MRST_SET_INV_STATE": (0, 2),
+}
+
+# -----------------------------------------------------------------------------------------
+# --- Battery model -----------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+class VenusModel:
+    """Physical state of one battery, advanced by step(now).
+    AC power is positive when discharging (into the home), DC power is positive when charging (into the battery).
+    With RTU mode on, SET_INV_STATE and the power setpoints select the target power; the AC power follows
+    after SIM_DELAY with SIM_RAMP_RATE. Charging stops at the charge cutoff (or CHARGE_TO_SOC), discharging
+    at the discharge cutoff. Any fault bit stops the inverter. load is the home consumption for grid_power()"""
+
+    def __init__(self, soc=50.0, capacity=SIM_CAPACITY, ramp_rate=SIM_RAMP_RATE, delay=SIM_DELAY, fw_version=1.0):
+        self.soc = soc                  # --- %
+        self.capacity = capacity        # --- Wh
+        self.ramp_rate = ramp_rate      # --- W/s
+        self.delay = delay              # --- s
+        self.fw_version = fw_version
+        self.ac_power = 0.0             # --- W, pos is discharge
+        self.dc_power = 0.0             # --- W, pos is charge
+        self.command = 0.0              # --- target the AC power is ramping to
+        self.pending = None             # --- (target, due time) of a new target within the dead time
+        self.charged = 0.0              # --- Wh from the grid (AC side)
+        self.discharged = 0.0           # --- Wh to the home (AC side)
+        self.alarm = 0                  # --- MRST_ALARM bits
+        self.fault = 0                  # --- MRST_FAULT_MSB/LSB bits (32 bit)
+        self.load = 0.0                 # --- home consumption in W
+        self.setpoints = dict(SIM_SETPOINTS)
+        self.time = time.monotonic()
+
+    def target_power(self):
+        # --- AC power the inverter is asked for, after RTU mode, faults and cutoffs
+        if self.fault or self.setpoints["MRST_RTU_MODE"] != SIM_RTU_ON:
+            return 0.0
+        inv_state = self.setpoints["MRST_SET_INV_STATE"]
+        if inv_state == 1:
+            charge_to_soc = self.setpoints["MRST_CHARGE_TO_SOC"]
+            if self.soc >= self.setpoints["MRST_CHARGE_CUTOFF"] or (charge_to_soc and self.soc >= charge_to_soc):
+                return 0.0
+            return -float(min(self.setpoints["MRST_PWR_CHARGE"], self.setpoints["MRST_MAX_CHARGE_PWR"], SIM_MAX_POWER))
+        if inv_state == 2:
+            if self.soc <= self.setpoints["MRST_DISCHARGE_CUTOFF"]:
+                return 0.0
+            return float(min(self.setpoints["MRST_PWR_DISCHARGE"], self.setpoints["MRST_MAX_DISCHARGE_PWR"], SIM_MAX_POWER))
+        return 0.0
+
+    def step(self, now=None):
+        now = time.monotonic() if now is None else now
+        dt = now - self.time
+        if dt <= 0:
+            return
+        self.time = now
+        # --- dead time: a new target is only applied SIM_DELAY after it was set, a fault stops at once
+        target = self.target_power()
+        if self.fault:
+            self.command = 0.0
+            self.pending = None
+        elif target != (self.pending[0] if self.pending is not None else self.command):
+            self.pending = (target, now + self.delay)
+        if self.pending is not None and now >= self.pending[1]:
+            self.command = self.pending[0]
+            self.pending = None
+        # --- ramp the AC power
+        ramp = self.ramp_rate * dt
+        self.ac_power += max(-ramp, min(ramp, self.command - self.ac_power))
+        # --- DC side and SoC
+        self.dc_power = -self.ac_power * SIM_EFFICIENCY if self.ac_power < 0 else -self.ac_power / SIM_EFFICIENCY
+        self.soc = max(0.0, min(100.0, self.soc + self.dc_power * dt / 3600 / self.capacity * 100))
+        if self.ac_power < 0:
+            self.charged -= self.ac_power * dt / 3600
+        else:
+            self.discharged += self.ac_power * dt / 3600
+
+    def grid_power(self):
+        # --- Power from the grid (pos is import) with the battery between home and grid
+        return self.load - self.ac_power
+
+    def inverter_state(self):
+        # --- MRST_GET_INV_STATE: 0:sleep, 1:standby, 2:charging, 3:discharging
+        if self.setpoints["MRST_RTU_MODE"] != SIM_RTU_ON and abs(self.ac_power) < 1:
+            return 0
+        if abs(self.ac_power) < 1:
+            return 1
+        return 2 if self.ac_power < 0 else 3
+
+    def values(self):
+        # --- Register name --> physical value of every read only register (char blocks as str)
+        dc_volt = 48.0 + 8.0 * self.soc / 100
+        return {
+            "MRST_DEVICE_NAME": "VNSE3-SIM",
+            "MRST_FW_VERSION": self.fw_version,
+            "MRST_SERIAL_NUM": "SIM000000001",
+            "MRST_DC_VOLT": dc_volt,
+            "MRST_DC_CURR": self.dc_power / dc_volt,
+            "MRST_DC_PWR_VAL": self.dc_power,
+            "MRST_DC_SOC": self.soc,
+            "MRST_DC_TOT_ENRG": self.capacity * self.soc / 100 / 1000,
+            "MRST_AC_VOLT": 230.0,
+            "MRST_AC_CURR": abs(self.ac_power) / 230.0,
+            "MRST_AC_PWR_VAL": self.ac_power,
+            "MRST_AC_FREQ": 50.0,
+            "MRST_TOT_CHARGED": self.charged / 1000,
+            "MRST_TOT_DISCHARGED": self.discharged / 1000,
+            "MRST_DAY_CHARGED": self.charged / 1000,
+            "MRST_DAY_DISCHARGED": self.discharged / 1000,
+            "MRST_MNT_CHARGED": self.charged / 1000,
+            "MRST_MNT_DISCHARGED": self.discharged / 1000,
+            "MRST_INT_TEMP": 25.0 + abs(self.ac_power) / 250,
+            "MRST_MOS1_TEMP": 25.0 + abs(self.ac_power) / 200,
+            "MRST_MOS2_TEMP": 25.0 + abs(self.ac_power) / 200,
+            "MRST_MAX_CELL_TEMP": 24.0,
+            "MRST_MIN_CELL_TEMP": 22.0,
+            "MRST_GET_INV_STATE": self.inverter_state(),
+            "MRST_LIMIT_VOLT": 57600,
+            "MRST_LIMIT_CHARGE_CURR": 50000,
+            "MRST_LIMIT_DISCHARG_CURR": 50000,
+            "MRST_ALARM": self.alarm,
+            "MRST_FAULT_LSB": self.fault & 0xFFFF,
+            "MRST_FAULT_MSB": self.fault >> 16 & 0xFFFF,
+        }
+
+# -----------------------------------------------------------------------------------------
+# --- Register image ----------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+def raw_word(value, gain, reg_type):
+    # --- Physical value --> raw 16 bit word (two's complement for signed registers)
+    raw = int(round(value / gain))
+    if reg_type == "s":
+        raw = max(-0x8000, min(0x7FFF, raw))
+    else:
+        raw = max(0, min(0xFFFF, raw))
+    return raw & 0xFFFF
+
+def encode_registers(model, rows):
+    # --- Register image {address: raw word} of the model, laid out by the register map rows
+    values = model.values()
+    image = {}
+    reg_index = 1
+    while reg_index < len(rows):
+        name, addr, reg_type, gain = rows[reg_index][IDXM_NAME], rows[reg_index][IDXM_ADDR], rows[reg_index][IDXM_TYPE], rows[reg_index][IDXM_GAIN]
+        pair_type = batt.MRST_WORD_PAIRS.get(name)
+        if reg_type == "c" and rows[reg_index][IDXM_BLCK] > 0:
+            # --- char block: 2 chars per register, padded with spaces
+            count = rows[reg_index][IDXM_BLCK]
+            text = str(values.get(name, "")).encode("ascii")[:count * 2].ljust(count * 2)
+            for offset, word in enumerate(struct.unpack(f">{count}H", text)):
+                image[addr + offset] = word
+            reg_index += count
+        elif pair_type is not None:
+            # --- 32 bit value, high word first: PWR_DIR/PWR_VAL hold the value under the low word name,
+            # --- the statistics xxx_H/xxx_L under the name without the suffix
+            value_name = name[:-2] if name.endswith("_H") else rows[reg_index + 1][IDXM_NAME]
+            raw = int(round(values.get(value_name, 0) / gain))
+            raw = max(-0x80000000, min(0x7FFFFFFF, raw)) if pair_type == "s32" else max(0, min(0xFFFFFFFF, raw))
+            image[addr], image[addr + 1] = struct.unpack(">HH", struct.pack(">i" if pair_type == "s32" else ">I", raw))
+            reg_index += 2
+        else:
+            if rows[reg_index][IDXM_MODE] == "RW":
+                value = model.setpoints.get(name, 0)
+            else:
+                value = values.get(name, 0)
+            image[addr] = raw_word(value, gain, "s" if reg_type == "s" else "u")
+            reg_index += 1
+    return image
+
+# -----------------------------------------------------------------------------------------
+# --- pymodbus device context -------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+class SimulatorContext(ModbusBaseDeviceContext):
+    """Holding registers of the simulated battery. Every request first advances the model and waits
+    the response time (latency + jitter + RTU wire time at baud, 0 = no wire time).
+    strict: reading an address outside the map is rejected (ILLEGAL_ADDRESS), otherwise it reads 0"""
+
+    def __init__(self, model, rows=None, latency=SIM_LATENCY, jitter=SIM_JITTER, baud=batt.MODBUS_BAUD, strict=False):
+        self.model = model
+        self.rows = rows if rows is not None else regmap.load_register_map(batt.MRST_DICTIONARY)
+        self.latency = latency
+        self.jitter = jitter
+        self.baud = baud
+        self.strict = strict
+        self.writable = {row[IDXM_ADDR]: (row[IDXM_NAME], row[IDXM_GAIN]) for row in self.rows[1:] if row[IDXM_MODE] == "RW"}
+        self.addresses = {row[IDXM_ADDR] for row in self.rows[1:]}
+        self.reads = 0
+        self.writes = 0
+        self.rejected = 0
+
+    def reset(self):
+        self.model.setpoints = dict(SIM_SETPOINTS)
+
+    async def respond(self, count):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if self.baud:
+            delay += mbus.estimate_read_time(count, self.baud, 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.model.step()
+
+    async def async_getValues(self, func_code, address, count=1):
+        await self.respond(count)
+        return self.getValues(func_code, address, count)
+
+    async def async_setValues(self, func_code, address, values):
+        await self.respond(len(values))
+        return self.setValues(func_code, address, values)
+
+    def getValues(self, func_code, address, count=1):
+        if self.decode(func_code) != "h":
+            return ExcCodes.ILLEGAL_FUNCTION
+        if self.strict and any(reg_addr not in self.addresses for reg_addr in range(address, address + count)):
+            self.rejected += 1
+            return ExcCodes.ILLEGAL_ADDRESS
+        image = encode_registers(self.model, self.rows)
+        self.reads += 1
+        return [image.get(reg_addr, 0) for reg_addr in range(address, address + count)]
+
+    def setValues(self, func_code, address, values):
+        # --- Only the RW registers can be written, all values are checked before any is applied
+        updates = []
+        for reg_addr, raw in zip(range(address, address + len(values)), values):
+            if reg_addr not in self.writable:
+                self.rejected += 1
+                return ExcCodes.ILLEGAL_ADDRESS
+            name, gain = self.writable[reg_addr]
+            value = raw * gain
+            low, high = SIM_RANGES.get(name, (0, 0xFFFF * gain))
+            if not low <= value <= high:
+                self.rejected += 1
+                return ExcCodes.ILLEGAL_VALUE
+            updates.append((name, value))
+        for name, value in updates:
+            self.model.setpoints[name] = value
+        self.writes += 1
+        return None
+
+def server_context(model, **kwargs):
+    return ModbusServerContext(devices={SIM_DEVICE_ID: SimulatorContext(model, **kwargs)}, single=False)
+
+# -----------------------------------------------------------------------------------------
+# --- Transports --------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+async def serve_tcp(model, host="127.0.0.1", port=SIM_TCP_PORT, **kwargs):
+    # --- RTU frames over TCP (like an RS485 to ethernet gateway), runs until cancelled
+    server = ModbusTcpServer(server_context(model, **kwargs), framer=FramerType.RTU, address=(host, port))
+    print(f"[{module_name}] Marstek simulator on tcp:{host}:{port}")
+    await server.serve_forever()
+
+def open_pty_bridge():
+    # --- Two raw ptys: the server opens one end, the client (batt.py) the other, relay() copies between the masters
+    server_master, server_slave = pty.openpty()
+    client_master, client_slave = pty.openpty()
+    for fd in (server_slave, client_slave):
+        tty.setraw(fd)
+    return (server_master, server_slave), (client_master, client_slave)
+
+def relay(loop, source, target):
+    def forward():
+        try:
+            os.write(target, os.read(source, 1024))
+        except OSError:
+            pass
+    loop.add_reader(source, forward)
+
+async def serve_pty(model, baud=batt.MODBUS_BAUD, **kwargs):
+    # --- RTU frames over a pty pair, prints the device for MODBUS_DEVICE, runs until cancelled
+    (server_master, server_slave), (client_master, client_slave) = open_pty_bridge()
+    loop = asyncio.get_running_loop()
+    relay(loop, server_master, client_master)
+    relay(loop, client_master, server_master)
+    server = ModbusSerialServer(server_context(model, baud=baud, **kwargs), framer=FramerType.RTU, port=os.ttyname(server_slave), baudrate=baud)
+    print(f"[{module_name}] Marstek simulator on {os.ttyname(client_slave)}")
+    try:
+        await server.serve_forever()
+    finally:
+        for fd in (server_master, client_master):
+            loop.remove_reader(fd)
+        for fd in (server_master, server_slave, client_master, client_slave):
+            os.close(fd)
+
+
+if __name__ == "__main__":
+    transport = sys.argv[1] if len(sys.argv) > 1 else "pty"
+    model = VenusModel()
+    try:
+        if transport == "tcp":
+            port = int(sys.argv[2]) if len(sys.argv) > 2 else SIM_TCP_PORT
+            latency = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else SIM_LATENCY
+            asyncio.run(serve_tcp(model, port=port, latency=latency))
+        else:
+            latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else SIM_LATENCY
+            asyncio.run(serve_pty(model, latency=latency))
+    except KeyboardInterrupt:
+        print(f"[{module_name}] SoC {model.soc:.1f}%, charged {model.charged:.0f} Wh, discharged {model.discharged:.0f} Wh")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+p1feed.py
+  Replays the telegrams in p1.txt on a pseudo terminal (pty) like a P1 cable does
+  usage: python p1feed.py [interval]
+    prints the serial device to use as DSMR_SERIAL_DEVICE (with DSMR_INPUT = "serial")
+"""
+
+import os
+import pty
+import sys
+import time
+import tty
+
+# -----------------------------------------------------------------
+module_name = "FEED"
+# -----------------------------------------------------------------
+
+P1_FIXTURE = "p1.txt"
+
+def load_frames(file_path=P1_FIXTURE):
+    # --- Telegrams from "/" up to and including the "!XXXX" line, with CRLF line ends as on the wire
+    frames = []
+    lines = []
+    with open(file_path, encoding="utf-8") as p1file:
+        for line in p1file.read().splitlines():
+            if line.startswith("/"):
+                lines = []
+            lines.append(line)
+            if line.startswith("!"):
+                frames.append(("\r\n".join(lines) + "\r\n").encode("ascii"))
+    return frames
+
+def feed(interval=1.0):
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    print(f"[{module_name}] P1 serial device: {os.ttyname(slave)}")
+    frames = load_frames()
+    cntr = 0
+    try:
+        while True:
+            os.write(master, frames[cntr % len(frames)])
+            cntr += 1
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print(f"[{module_name}] {cntr} telegrams sent")
+    finally:
+        os.close(master)
+        os.close(slave)
+
+
+if __name__ == "__main__":
+    feed(float(sys.argv[1]) if len(sys.argv) > 1 else 1.0)
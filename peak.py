@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+peak.py
+  Capacity tariff: the bill follows the highest quarter-hour average import power of the month
+    PeakTracker - running quarter hour (stats.QuarterHourAverage) and the monthly peak, persisted across restarts
+                  shave_power(): discharge power that keeps the running quarter at the monthly peak (O(1) per telegram)
+"""
+
+import json
+import os
+import time
+import stats
+
+# -----------------------------------------------------------------
+module_name = "PEAK"
+# -----------------------------------------------------------------
+
+PEAK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ems_peak.json")
+PEAK_PERIOD = 900           # --- s, quarter hour
+PEAK_FLOOR = 2500.0         # --- W, minimum billed peak: no shaving below this average
+PEAK_MARGIN = 100.0         # --- W, the running quarter aims this far below the monthly peak
+
+# -----------------------------------------------------------------------------------------
+# --- Peak tracker ------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+class PeakTracker:
+    """Quarter-hour average import of the primary meter and the highest closed quarter of the month.
+    Only complete quarters count for the peak: a partial one (restart or outage within the quarter) has an estimated
+    average. The monthly peak is written to PEAK_FILE when it rises and when a new month starts"""
+
+    def __init__(self, file_path=PEAK_FILE, floor=PEAK_FLOOR, margin=PEAK_MARGIN, period=PEAK_PERIOD):
+        self.file_path = file_path
+        self.floor = floor
+        self.margin = margin
+        self.quarter = stats.QuarterHourAverage(period)
+        self.month = ""             # --- "YYYY-MM" of the peak (local time)
+        self.peak = 0.0             # --- W, highest quarter-hour average of the month
+        self.peak_start = 0         # --- epoch of the start of that quarter
+        self.last_average = 0.0     # --- W, average of the last closed quarter
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.file_path) as peak_file:
+                saved = json.load(peak_file)
+            self.month, self.peak, self.peak_start = saved["month"], float(saved["peak"]), int(saved["start"])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass    # --- no (valid) file: no peak yet this month
+
+    def save(self):
+        temp_path = self.file_path + ".tmp"
+        with open(temp_path, "w") as peak_file:
+            json.dump({"month": self.month, "peak": round(self.peak, 1), "start": self.peak_start}, peak_file)
+        os.replace(temp_path, self.file_path)   # --- a restart never reads a half written file
+
+    def roll_month(self, time_stamp):
+        # --- A quarter in another month than the peak starts a new monthly peak
+        month = time.strftime("%Y-%m", time.localtime(time_stamp))
+        if month == self.month:
+            return False
+        self.month, self.peak, self.peak_start = month, 0.0, 0
+        return True
+
+    def update(self, time_stamp, energy, power):
+        # --- Per telegram: time_stamp epoch, energy import counter in Wh, power import power in W
+        # --- returns True when the monthly peak changed (and was saved)
+        previous_start = self.quarter.start
+        closed = self.quarter.update(time_stamp, energy, power)
+        if self.quarter.start == previous_start:
+            return False    # --- same quarter, same month
+        changed = False
+        if closed:
+            start, average, partial = closed
+            self.last_average = average
+            changed = self.roll_month(start)
+            if not partial and average > self.peak:
+                self.peak, self.peak_start = average, start
+                changed = True
+        changed = self.roll_month(time_stamp) or changed
+        if changed:
+            try:
+                self.save()
+            except OSError:
+                pass    # --- read-only install: the peak is only kept in memory
+        return changed
+
+    def target(self):
+        # --- W, quarter-hour average the running quarter may reach
+        return max(self.peak, self.floor) - self.margin
+
+    def shave_power(self, home_load):
+        # --- Discharge power in W that keeps the running quarter at target(): the rest of the quarter may import
+        # --- (target * period - imported so far) / remaining on average. home_load: net home power without the
+        # --- battery (W, pos is import). 0 when the projection stays below the target
+        quarter = self.quarter
+        remaining = quarter.remaining()
+        if quarter.start is None or remaining <= 0:
+            return 0.0
+        allowed = (self.target() * quarter.period - quarter.imported() * 3600) / remaining
+        return min(max(home_load - allowed, 0.0), max(home_load, 0.0))   # --- never export to shave
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+regmap.py
+  Marstek register map compiled from the EMS dictionaries (ems_dict_vXX.xlsx, sheet MARSTEK_MODBUS)
+    read_xlsx_sheet       - rows of one sheet as {column letter: text} (stdlib zipfile + ElementTree, no openpyxl)
+    compile_register_map  - MARSTEK_MODBUS sheet --> register map rows (IDXM_* columns, row 0 is the header)
+    build_register_map    - compile one dictionary into its pickled artifact (ems_dict_vXX.regmap)
+    load_register_map     - rows from the artifact, rebuilt when missing or older than the dictionary
+    select_dictionary     - dictionary to use for a firmware version (MRST_FW_VERSION)
+    resolve_register_map  - row of every MRST_xxx constant in a map, looked up by name
+    check_register_map    - MRST_xxx constants without a row in a map
+  build step: python regmap.py [ems_dict_vXX.xlsx ...]   (default: all dictionaries)
+"""
+
+import glob
+import os
+import pickle
+import re
+import sys
+import zipfile
+import xml.etree.ElementTree as ET
+
+# -----------------------------------------------------------------
+module_name = "RMAP"
+# -----------------------------------------------------------------
+
+REGMAP_DIR = os.path.dirname(os.path.abspath(__file__))
+REGMAP_SHEET = "MARSTEK_MODBUS"
+REGMAP_SUFFIX = ".regmap"
+REGMAP_FORMAT = 2               # --- artifact layout version, older artifacts are rebuilt (2: REGMAP_RENAMES)
+
+REGMAP_DEFAULT = "ems_dict_v07.xlsx"
+REGMAP_FW_V06 = 1.0             # --- first firmware (MRST_FW_VERSION) with the v06 / v07 register layout
+# --- (first firmware version, dictionary) in ascending order, MRST_FW_VERSION selects the last entry <= firmware
+# --- add an entry when a firmware release moves or renames registers
+REGMAP_FIRMWARE = [
+    (0.0, "ems_dict_v05.xlsx"),         # --- backup power at offset 2 of its block
+    (REGMAP_FW_V06, REGMAP_DEFAULT),    # --- v06 has the same layout as v07
+]
+
+# --- (row name, mode) in older dictionaries --> current row name (v05 names the inverter state and command alike)
+REGMAP_RENAMES = {
+    ("MRST_INV_STATE", "R"): "MRST_GET_INV_STATE",
+    ("MRST_INV_STATE", "RW"): "MRST_SET_INV_STATE",
+}
+
+# --- Sheet header name --> register map column (same order as the IDXM_* constants in batt.py)
+REGMAP_COLUMNS = ("INDX", "NAME", "ADDR", "ABBR", "BLCK", "OFFSET", "MODE", "TYPE", "RVAL", "WVAL", "GAIN", "CONV", "UNIT", "DESC")
+REGMAP_ALIASES = {"RAWV": "RVAL"}    # --- older dictionaries (v05, v06)
+REGMAP_NUMBERS = ("INDX", "ADDR", "BLCK", "OFFSET", "GAIN")
+
+XLSX_NS = {
+    "m": "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+}
+
+# -----------------------------------------------------------------------------------------
+# --- xlsx reader -------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+def read_xlsx_sheet(xlsx_path, sheet_name):
+    # --- Rows of one sheet as {column letter: text}, shared strings resolved, empty rows kept
+    with zipfile.ZipFile(xlsx_path) as xlsx:
+        workbook = ET.fromstring(xlsx.read("xl/workbook.xml"))
+        relations = ET.fromstring(xlsx.read("xl/_rels/workbook.xml.rels"))
+        targets = {relation.get("Id"): relation.get("Target") for relation in relations}
+        strings = []
+        if "xl/sharedStrings.xml" in xlsx.namelist():
+            for item in ET.fromstring(xlsx.read("xl/sharedStrings.xml")).findall("m:si", XLSX_NS):
+                strings.append("".join(text.text or "" for text in item.iter(f"{{{XLSX_NS['m']}}}t")))
+        for sheet in workbook.find("m:sheets", XLSX_NS):
+            if sheet.get("name") == sheet_name:
+                target = targets[sheet.get(f"{{{XLSX_NS['r']}}}id")].lstrip("/")
+                root = ET.fromstring(xlsx.read(target if target.startswith("xl/") else "xl/" + target))
+                break
+        else:
+            raise KeyError(f"{os.path.basename(xlsx_path)}: no sheet {sheet_name}")
+
+    rows = []
+    for row in root.iter(f"{{{XLSX_NS['m']}}}row"):
+        cells = {}
+        for cell in row.findall("m:c", XLSX_NS):
+            value = cell.find("m:v", XLSX_NS)
+            if value is not None:
+                text = strings[int(value.text)] if cell.get("t") == "s" else value.text
+            else:
+                inline = cell.find("m:is", XLSX_NS)
+                text = "".join(t.text or "" for t in inline.iter(f"{{{XLSX_NS['m']}}}t")) if inline is not None else None
+            if text is not None:
+                cells[re.match(r"[A-Z]+", cell.get("r")).group()] = text
+        rows.append(cells)
+    return rows
+
+# -----------------------------------------------------------------------------------------
+# --- Compiler ----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+def sheet_text(text):
+    # --- The sheet generates python source: strip the quotes, commas and brackets around a value
+    return (text or "").strip().strip('[],"').strip()
+
+def sheet_number(text):
+    text = sheet_text(text)
+    if not text:
+        return 0
+    number = float(text)
+    return int(number) if number.is_integer() and "." not in text else number
+
+def compile_register_map(xlsx_path):
+    # --- MARSTEK_MODBUS sheet --> [header, row 1, ...], the header row names the column of every field
+    sheet = read_xlsx_sheet(xlsx_path, REGMAP_SHEET)
+    columns = {}
+    for letter, text in sheet[0].items():
+        name = sheet_text(text)
+        name = REGMAP_ALIASES.get(name, name)
+        if name in REGMAP_COLUMNS:
+            columns[name] = letter
+    missing = [name for name in REGMAP_COLUMNS if name not in columns and name not in ("RVAL", "WVAL", "CONV")]
+    if missing:
+        raise ValueError(f"{os.path.basename(xlsx_path)}: {REGMAP_SHEET} has no column {', '.join(missing)}")
+
+    rows = [list(REGMAP_COLUMNS)]
+    for cells in sheet[1:]:
+        if sheet_text(cells.get("A")) or not cells.get(columns["NAME"]):
+            continue    # --- only the "[ 1, "MRST_...", ... ]," rows
+        row = []
+        for name in REGMAP_COLUMNS:
+            text = cells.get(columns.get(name))
+            if name in ("RVAL", "WVAL", "CONV"):
+                row.append(0)       # --- run time values
+            elif name in REGMAP_NUMBERS:
+                row.append(sheet_number(text))
+            elif name in ("UNIT", "DESC"):
+                row.append(text if text is not None else "")    # --- kept as is (unit " " is a blank unit)
+            else:
+                row.append(sheet_text(text))
+        row[1] = REGMAP_RENAMES.get((row[1], row[6]), row[1])
+        if row[0] != len(rows):
+            raise ValueError(f"{os.path.basename(xlsx_path)}: {REGMAP_SHEET} row {row[1]} has INDX {row[0]}, expected {len(rows)}")
+        rows.append(row)
+    return rows
+
+# -----------------------------------------------------------------------------------------
+# --- Artifact ----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+def dictionary_path(dictionary):
+    return dictionary if os.path.isabs(dictionary) else os.path.join(REGMAP_DIR, dictionary)
+
+def artifact_path(dictionary):
+    return os.path.splitext(dictionary_path(dictionary))[0] + REGMAP_SUFFIX
+
+def build_register_map(dictionary):
+    # --- Compile the dictionary and write its artifact, returns the rows
+    xlsx_path = dictionary_path(dictionary)
+    rows = compile_register_map(xlsx_path)
+    artifact = {"format": REGMAP_FORMAT, "source": os.path.basename(xlsx_path), "mtime": os.path.getmtime(xlsx_path), "rows": rows}
+    temp_path = artifact_path(dictionary) + ".tmp"
+    with open(temp_path, "wb") as file:
+        pickle.dump(artifact, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, artifact_path(dictionary))   # --- a reader never sees a half written artifact
+    return rows
+
+def load_register_map(dictionary=REGMAP_DEFAULT):
+    # --- Rows from the artifact; compiled from the dictionary when the artifact is missing or stale
+    xlsx_path = dictionary_path(dictionary)
+    try:
+        with open(artifact_path(dictionary), "rb") as file:
+            artifact = pickle.load(file)
+        if artifact["format"] == REGMAP_FORMAT and (not os.path.exists(xlsx_path) or artifact["mtime"] == os.path.getmtime(xlsx_path)):
+            return artifact["rows"]
+    except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+        pass
+    try:
+        return build_register_map(dictionary)
+    except OSError:
+        return compile_register_map(xlsx_path)   # --- read-only install: compile without caching
+
+def select_dictionary(fw_version):
+    # --- Dictionary of the last REGMAP_FIRMWARE entry at or below the firmware version
+    selected = REGMAP_FIRMWARE[0][1]
+    for first_version, dictionary in REGMAP_FIRMWARE:
+        if fw_version >= first_version:
+            selected = dictionary
+    return selected
+
+def resolve_register_map(names, constants):
+    # --- names: NAME column of the map; returns {MRST_xxx: row} for the constants found in the map,
+    # --- the first row with that name (or MRST_xxx_H, the high word of a u32)
+    index = {}
+    for reg_index in range(len(names) - 1, 0, -1):
+        index[names[reg_index]] = reg_index
+    resolved = {}
+    for name in constants:
+        reg_index = index.get(name, index.get(name + "_H"))
+        if reg_index is not None:
+            resolved[name] = reg_index
+    return resolved
+
+def check_register_map(names, constants):
+    # --- Row constants (MRST_xxx) the map has no row for; rows may sit elsewhere than in the default map
+    resolved = resolve_register_map(names, constants)
+    return [name for name in constants if name not in resolved]
+
+# -----------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    for dictionary in sys.argv[1:] or sorted(glob.glob(os.path.join(REGMAP_DIR, "ems_dict_v*.xlsx"))):
+        rows = build_register_map(dictionary)
+        print(f"[{module_name}] {os.path.basename(dictionary)} --> {os.path.basename(artifact_path(dictionary))}: {len(rows) - 1} registers")
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+regs.py
+  Register store shared by the Modbus layer (batt.py) and the CLI (main.py), no per-cycle copying
+    RegisterStore - Marstek registers as parallel columns: raw words (array "H"), converted values (array "d"),
+                    text of char registers, read time per block (monotonic) and a name / address index
+    RegisterTable - list-of-lists view on the store: MARSTEK_MODBUS[row][IDXM_*] keeps working
+    BattTable     - list-of-lists view with the BATT_* fields: globl.BATT_REGISTERS[row][IDXB_*] keeps working
+"""
+
+from array import array
+
+# -----------------------------------------------------------------
+module_name = "REGS"
+# -----------------------------------------------------------------
+
+# --- Columns of a register map row (same order as the IDXM_* constants in batt.py)
+REGS_COLUMNS = ("indx", "name", "addr", "abbr", "blck", "offs", "mode", "type", "rval", "wval", "gain", "conv", "unit", "desc")
+COL_CONV = REGS_COLUMNS.index("conv")
+
+# --- Columns of a BATT field row (same order as the IDXB_* constants in globl.py)
+BATT_COL_GVAL = 3
+BATT_COL_SVAL = 4
+
+# -----------------------------------------------------------------------------------------
+# --- Register store ----------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+class RegisterStore:
+    """One entry per register row, row 0 is the header (rows are numbered like the MRST_* constants).
+    Numeric columns are typed arrays, the converted value of char registers is kept in text"""
+
+    def __init__(self):
+        self.header = list(REGS_COLUMNS)
+        self.generation = 0     # --- incremented by every load, views re-resolve their indexes
+        self.load([self.header])
+
+    def load(self, rows):
+        # --- rows: register map as list of lists (IDXM_* columns), rows[0] is the header
+        count = len(rows)
+        self.header = list(rows[0])
+        data = [self.header[:1] + [""] * (len(REGS_COLUMNS) - 1)] + [list(row) for row in rows[1:]]
+        self.name = [row[1] for row in data]
+        self.addr = array("H", [row[2] or 0 for row in data])
+        self.abbr = [row[3] for row in data]
+        self.blck = array("H", [row[4] or 0 for row in data])
+        self.offs = array("H", [row[5] or 0 for row in data])
+        self.mode = [row[6] for row in data]
+        self.type = [row[7] for row in data]
+        self.rval = array("H", [0] * count)
+        self.wval = array("H", [0] * count)
+        self.gain = array("d", [row[10] or 0 for row in data])
+        self.conv = array("d", [0.0] * count)
+        self.unit = [row[12] for row in data]
+        self.desc = [row[13] for row in data]
+        self.text = ["" if reg_type == "c" else None for reg_type in self.type]
+        self.stamp = array("d", [0.0] * count)     # --- time.monotonic() of the last decode, on the first row of a block
+        # --- converted values with an integral gain are shown as int (like value * 1 in the list version)
+        self.integral = [reg_type != "c" and float(gain).is_integer() for reg_type, gain in zip(self.type, self.gain)]
+        self.integral[0] = False
+        # --- name --> first row with that name (char blocks repeat the name), address --> row
+        self.index = {}
+        for reg_index in range(count - 1, 0, -1):
+            self.index[self.name[reg_index]] = reg_index
+        self.by_addr = {self.addr[reg_index]: reg_index for reg_index in range(1, count)}
+        self.generation += 1
+
+    def __len__(self):
+        return len(self.name)
+
+    def value(self, reg_index):
+        # --- Converted value of one row: str (char), int (integral gain) or float
+        if self.text[reg_index] is not None:
+            return self.text[reg_index]
+        if self.integral[reg_index]:
+            return int(self.conv[reg_index])
+        return self.conv[reg_index]
+
+    def stamp_time(self, reg_index):
+        # --- time.monotonic() the block of this row was last read (0.0: never)
+        return self.stamp[reg_index - self.offs[reg_index]]
+
+    def block_text(self, reg_index):
+        # --- Text of a char block (e.g. device name: 10 registers --> 20 chars)
+        return "".join(self.text[reg_index:reg_index + max(self.blck[reg_index], 1)])
+
+    def get(self, reg_index, column):
+        if column == COL_CONV:
+            return self.value(reg_index)
+        if column == 0:
+            return reg_index if reg_index else self.header[0]
+        return getattr(self, REGS_COLUMNS[column])[reg_index]
+
+    def set(self, reg_index, column, value):
+        if column == COL_CONV:
+            if self.text[reg_index] is not None:
+                self.text[reg_index] = value
+            else:
+                self.conv[reg_index] = value
+        elif column != 0:
+            getattr(self, REGS_COLUMNS[column])[reg_index] = value
+
+# -----------------------------------------------------------------------------------------
+# --- List-of-lists views -----------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+class RowView:
+    """One row of a table view: row[IDX*] reads and writes the store"""
+
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, column):
+        return self.table.get(self.index, column)
+
+    def __setitem__(self, column, value):
+        self.table.set(self.index, column, value)
+
+    def __len__(self):
+        return self.table.width
+
+    def __iter__(self):
+        return (self.table.get(self.index, column) for column in range(self.table.width))
+
+    def __repr__(self):
+        return repr(list(self))
+
+class RegisterTable:
+    """MARSTEK_MODBUS as a view on the store, row 0 is the header"""
+
+    width = len(REGS_COLUMNS)
+
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[reg_index] for reg_index in range(*index.indices(len(self)))]
+        if index == 0:
+            return self.store.header
+        if index < 0:
+            index += len(self)
+        if not 0 < index < len(self):
+            raise IndexError(index)
+        return RowView(self, index)
+
+    def get(self, index, column):
+        return self.store.get(index, column)
+
+    def set(self, index, column, value):
+        self.store.set(index, column, value)
+
+class BattTable:
+    """BATT_REGISTERS as a view on the store: GVAL is read from the MRST_* row with the same name
+    (char blocks are joined, u32 statistics use the high word row MRST_*_H), SVAL is kept here"""
+
+    def __init__(self, store, fields):
+        self.store = store
+        self.fields = [list(row) for row in fields]     # --- INDX, NAME, ABBR, GVAL, SVAL, UNIT, DESC
+        self.width = len(self.fields[0])
+        self.sval = [row[BATT_COL_SVAL] for row in self.fields]
+        self.sources = []
+        self.generation = -1
+
+    def resolve(self):
+        # --- BATT_xxx --> row of MRST_xxx (or MRST_xxx_H) in the store, None when not in the map
+        self.sources = [None]
+        for row in self.fields[1:]:
+            mrst_name = "MRST_" + row[1][len("BATT_"):]
+            self.sources.append(self.store.index.get(mrst_name, self.store.index.get(mrst_name + "_H")))
+        self.generation = self.store.generation
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[batt_index] for batt_index in range(*index.indices(len(self)))]
+        if index == 0:
+            return self.fields[0]
+        return RowView(self, index % len(self))
+
+    def get(self, index, column):
+        if column == BATT_COL_GVAL:
+            if self.generation != self.store.generation:
+                self.resolve()
+            reg_index = self.sources[index]
+            if reg_index is None:
+                return self.fields[index][BATT_COL_GVAL]
+            if self.store.type[reg_index] == "c":
+                return self.store.block_text(reg_index)
+            return self.store.value(reg_index)
+        if column == BATT_COL_SVAL:
+            return self.sval[index]
+        return self.fields[index][column]
+
+    def set(self, index, column, value):
+        if column == BATT_COL_SVAL:
+            self.sval[index] = value
+        elif column == BATT_COL_GVAL:
+            raise TypeError("BATT_REGISTERS GVAL is read from the register store")
+        else:
+            self.fields[index][column] = value
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+stats.py
+  Streaming statistics with O(1) work per new value
+    RollingWindow - mean, min, max and variance over the last N values (fixed ring buffer)
+    RollingStats  - a set of rolling windows plus EWMA values for one signal (e.g. HOME_PWR_TOT)
+    Histogram     - counts per fixed bucket (e.g. Modbus latency), percentiles without keeping the values
+    QuarterHourAverage - average import power of the running quarter hour and its projection to the end of the quarter
+"""
+
+from array import array
+from bisect import bisect_left
+from collections import deque
+
+# -----------------------------------------------------------------
+module_name = "STAT"
+# -----------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------------
+# --- Rolling window ----------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+class RollingWindow:
+    """Mean, min, max and variance over the last `size` values.
+    Running sums over a fixed ring buffer, min/max via monotonic queues (amortized O(1))"""
+
+    __slots__ = ("size", "ring", "index", "count", "total", "total_sq", "minq", "maxq", "seq")
+
+    def __init__(self, size):
+        self.size = size
+        self.ring = [0.0] * size    # --- last `size` values
+        self.index = 0              # --- next write position in the ring
+        self.count = 0              # --- number of valid values (<= size)
+        self.total = 0.0            # --- running sum
+        self.total_sq = 0.0         # --- running sum of squares
+        self.minq = deque()         # --- (seq, value) increasing values, front is the minimum
+        self.maxq = deque()         # --- (seq, value) decreasing values, front is the maximum
+        self.seq = 0                # --- sequence number of the next value
+
+    def update(self, value):
+        old = self.ring[self.index]
+        self.ring[self.index] = value
+        if self.count == self.size:
+            self.total += value - old
+            self.total_sq += value * value - old * old
+        else:
+            self.count += 1
+            self.total += value
+            self.total_sq += value * value
+        self.index += 1
+        if self.index == self.size:
+            # --- once per lap: recompute the sums so float rounding can not build up
+            self.index = 0
+            self.total = sum(self.ring)
+            self.total_sq = sum(v * v for v in self.ring)
+        # --- monotonic queues, drop the values that left the window
+        seq = self.seq
+        self.seq += 1
+        while self.minq and self.minq[-1][1] >= value: self.minq.pop()
+        self.minq.append((seq, value))
+        while self.maxq and self.maxq[-1][1] <= value: self.maxq.pop()
+        self.maxq.append((seq, value))
+        if self.minq[0][0] <= seq - self.size: self.minq.popleft()
+        if self.maxq[0][0] <= seq - self.size: self.maxq.popleft()
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def min(self):
+        return self.minq[0][1] if self.minq else 0.0
+
+    def max(self):
+        return self.maxq[0][1] if self.maxq else 0.0
+
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        mean = self.total / self.count
+        return max(0.0, self.total_sq / self.count - mean * mean)
+
+# -----------------------------------------------------------------------------------------
+# --- Rolling statistics for one signal ---------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+class RollingStats:
+    """Last value, rolling windows and EWMA values of one signal.
+    Readers (control loop, CLI) only read the precomputed results"""
+
+    def __init__(self, sizes=(2, 3, 4, 5, 6, 8), alphas=(0.5,)):
+        self.windows = {size: RollingWindow(size) for size in sizes}
+        self.alphas = tuple(alphas)
+        self.ewmas = {alpha: 0.0 for alpha in self.alphas}
+        self.value = 0.0        # --- last value
+        self.count = 0          # --- number of values seen
+
+    def update(self, value):
+        self.value = value
+        for window in self.windows.values():
+            window.update(value)
+        for alpha in self.alphas:
+            # --- the first value seeds the EWMA
+            self.ewmas[alpha] = value if self.count == 0 else self.ewmas[alpha] + alpha * (value - self.ewmas[alpha])
+        self.count += 1
+
+    def mean(self, size):
+        return self.windows[size].mean()
+
+    def ewma(self, alpha=None):
+        return self.ewmas[self.alphas[0] if alpha is None else alpha]
+
+# -----------------------------------------------------------------------------------------
+# --- Fixed bucket histogram --------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+class Histogram:
+    """Counts per bucket, edges are the upper bounds of the buckets (ascending), the last bucket
+    counts everything above the last edge. add() only increments in place: no allocation per value"""
+
+    __slots__ = ("edges", "counts", "count", "total", "peak")
+
+    def __init__(self, edges):
+        self.edges = tuple(edges)
+        self.counts = array("Q", [0] * (len(self.edges) + 1))
+        self.count = 0
+        self.total = 0.0
+        self.peak = 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(self.edges, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.peak:
+            self.peak = value
+
+    def clear(self):
+        for bucket in range(len(self.counts)):
+            self.counts[bucket] = 0
+        self.count = 0
+        self.total = 0.0
+        self.peak = 0.0
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        # --- Upper edge of the bucket that holds the percentile (the peak for the overflow bucket)
+        if not self.count:
+            return 0.0
+        rank = percent / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.edges[bucket], self.peak) if bucket < len(self.edges) else self.peak
+        return self.peak
+
+# -----------------------------------------------------------------------------------------
+# --- Quarter hour average ----------------------------------------------------------------
+# -----------------------------------------------------------------------------------------
+
+class QuarterHourAverage:
+    """Average import power of the running quarter hour (capacity tariff), from the meter's import energy counter.
+    update() closes a quarter when a telegram falls in the next one; the counter at the boundary is interpolated
+    with the present power; after a gap of a quarter or more the old quarter only counts up to its last telegram.
+    A quarter without telegrams around its start (first quarter after a (re)start, first one after a gap) or its end
+    (last one before a gap) is partial: its average is an estimate, closed returns it with partial True.
+    projected() assumes the present power until the end of the quarter"""
+
+    __slots__ = ("period", "start", "start_energy", "energy", "power", "time", "partial")
+
+    def __init__(self, period=900):
+        self.period = period        # --- s
+        self.start = None           # --- epoch of the start of the running quarter
+        self.start_energy = 0.0     # --- Wh, import counter at the start of the quarter
+        self.energy = 0.0           # --- Wh, import counter of the last telegram
+        self.power = 0.0            # --- W, import power of the last telegram
+        self.time = 0               # --- epoch of the last telegram
+        self.partial = False        # --- the counter at the start of the running quarter is estimated
+
+    def update(self, time_stamp, energy, power):
+        # --- time_stamp: epoch of the telegram, energy: import counter in Wh, power: import power in W
+        # --- returns (start, average W, partial) of the quarter that was closed by this telegram, else None
+        quarter = time_stamp - time_stamp % self.period
+        closed = None
+        boundary_energy = energy - power * (time_stamp - quarter) / 3600
+        if self.start is None:
+            self.start_energy = boundary_energy     # --- started within the quarter: counter at its start estimated
+            self.partial = time_stamp > quarter
+        elif quarter == self.start + self.period:
+            boundary_energy = max(self.energy, min(energy, boundary_energy))
+            closed = (self.start, (boundary_energy - self.start_energy) * 3600 / self.period, self.partial)
+            self.start_energy = boundary_energy
+            self.partial = False
+        elif quarter != self.start:
+            # --- no telegrams at the end of the quarter (outage, restart): the import during the gap belongs to
+            # --- unknown quarters, the old quarter closes with its energy up to its last telegram
+            closed = (self.start, (self.energy - self.start_energy) * 3600 / self.period, True)
+            self.start_energy = max(self.energy, min(energy, boundary_energy))
+            self.partial = time_stamp > quarter
+        self.start = quarter
+        self.energy = energy
+        self.power = power
+        self.time = time_stamp
+        return closed
+
+    def elapsed(self):
+        return self.time - self.start if self.start is not None else 0
+
+    def remaining(self):
+        return self.period - self.elapsed()
+
+    def imported(self):
+        # --- Wh imported in the running quarter
+        return self.energy - self.start_energy
+
+    def average(self):
+        # --- W, average so far
+        elapsed = self.elapsed()
+        return self.imported() * 3600 / elapsed if elapsed > 0 else self.power
+
+    def projected(self):
+        # --- W, quarter average when the present power holds until the end of the quarter
+        if self.start is None:
+            return 0.0
+        return (self.imported() * 3600 + self.power * self.remaining()) / self.period
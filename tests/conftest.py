@@ -0,0 +1,26 @@
+"""
+conftest.py
+  The modules live flat in the repository root: make them importable for the tests
+    default_map - fixture: batt is back on the default register map after the test
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def default_map():
+    import batt
+    import regmap
+    yield
+    if batt.MRST_DICTIONARY != regmap.REGMAP_DEFAULT:
+        batt.MRST_STORE.load(regmap.load_register_map(regmap.REGMAP_DEFAULT))
+        batt.MRST_DICTIONARY = regmap.REGMAP_DEFAULT
+        vars(batt).update(regmap.resolve_register_map(batt.MRST_STORE.name, batt.marstek_row_constants()))
+        batt.MRST_DECODE_PLAN = batt.compile_decode_plan()
+        batt.write_cache.deadbands = batt.marstek_write_deadbands()
+    batt.write_cache.clear()
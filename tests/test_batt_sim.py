@@ -0,0 +1,119 @@
+"""
+test_batt_sim.py
+  batt.batt_main against the simulator (mrstsim.py, RTU over TCP): NOM cycle, register map switch, control latency
+"""
+
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+import batt
+import dsmr
+import globl
+import mbus
+import mrstsim
+import regmap
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_batt(monkeypatch, model, seconds, rows=None, interval=0.2, latency=0.001, telegram_period=None):
+    # --- batt_main and the simulator in one event loop for a few seconds, returns the bus statistics
+    # --- telegram_period: publish the grid power of the model as a meter telegram every period seconds
+    port = free_port()
+    monkeypatch.setattr(batt, "MODBUS_DEVICE", f"tcp:127.0.0.1:{port}")
+    monkeypatch.setattr(globl, "bus_stats", mbus.BusStats())
+    monkeypatch.setattr(globl, "log_debug", lambda module, sentence: None)
+    monkeypatch.setattr(globl, "log_loop", lambda module, sentence: None)
+    monkeypatch.setattr(batt, "print_modbus_registers", lambda: None)
+    monkeypatch.setattr(dsmr, "telegram_signal", dsmr.TelegramSignal())
+    stop_event = threading.Event()
+
+    async def meter():
+        while True:
+            await asyncio.sleep(telegram_period)
+            now = time.monotonic()
+            globl.HOME_POWER[globl.HOME_PWR_TOT][globl.IDXH_HVAL] = round(model.grid_power())
+            globl.HOME_POWER[globl.HOME_PWR_TOT][globl.IDXH_TIME] = now
+            dsmr.telegram_signal.notify(now)
+
+    async def scenario():
+        server = asyncio.create_task(mrstsim.serve_tcp(model, port=port, rows=rows, latency=latency, jitter=0.0, baud=0))
+        await asyncio.sleep(0.3)
+        tasks = [server] + ([asyncio.create_task(meter())] if telegram_period else [])
+        batt_task = asyncio.create_task(batt.batt_main(stop_event, interval))
+        await asyncio.sleep(seconds)
+        stop_event.set()
+        await asyncio.wait_for(batt_task, 5.0)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(scenario())
+    return globl.bus_stats
+
+
+def test_older_firmware_switches_the_map_and_restarts_the_bus(monkeypatch, default_map):
+    # --- the statistics get the entries of a plan only while no bus worker runs
+    running, prepared = [0], []
+    bus_run, stats_prepare = mbus.ModbusBus.run, mbus.BusStats.prepare
+
+    async def run(bus):
+        running[0] += 1
+        try:
+            await bus_run(bus)
+        finally:
+            running[0] -= 1
+
+    def prepare(bus_stats, requests):
+        prepared.append(running[0])
+        stats_prepare(bus_stats, requests)
+
+    monkeypatch.setattr(mbus.ModbusBus, "run", run)
+    monkeypatch.setattr(mbus.BusStats, "prepare", prepare)
+    rows = regmap.load_register_map("ems_dict_v05.xlsx")
+    bus_stats = run_batt(monkeypatch, mrstsim.VenusModel(soc=60.0, fw_version=0.9), 2.0, rows=rows)
+    assert batt.MRST_DICTIONARY == "ems_dict_v05.xlsx"
+    assert prepared == [0, 0]
+    # --- every read of both plans has its own entry: nothing lands in the catch-all entry
+    assert bus_stats.functions[mbus.FC_READ][mbus.BUS_ADDR_OTHER].latency.count == 0
+    assert bus_stats.cycles.count > 2
+    assert batt.MRST_STORE.value(batt.MRST_FW_VERSION) == pytest.approx(0.9)
+
+
+def test_control_latency_is_split_at_the_register_reads(monkeypatch, default_map):
+    # --- NOM on telegrams: every tick that wrote adds one sample to both parts. The read part holds at least
+    # --- one simulated response time, the write part only the writes of the tick (RTU mode, inverter state, power)
+    latency = 0.03
+    monkeypatch.setattr(globl, "mode_nom", True)
+    monkeypatch.setattr(globl, "ctrl_read_latency", globl.stats.Histogram(globl.CTRL_LATENCY_EDGES))
+    monkeypatch.setattr(globl, "ctrl_latency", globl.stats.Histogram(globl.CTRL_LATENCY_EDGES))
+    model = mrstsim.VenusModel(soc=60.0)
+    model.load = 700.0
+    run_batt(monkeypatch, model, 4.0, interval=2.0, latency=latency, telegram_period=0.5)
+    reads, writes = globl.ctrl_read_latency, globl.ctrl_latency
+    assert writes.count > 0 and reads.count == writes.count
+    assert reads.mean() >= latency
+    assert latency <= writes.mean() and writes.peak < 4 * latency + 0.05
+
+
+def test_nom_cycle_balances_the_meter(monkeypatch, default_map):
+    # --- End to end: telegrams with a 700 W import, NOM switches the simulated battery to RTU mode and discharge
+    # --- and settles the grid power near 0 W; the setpoints the simulator holds are confirmed in the write cache
+    monkeypatch.setattr(globl, "mode_nom", True)
+    model = mrstsim.VenusModel(soc=60.0)
+    model.load = 700.0
+    bus_stats = run_batt(monkeypatch, model, 12.0, interval=2.0, telegram_period=0.5)
+    assert model.setpoints["MRST_RTU_MODE"] == mrstsim.SIM_RTU_ON
+    assert model.setpoints["MRST_SET_INV_STATE"] == globl.INV_STATE_DISCHARGE
+    assert abs(model.grid_power()) < 100.0
+    discharge_addr = batt.MRST_STORE.addr[batt.MRST_PWR_DISCHARGE]
+    assert batt.write_cache.confirmed[discharge_addr] == model.setpoints["MRST_PWR_DISCHARGE"]
+    assert bus_stats.functions[mbus.FC_READ][mbus.BUS_ADDR_OTHER].latency.count == 0
+    assert sum(entry.failures() for entry in bus_stats.entries()) == 0
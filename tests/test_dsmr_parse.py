@@ -0,0 +1,85 @@
+"""
+test_dsmr_parse.py
+  dsmr.parse_telegram (single pass OBIS parser, reused record) and dsmr.decode_time_stamp around the DST switches
+"""
+
+import calendar
+import os
+
+import pytest
+import dsmr
+import p1feed
+
+FRAMES = p1feed.load_frames(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), p1feed.P1_FIXTURE))
+
+
+def utc(year, month, day, hour, minute, second):
+    return calendar.timegm((year, month, day, hour, minute, second))
+
+
+def test_telegram_fields():
+    record = dsmr.parse_telegram(FRAMES[0].decode("ascii"))
+    assert record.version == 5.0
+    assert record.time_stamp == utc(2025, 10, 30, 15, 13, 6)    # --- 16:13:06 CET
+    assert not record.dst
+    assert record.serial_num == "4530303434303037343238353839323139"
+    assert (record.enrg_t1_cons, record.enrg_t2_cons) == (17976.723, 13530.092)
+    assert (record.enrg_t1_prod, record.enrg_t2_prod) == (1991.034, 4626.697)
+    assert (record.pwr_tot_cons, record.pwr_tot_prod) == (195.0, 0.0)  # --- kW --> W
+    assert (record.volt_l1, record.volt_l2, record.volt_l3) == (230.9, 231.1, 232.4)
+    assert (record.curr_l1, record.curr_l2, record.curr_l3) == (1.0, 1.0, 1.0)
+    assert (record.pwr_l1_cons, record.pwr_l3_cons, record.pwr_l2_prod) == (207.0, 152.0, 162.0)
+    assert record.text_msg == ""
+    assert record.pwr_failure_log == ((utc(2022, 11, 11, 14, 49, 37), 1025),)
+    # --- gas: the M-Bus channel line carries its own time stamp and the volume in the second group
+    assert record.gas_time_stamp == utc(2025, 10, 30, 15, 10, 2)
+    assert record.gas_volume == 7850.922
+    assert record.mbus2_value == 0
+
+
+def test_reused_record_lists_the_changed_slots():
+    record = dsmr.parse_telegram(FRAMES[0].decode("ascii"))
+    fresh = dsmr.parse_telegram(FRAMES[1].decode("ascii"))
+    reused = dsmr.parse_telegram(FRAMES[1].decode("ascii"), record)
+    assert reused is record
+    for attr in dsmr.SLOT_ATTR:
+        assert getattr(reused, attr) == getattr(fresh, attr), attr
+    changed = {dsmr.SLOT_ATTR[slot] for slot in reused.changed}
+    assert {"time_stamp", "enrg_t1_cons", "pwr_tot_cons"} <= changed
+    assert "serial_num" not in changed and "version" not in changed
+    assert dsmr.parse_telegram(FRAMES[1].decode("ascii"), record).changed == []
+
+
+@pytest.mark.parametrize("stamp, expected", [
+    # --- autumn: 03:00 CEST --> 02:00 CET, the hour 02:xx comes twice (S then W)
+    ("251026015959S", utc(2025, 10, 25, 23, 59, 59)),
+    ("251026023000S", utc(2025, 10, 26, 0, 30, 0)),
+    ("251026025959S", utc(2025, 10, 26, 0, 59, 59)),
+    ("251026020000W", utc(2025, 10, 26, 1, 0, 0)),
+    ("251026023000W", utc(2025, 10, 26, 1, 30, 0)),
+    ("251026030000W", utc(2025, 10, 26, 2, 0, 0)),
+    # --- spring: 02:00 CET --> 03:00 CEST
+    ("250330015959W", utc(2025, 3, 30, 0, 59, 59)),
+    ("250330030000S", utc(2025, 3, 30, 1, 0, 0)),
+])
+def test_time_stamp_around_the_dst_switch(stamp, expected):
+    dsmr.TIME_STAMP_CACHE.clear()
+    assert dsmr.decode_time_stamp(stamp) == expected
+    assert dsmr.decode_time_stamp(stamp) == expected    # --- from the hour cache
+
+
+def test_time_stamp_cache_keeps_both_02_hours_apart():
+    # --- the same YYMMDDhh with S and W are different hours
+    dsmr.TIME_STAMP_CACHE.clear()
+    summer = dsmr.decode_time_stamp("251026021500S")
+    winter = dsmr.decode_time_stamp("251026021500W")
+    assert winter - summer == 3600
+    assert dsmr.decode_time_stamp("251026021501S") == summer + 1
+    assert dsmr.decode_time_stamp("") == 0
+
+
+def test_summer_time_telegram_sets_dst():
+    telegram = FRAMES[0].decode("ascii").replace("0-0:1.0.0(251030161306W)", "0-0:1.0.0(250630161306S)")
+    record = dsmr.parse_telegram(telegram)
+    assert record.dst
+    assert record.time_stamp == utc(2025, 6, 30, 14, 13, 6)     # --- 16:13:06 CEST
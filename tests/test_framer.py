@@ -0,0 +1,72 @@
+"""
+test_framer.py
+  dsmr.crc16 and dsmr.P1Framer on the telegrams of p1.txt: CRC check, split reads, resync on garbage and cut telegrams
+"""
+
+import os
+
+import dsmr
+import p1feed
+
+FRAMES = p1feed.load_frames(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), p1feed.P1_FIXTURE))
+TELEGRAMS = [frame.rstrip(b"\r\n") for frame in FRAMES]  # --- as returned: "/" up to and including the CRC
+
+
+def corrupt(frame):
+    # --- One changed digit in the body, the CRC is kept
+    index = frame.index(b"1.8.1(") + 6
+    return frame[:index] + bytes([frame[index] ^ 0x01]) + frame[index + 1:]
+
+
+def test_crc16_check_value():
+    assert dsmr.crc16(b"123456789") == 0xBB3D     # --- CRC16/ARC check value
+    assert dsmr.crc16(b"") == 0
+    for frame in FRAMES:
+        bang = frame.index(b"!")
+        assert dsmr.crc16(frame[:bang + 1]) == int(frame[bang + 1:bang + 5], 16)
+
+
+def test_telegrams_in_one_read_and_split_reads():
+    framer = dsmr.P1Framer()
+    assert framer.feed(b"".join(FRAMES), now=1.0) == TELEGRAMS
+    framer = dsmr.P1Framer()
+    stream = b"".join(FRAMES)
+    frames = []
+    for start in range(0, len(stream), 7):  # --- 7 bytes per read: every cut point, also inside the CRC
+        frames += framer.feed(stream[start:start + 7], now=1.0)
+    assert frames == TELEGRAMS
+    assert (framer.frames, framer.rejected, framer.resynced) == (2, 0, 0)
+
+
+def test_wrong_crc_is_rejected_and_the_next_telegram_kept():
+    framer = dsmr.P1Framer()
+    assert framer.feed(corrupt(FRAMES[0]) + FRAMES[1], now=1.0) == [TELEGRAMS[1]]
+    assert (framer.frames, framer.rejected) == (1, 1)
+    bad_hex = FRAMES[0][:FRAMES[0].index(b"!") + 1] + b"17DX\r\n"
+    assert framer.feed(bad_hex, now=2.0) == []
+    assert framer.rejected == 2
+
+
+def test_resync_on_garbage_and_cut_telegram():
+    framer = dsmr.P1Framer()
+    cut = FRAMES[0][:len(FRAMES[0]) // 2]
+    assert framer.feed(b"\x00\xffnoise" + cut + FRAMES[1], now=1.0) == [TELEGRAMS[1]]
+    assert framer.resynced == 2   # --- noise before the header, header of the next telegram before the end
+    assert framer.rejected == 0
+    assert framer.feed(b"\r\n\r\n" + FRAMES[0], now=2.0) == [TELEGRAMS[0]]
+    assert framer.resynced == 2   # --- whitespace between telegrams is no resync
+
+
+def test_runaway_header_is_skipped():
+    framer = dsmr.P1Framer(max_size=256)
+    assert framer.feed(b"/" + b"x" * 300, now=1.0) == []
+    assert framer.resynced >= 1
+    assert framer.feed(FRAMES[0], now=2.0) == [TELEGRAMS[0]]
+
+
+def test_late_telegram_is_counted():
+    framer = dsmr.P1Framer(interval=1.0)
+    framer.feed(FRAMES[0], now=10.0)
+    framer.feed(FRAMES[1], now=11.0)
+    framer.feed(FRAMES[0], now=13.0)
+    assert framer.late == 1
@@ -0,0 +1,76 @@
+"""
+test_peak.py
+  stats.QuarterHourAverage and peak.PeakTracker: quarter close, telegram gaps, restarts within a quarter
+"""
+
+import json
+import peak
+import stats
+
+QUARTER = 900
+START = 1_780_000_200 - 1_780_000_200 % QUARTER    # --- epoch at a quarter boundary
+
+
+def replay(tracker, first, last, power, energy=0.0, skip=None):
+    # --- One telegram per second from first to last (s after START) at a constant import power,
+    # --- returns the import counter (Wh) after the last telegram
+    closed = []
+    for second in range(first, last):
+        energy_now = energy + power * (second - first) / 3600
+        if skip and skip[0] <= second < skip[1]:
+            continue
+        result = tracker.update(START + second, energy_now, power)
+        if result and isinstance(tracker, stats.QuarterHourAverage):
+            closed.append(result)
+    return closed if isinstance(tracker, stats.QuarterHourAverage) else energy + power * (last - first) / 3600
+
+
+def test_quarter_closes_with_the_average():
+    quarter = stats.QuarterHourAverage(QUARTER)
+    closed = replay(quarter, 0, 3 * QUARTER + 1, 2000.0)
+    assert [round(average) for _, average, _ in closed] == [2000, 2000, 2000]
+    assert [start - START for start, _, _ in closed] == [0, QUARTER, 2 * QUARTER]
+    assert not any(partial for _, _, partial in closed)
+
+
+def test_quarter_gap_is_not_credited_to_the_last_quarter():
+    quarter = stats.QuarterHourAverage(QUARTER)
+    # --- steady 2000 W, no telegrams for 85 minutes starting 10 minutes into the first quarter
+    closed = replay(quarter, 0, 12 * QUARTER, 2000.0, skip=(600, 600 + 85 * 60))
+    first_start, first_average, first_partial = closed[0]
+    assert first_start == START
+    assert first_partial                                # --- no telegrams at its end
+    assert round(first_average) == round(2000.0 * 599 / QUARTER)     # --- up to its last telegram (599 s)
+    assert closed[1][2]                                 # --- the quarter the telegrams came back in
+    assert all(round(average) == 2000 and not partial for _, average, partial in closed[2:])
+
+
+def test_quarter_after_start_within_the_quarter_is_partial():
+    quarter = stats.QuarterHourAverage(QUARTER)
+    closed = replay(quarter, 14 * 60, 2 * QUARTER + 1, 1000.0)
+    assert closed[0][2] and not closed[1][2]
+
+
+def test_restart_within_a_quarter_does_not_set_the_peak(tmp_path):
+    file_path = str(tmp_path / "ems_peak.json")
+    tracker = peak.PeakTracker(file_path=file_path)
+    # --- two full quarters at 1 kW, the third quarter runs 14 minutes at 1 kW
+    energy = replay(tracker, 0, 2 * QUARTER + 14 * 60, 1000.0)
+    assert round(tracker.peak) == 1000
+
+    # --- restart at minute 14 while a 5 kW load is on: the counter at the quarter start is estimated from 5 kW
+    tracker = peak.PeakTracker(file_path=file_path)
+    energy = replay(tracker, 2 * QUARTER + 14 * 60, 3 * QUARTER, 5000.0, energy)
+    replay(tracker, 3 * QUARTER, 4 * QUARTER + 1, 1000.0, energy)
+    assert tracker.quarter.start == START + 4 * QUARTER
+    assert round(tracker.peak) == 1000
+    with open(file_path) as peak_file:
+        assert round(json.load(peak_file)["peak"]) == 1000
+
+
+def test_shave_power_keeps_the_quarter_at_the_target(tmp_path):
+    tracker = peak.PeakTracker(file_path=str(tmp_path / "ems_peak.json"), floor=2500.0, margin=100.0)
+    replay(tracker, 0, 450, 4000.0)                     # --- half a quarter at 4 kW
+    # --- 2400 W target: the second half may import 2 * 2400 - 4000 = 800 W on average
+    assert abs(tracker.shave_power(4000.0) - 3200.0) < 20.0
+    assert tracker.shave_power(500.0) == 0.0
@@ -0,0 +1,54 @@
+"""
+test_pid.py
+  ctrl.PIDController: anti-windup while saturated, slew rate, clamping, bumpless restart after a pause
+"""
+
+import pytest
+import ctrl
+
+
+def run(controller, measurements, low=0.0, high=2500.0, start=0.0, dt=1.0):
+    outputs = []
+    for step, measurement in enumerate(measurements):
+        outputs.append(controller.update(measurement, 0.0, low, high, start + step * dt))
+    return outputs
+
+
+def test_no_windup_while_saturated():
+    # --- 60 s of 5000 W import against a 2500 W limit, then the load drops: the output leaves the limit
+    # --- in the first step (an integrator without anti-windup would hold it for tens of seconds)
+    controller = ctrl.PIDController(kp=0.2, ki=0.5)
+    outputs = run(controller, [5000.0] * 60)
+    assert outputs[-1] == 2500.0
+    assert controller.integral + controller.kp * 5000.0 == pytest.approx(2500.0)
+    after = controller.update(-500.0, 0.0, 0.0, 2500.0, 60.0)   # --- now exporting 500 W
+    assert after == pytest.approx(2500.0 - 0.2 * 5500.0 - 0.5 * 500.0)
+
+
+def test_no_windup_at_the_low_limit():
+    controller = ctrl.PIDController(kp=0.2, ki=0.5)
+    run(controller, [-3000.0] * 60)
+    assert controller.output == 0.0
+    assert controller.update(400.0, 0.0, 0.0, 2500.0, 60.0) > 0.0
+
+
+def test_slew_limit_is_not_wound_up():
+    controller = ctrl.PIDController(kp=1.0, ki=1.0, slew_rate=100.0)
+    outputs = run(controller, [2000.0] * 5, dt=0.5)
+    assert all(abs(b - a) <= 50.0 + 1e-9 for a, b in zip(outputs[1:], outputs[2:]))
+    # --- the error goes away: the output stops rising at once instead of unwinding a slew backlog
+    stop = controller.update(0.0, 0.0, 0.0, 2500.0, 2.5)
+    assert stop <= outputs[-1]
+
+
+def test_output_stays_within_the_live_limits():
+    controller = ctrl.PIDController(kp=0.2, ki=0.5)
+    assert controller.update(5000.0, 0.0, 0.0, 800.0, 0.0) <= 800.0
+    assert controller.update(5000.0, 0.0, 0.0, 300.0, 1.0) == 300.0    # --- limit dropped (e.g. discharge cutoff)
+
+
+def test_bumpless_restart_after_a_pause():
+    controller = ctrl.PIDController(kp=0.2, ki=0.5)
+    run(controller, [1000.0] * 10)
+    output = controller.update(0.0, 0.0, 0.0, 2500.0, 10.0 + ctrl.CTRL_DT_MAX + 1.0, previous=600.0)
+    assert output == pytest.approx(600.0)   # --- continues from the setpoint the device holds
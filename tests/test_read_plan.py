@@ -0,0 +1,83 @@
+"""
+test_read_plan.py
+  mbus.plan_reads / split_span: merging register blocks into few read requests, one request per block after a rejected span
+"""
+
+import asyncio
+
+import batt
+import mbus
+
+
+def test_neighbouring_blocks_are_merged():
+    spans = mbus.plan_reads([("b", 110, 2), ("a", 100, 4), ("c", 200, 1)], max_gap=8, max_count=64)
+    assert [(span.addr, span.count) for span in spans] == [(100, 12), (200, 1)]
+    assert spans[0].blocks == (("a", 100, 4), ("b", 110, 2))    # --- in address order, whatever the input order
+
+
+def test_gap_and_count_limits():
+    blocks = [("a", 100, 4), ("b", 110, 2)]     # --- hole of 6 registers
+    assert len(mbus.plan_reads(blocks, max_gap=6, max_count=64)) == 1
+    assert len(mbus.plan_reads(blocks, max_gap=5, max_count=64)) == 2
+    assert len(mbus.plan_reads(blocks, max_gap=8, max_count=12)) == 1
+    assert len(mbus.plan_reads(blocks, max_gap=8, max_count=11)) == 2
+    assert len(mbus.plan_reads(blocks, max_gap=-1)) == 2       # --- -1: one request per block
+    assert len(mbus.plan_reads([("a", 100, 4), ("b", 104, 2)], max_gap=0)) == 1  # --- adjacent blocks
+
+
+def test_split_span_reads_every_block_once():
+    span = mbus.plan_reads([("a", 100, 4), ("b", 110, 2), ("c", 113, 3)], max_gap=8)[0]
+    assert (span.addr, span.count) == (100, 16)
+    assert [(split.addr, split.count, split.blocks) for split in mbus.split_span(span)] == \
+        [(100, 4, (("a", 100, 4),)), (110, 2, (("b", 110, 2),)), (113, 3, (("c", 113, 3),))]
+
+
+def test_marstek_plan_covers_every_block():
+    blocks = batt.marstek_register_blocks()
+    spans = mbus.plan_reads(blocks, batt.MODBUS_READ_GAP, batt.MODBUS_READ_MAX)
+    assert sorted(block for span in spans for block in span.blocks) == sorted(blocks)
+    assert all(span.count <= batt.MODBUS_READ_MAX for span in spans)
+    assert len(spans) < len(blocks)
+    for span in spans:
+        for _, addr, count in span.blocks:
+            assert span.addr <= addr and addr + count <= span.addr + span.count
+
+
+class Response:
+    def __init__(self, registers=None, error=False):
+        self.registers = registers
+        self.error = error
+
+    def isError(self):
+        return self.error
+
+
+class SplittingBus:
+    """Rejects a read over more than one block (like a device with unmapped registers in the gap)"""
+
+    def __init__(self, blocks):
+        self.starts = {addr: count for _, addr, count in blocks}
+        self.reads = []
+
+    def read(self, address, count):
+        self.reads.append((address, count))
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(Response([0] * count) if self.starts.get(address) == count else Response(error=True))
+        return future
+
+
+def test_rejected_span_is_split_in_place(default_map):
+    blocks = batt.marstek_register_blocks()
+    entry = mbus.PollEntry(0, 1, 0, mbus.plan_reads(blocks, batt.MODBUS_READ_GAP, batt.MODBUS_READ_MAX))
+    merged = [span for span in entry.spans if len(span.blocks) > 1]
+    assert merged
+    bus = SplittingBus(blocks)
+
+    async def cycle():
+        await batt.complete_modbus_reads(bus, [(entry, span, bus.read(span.addr, span.count)) for span in entry.spans])
+
+    asyncio.run(cycle())
+    assert len(entry.spans) == len(blocks)     # --- the plan keeps one request per block from now on
+    bus.reads.clear()
+    asyncio.run(cycle())
+    assert sorted(bus.reads) == sorted((addr, count) for _, addr, count in blocks)
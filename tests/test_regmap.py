@@ -0,0 +1,52 @@
+"""
+test_regmap.py
+  regmap.select_dictionary / check_register_map and batt.select_register_map: one register map per firmware range
+"""
+
+import pytest
+import batt
+import regmap
+
+
+@pytest.mark.parametrize("fw_version, dictionary", [
+    (0.5, "ems_dict_v05.xlsx"),
+    (regmap.REGMAP_FW_V06 - 0.01, "ems_dict_v05.xlsx"),
+    (regmap.REGMAP_FW_V06, "ems_dict_v07.xlsx"),
+    (2.5, "ems_dict_v07.xlsx"),
+])
+def test_firmware_selects_its_dictionary(fw_version, dictionary):
+    assert regmap.select_dictionary(fw_version) == dictionary
+
+
+@pytest.mark.parametrize("dictionary", [dictionary for _, dictionary in regmap.REGMAP_FIRMWARE])
+def test_every_firmware_map_has_the_control_rows(dictionary):
+    names = [row[1] for row in regmap.load_register_map(dictionary)]
+    constants = batt.marstek_row_constants()
+    assert regmap.check_register_map(names, constants) == []
+    resolved = regmap.resolve_register_map(names, constants)
+    assert names[resolved["MRST_GET_INV_STATE"]] == "MRST_GET_INV_STATE"
+    assert names[resolved["MRST_SET_INV_STATE"]] == "MRST_SET_INV_STATE"
+
+
+def test_rows_are_resolved_by_name():
+    # --- A map with the rows elsewhere than in the default map is accepted, a missing row is reported
+    names = ["NAME", "MRST_B", "MRST_A_H", "MRST_A_L"]
+    assert regmap.resolve_register_map(names, {"MRST_A": 1, "MRST_B": 2}) == {"MRST_A": 2, "MRST_B": 1}
+    assert regmap.check_register_map(names, {"MRST_A": 1, "MRST_C": 3}) == ["MRST_C"]
+
+
+@pytest.mark.parametrize("fw_version, dictionary", [(0.9, "ems_dict_v05.xlsx"), (1.2, "ems_dict_v07.xlsx")])
+def test_batt_switches_to_the_firmware_map(default_map, fw_version, dictionary):
+    batt.MRST_STORE.conv[batt.MRST_FW_VERSION] = fw_version
+    changed = batt.select_register_map()
+    assert changed == (dictionary != regmap.REGMAP_DEFAULT)
+    assert batt.MRST_DICTIONARY == dictionary
+    assert batt.MRST_STORE.name[batt.MRST_SET_INV_STATE] == "MRST_SET_INV_STATE"
+    assert batt.MRST_STORE.addr[batt.MRST_SET_INV_STATE] == 42010
+    assert batt.write_cache.deadbands[batt.MRST_STORE.addr[batt.MRST_PWR_CHARGE]] == 10
+
+
+def test_unread_firmware_keeps_the_map(default_map):
+    batt.MRST_STORE.conv[batt.MRST_FW_VERSION] = 0.0
+    assert not batt.select_register_map()
+    assert batt.MRST_DICTIONARY == regmap.REGMAP_DEFAULT
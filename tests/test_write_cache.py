@@ -0,0 +1,106 @@
+"""
+test_write_cache.py
+  mbus.WriteCache deadband and batt.MarstekSetpoints: range check, failed transactions roll back the write cache
+"""
+
+import asyncio
+import struct
+
+import batt
+import mbus
+
+
+class FakeResponse:
+    def __init__(self, registers=None):
+        self.registers = registers or []
+
+    def isError(self):
+        return False
+
+
+class FakeBus:
+    """Completes every request at once: writes are acknowledged (or fail with fail[address]), reads return the last write"""
+
+    def __init__(self, fail=None):
+        self.fail = fail or {}
+        self.device = {}
+        self.writes = []
+
+    def done(self, result):
+        future = asyncio.get_running_loop().create_future()
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+        return future
+
+    def write_many(self, address, values):
+        self.writes.append((address, list(values)))
+        if address in self.fail:
+            return self.done(self.fail[address])
+        for offset, value in enumerate(values):
+            self.device[address + offset] = value
+        return self.done(FakeResponse())
+
+    def write(self, address, value):
+        return self.write_many(address, [value])
+
+    def read(self, address, count, priority=None):
+        return self.done(FakeResponse([self.device.get(address + offset, 0) for offset in range(count)]))
+
+
+def test_deadband_skips_small_changes():
+    cache = mbus.WriteCache({100: 10})
+    assert cache.needed(100, 500)           # --- nothing confirmed yet
+    cache.confirm(100, 500)
+    assert not cache.needed(100, 510)
+    assert not cache.needed(100, 490)
+    assert cache.needed(100, 511)
+    assert cache.needed(101, 500)           # --- no deadband: every change is written
+    cache.confirm(101, 500)
+    assert not cache.needed(101, 500)
+    assert cache.needed(101, 501)
+    assert cache.skipped == 3
+    cache.forget(100)
+    assert cache.needed(100, 500)
+
+
+def test_out_of_range_setpoint_is_dropped(default_map):
+    setpoints = batt.MarstekSetpoints()
+    setpoints.set(batt.MRST_PWR_DISCHARGE, -5)
+    setpoints.set(batt.MRST_PWR_CHARGE, 70000)
+    setpoints.set(batt.MRST_RTU_MODE, 0x55AA)
+    assert setpoints.changes == {batt.MRST_RTU_MODE: 0x55AA}
+
+
+def test_failed_transaction_rolls_back_the_cache(default_map):
+    # --- The first block is written, the second fails with an encoding error: commit reports it (no exception)
+    # --- and no register of the transaction stays confirmed
+    rtu_addr = batt.MRST_STORE.addr[batt.MRST_RTU_MODE]
+    charge_addr = batt.MRST_STORE.addr[batt.MRST_PWR_CHARGE]
+    bus = FakeBus(fail={charge_addr: struct.error("ushort format requires 0 <= number <= 65535")})
+    setpoints = batt.MarstekSetpoints()
+    setpoints.set(batt.MRST_RTU_MODE, 0x55AA)
+    setpoints.set(batt.MRST_PWR_CHARGE, 800)
+    assert not asyncio.run(setpoints.commit(bus))
+    assert [address for address, _ in bus.writes] == [rtu_addr, charge_addr]
+    assert rtu_addr not in batt.write_cache.confirmed
+    assert charge_addr not in batt.write_cache.confirmed
+
+    # --- The next tick writes both again
+    bus.fail = {}
+    setpoints.set(batt.MRST_RTU_MODE, 0x55AA)
+    setpoints.set(batt.MRST_PWR_CHARGE, 800)
+    assert asyncio.run(setpoints.commit(bus))
+    assert batt.write_cache.confirmed[rtu_addr] == 0x55AA
+    assert batt.write_cache.confirmed[charge_addr] == 800
+
+
+def test_confirmed_setpoint_within_the_deadband_is_not_written(default_map):
+    bus = FakeBus()
+    setpoints = batt.MarstekSetpoints()
+    setpoints.set(batt.MRST_PWR_DISCHARGE, 600)
+    assert asyncio.run(setpoints.commit(bus))
+    setpoints.set(batt.MRST_PWR_DISCHARGE, 605)
+    assert asyncio.run(setpoints.commit(bus))
+    assert len(bus.writes) == 1